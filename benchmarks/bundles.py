@@ -0,0 +1,123 @@
+"""
+Benchmark: moving many small images one request per file versus in bundles.
+
+Starts the server on loopback in a temporary directory and uploads, then downloads, a few thousand thumbnails
+of 5 to 50 KB, first with pipelined PUT and GET requests, then with MPUT and MGET bundles, each over a
+fresh connection. Reports the files and megabytes per second of each, as the client sees it.
+Run with the package importable as file_service:
+
+    python benchmarks/bundles.py [--count 2000] [--bundle-size 500]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from socket import create_connection, create_server
+from typing import Callable
+
+import file_service
+from file_service.client import commands
+from file_service.client.pipeline import Operation
+from file_service.client.session import ClientSession
+from file_service.protocol.message import GET_VAL, PUT_VAL
+from file_service.utilities.debug import OFF_LEVEL, configure_logging
+
+_MIN_SIZE = 5 * 1024
+_MAX_SIZE = 50 * 1024
+_SERVER_START_TIMEOUT = 10.0  # Seconds
+
+
+def start_server(directory: str) -> tuple[subprocess.Popen[bytes], int]:
+    """Start the server in directory on a free loopback port. Return it and its port, once it accepts clients."""
+    with create_server(("127.0.0.1", 0)) as probe:
+        port = probe.getsockname()[1]
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(file_service.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_parent, os.environ.get("PYTHONPATH")])))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "file_service.server.main", str(port), "--log-level", "off"],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except ConnectionRefusedError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start.")
+            time.sleep(0.05)
+
+
+def write_thumbnails(directory: str, prefix: str, count: int) -> list[str]:
+    """Write count images of random content and sizes between 5 and 50 KB. Return their paths."""
+    rng = random.Random(prefix)
+    filepaths = []
+    for i in range(count):
+        filepath = os.path.join(directory, f"{prefix}_{i:05}.jpg")
+        with open(filepath, "wb") as f:
+            f.write(rng.randbytes(rng.randint(_MIN_SIZE, _MAX_SIZE)))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def run_pipelined(session: ClientSession, command: str, file_strs: list[str]) -> bool:
+    """Run a command for each file over a session, pipelined. Return whether all succeeded."""
+    return all(result.success for result in session.run_pipelined(Operation(command, f) for f in file_strs))
+
+
+def run_bundled(session_fn: Callable[[list[str]], bool], file_strs: list[str], bundle_size: int) -> bool:
+    """Pass the files to a session's bundle command, bundle_size at a time. Return whether all succeeded."""
+    results = [session_fn(file_strs[i:i + bundle_size]) for i in range(0, len(file_strs), bundle_size)]
+    return all(results)
+
+
+def measure(port: int, run_fn: Callable[[ClientSession], bool]) -> float:
+    """Return the seconds run_fn takes over a fresh connection. Raise RuntimeError if it fails."""
+    with ClientSession("127.0.0.1", port) as session:
+        start = time.perf_counter()
+        if not run_fn(session):
+            raise RuntimeError("Some transfers failed.")
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare one request per file with bundles.")
+    parser.add_argument("--count", type=int, default=2000, help="Number of files moved each way")
+    parser.add_argument("--bundle-size", type=int, default=500, help="Files per MPUT or MGET request")
+    args = parser.parse_args()
+    configure_logging(OFF_LEVEL)
+    commands.set_local_cache(None)  # Every GET transfers the file, as MGET does.
+
+    with tempfile.TemporaryDirectory() as server_directory, tempfile.TemporaryDirectory() as client_directory:
+        server, port = start_server(server_directory)
+        os.chdir(client_directory)  # Downloads are saved in the working directory.
+        try:
+            upload_directory = os.path.join(client_directory, "uploads")
+            os.mkdir(upload_directory)
+            print(f"{'Transfer':<16} {'Files/s':>9} {'MB/s':>8}")
+            for bundled in (False, True):
+                mode = "bundled" if bundled else "pipelined"
+                filepaths = write_thumbnails(upload_directory, mode, args.count)
+                filenames = [os.path.basename(filepath) for filepath in filepaths]
+                megabytes = sum(os.path.getsize(filepath) for filepath in filepaths) / 1e6
+                if bundled:
+                    put_elapsed = measure(port, lambda s: run_bundled(s.mput, filepaths, args.bundle_size))
+                    get_elapsed = measure(port, lambda s: run_bundled(s.mget, filenames, args.bundle_size))
+                else:
+                    put_elapsed = measure(port, lambda s: run_pipelined(s, PUT_VAL, filepaths))
+                    get_elapsed = measure(port, lambda s: run_pipelined(s, GET_VAL, filenames))
+                for command, elapsed in (("PUT", put_elapsed), ("GET", get_elapsed)):
+                    print(f"{mode + ' ' + command:<16} {args.count / elapsed:>9.0f} {megabytes / elapsed:>8.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: bytes on the wire and CPU cost of compressing each type of message, per codec.
+
+Encodes typical messages in the binary wire format and frames them as a connection that negotiated each codec
+would, applying the adaptive policy that leaves small messages, JPEG data and data that does not compress as they
+are. Reports the bytes sent, and the CPU time spent compressing on the sender and decompressing on the receiver,
+per message.
+Run with the package importable as file_service:
+
+    python benchmarks/compression.py
+"""
+import os
+import struct
+import time
+import zlib
+from functools import partial
+from typing import Callable
+
+from file_service.protocol import compression, message as message_protocol, socket as socket_protocol
+from file_service.protocol.compression import CODECS
+from file_service.protocol.message import BINARY_FORMAT, GET_VAL, LIST_VAL, OK_VAL, PUT_VAL
+from file_service.protocol.socket import EncodedMessage
+from file_service.utilities.message import is_worth_compressing
+
+_REPETITIONS = 20
+_KIB = 1024
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def _png(width: int, height: int, compression_level: int, noisy: bool = False) -> bytes:
+    """
+    Return an RGB PNG of a gradient, or of noise, like a photo, which does not compress.
+    Its pixel data is deflated at a compression level; 0 stores it as it is.
+    """
+    row = bytes(x * 255 // width for x in range(width) for _ in range(3))
+    pixels = b"".join(b"\x00" + (os.urandom(len(row)) if noisy else row) for _ in range(height))
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b"tEXt", b"Comment\x00" + b"Exported by an image editor. " * 64),
+        _png_chunk(b"IDAT", zlib.compress(pixels, compression_level)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+
+def _messages() -> dict[str, EncodedMessage]:
+    """Return a typical message of each type, encoded in the binary wire format."""
+    def construct(**kwargs) -> EncodedMessage:  # type: ignore
+        return message_protocol.construct_payload(wire_format=BINARY_FORMAT, **kwargs)
+
+    names = [f"holiday_{i // 100:04}_photo_{i:06}.jpg" for i in range(10_000)]
+    return {
+        "PUT response": construct(command=PUT_VAL, status=OK_VAL, filename="photo_000001.jpg"),
+        "LIST page (1000 names)": construct(command=LIST_VAL, status=OK_VAL, details="\n".join(names[:1000])),
+        "LIST unpaged (10000 names)": construct(command=LIST_VAL, status=OK_VAL, details="\n".join(names)),
+        "GET JPEG (256 KiB)": construct(
+            command=GET_VAL, status=OK_VAL, filename="photo.jpg", file_data=os.urandom(256 * _KIB)
+        ),
+        "GET PNG photo, deflated": construct(
+            command=GET_VAL, status=OK_VAL, filename="photo.png", file_data=_png(256, 256, 6, noisy=True)
+        ),
+        "GET PNG, deflated": construct(
+            command=GET_VAL, status=OK_VAL, filename="diagram.png", file_data=_png(256, 256, 9)
+        ),
+        "GET PNG, stored": construct(
+            command=GET_VAL, status=OK_VAL, filename="diagram.png", file_data=_png(256, 256, 0)
+        ),
+    }
+
+
+def _cpu_time_ms(fn: Callable[[], object]) -> float:
+    """Return the mean CPU time in milliseconds of calling a function."""
+    start = time.process_time()
+    for _ in range(_REPETITIONS):
+        fn()
+    return (time.process_time() - start) / _REPETITIONS * 1000
+
+
+def measure(message: EncodedMessage, codec: str | None) -> tuple[int, float, float]:
+    """Return the bytes on the wire, and the compression and decompression CPU times in milliseconds, of a message."""
+    if codec is None:
+        return sum(map(len, socket_protocol.frame_message(message))), 0.0, 0.0
+    compress_fn = partial(compression.compress, codec=codec if is_worth_compressing(message) else None)
+    header, data = socket_protocol.frame_message(message, compress_fn)
+    flag = header[-1]
+    max_size = socket_protocol.get_max_payload_size()
+    compress_time = _cpu_time_ms(lambda: socket_protocol.frame_message(message, compress_fn))
+    decompress_time = _cpu_time_ms(lambda: compression.decompress(flag, data, max_size))
+    return len(header) + len(data), compress_time, decompress_time
+
+
+def main() -> None:
+    print(f"{'Message':<28} {'Codec':<6} {'Wire bytes':>10} {'Ratio':>6} {'Compress (ms)':>13} {'Decompress (ms)':>15}")
+    for name, message in _messages().items():
+        uncompressed_size, _, _ = measure(message, None)
+        for codec in (None, *CODECS):
+            size, compress_time, decompress_time = measure(message, codec)
+            print(
+                f"{name:<28} {codec or 'none':<6} {size:>10} {size / uncompressed_size:>6.2f} "
+                f"{compress_time:>13.3f} {decompress_time:>15.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark: PUT throughput with uploads left to the operating system, synced one at a time, or group-committed.
+
+Starts the server on loopback in a temporary directory once per durability mode, and uploads the same number of
+small images over many concurrent connections. Reports PUTs per second and the median and 99th percentile latency
+of each mode, as the client sees it. The temporary directories are created in --directory, which should be on the
+disk under test: syncing costs nothing on a filesystem in memory, such as tmpfs.
+Run with the package importable as file_service:
+
+    python benchmarks/durability.py [--count 2000] [--clients 32] [--windows 0 1 5] [--directory .]
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from socket import IPPROTO_TCP, TCP_NODELAY, create_connection, create_server
+
+import file_service
+from file_service.client.session import ClientSession
+from file_service.utilities.debug import OFF_LEVEL, configure_logging
+from file_service.utilities.durability import DURABILITY_FSYNC, DURABILITY_GROUP, DURABILITY_OFF
+
+_FILE_SIZE = 16 * 1024
+_SERVER_START_TIMEOUT = 10.0  # Seconds
+
+
+def start_server(directory: str, server_args: list[str]) -> tuple[subprocess.Popen[bytes], int]:
+    """Start the server in directory on a free loopback port. Return it and its port, once it accepts clients."""
+    with create_server(("127.0.0.1", 0)) as probe:
+        port = probe.getsockname()[1]
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(file_service.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_parent, os.environ.get("PYTHONPATH")])))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "file_service.server.main", str(port), "--log-level", "off", *server_args],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except ConnectionRefusedError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start.")
+            time.sleep(0.05)
+
+
+def write_uploads(directory: str, count: int) -> list[str]:
+    """Write count images of random content. Return their paths."""
+    rng = random.Random(0)
+    filepaths = []
+    for i in range(count):
+        filepath = os.path.join(directory, f"upload_{i:05}.jpg")
+        with open(filepath, "wb") as f:
+            f.write(rng.randbytes(_FILE_SIZE))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def upload(port: int, filepaths: list[str], latencies: list[float]) -> None:
+    """Upload files one at a time over a connection, appending the latency of each PUT in seconds to latencies."""
+    with ClientSession("127.0.0.1", port) as session:
+        # Otherwise most of each PUT is spent waiting for a delayed acknowledgement, hiding the cost of syncing.
+        session.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        for filepath in filepaths:
+            start = time.perf_counter()
+            if not session.put(filepath):
+                raise RuntimeError(f"Uploading '{filepath}' failed.")
+            latencies.append(time.perf_counter() - start)
+
+
+def measure(server_args: list[str], filepaths: list[str], clients: int, directory: str) -> tuple[float, list[float]]:
+    """
+    Upload files over clients concurrent connections to a fresh server started with server_args.
+    Return the seconds the uploads took and the latency of each.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as server_directory:
+        server, port = start_server(server_directory, server_args)
+        try:
+            latencies: list[float] = []
+            threads = [
+                threading.Thread(target=upload, args=(port, filepaths[i::clients], latencies))
+                for i in range(clients)
+            ]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+    if len(latencies) != len(filepaths):
+        raise RuntimeError("Some uploads failed.")
+    return elapsed, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare PUT throughput across durability modes.")
+    parser.add_argument("--count", type=int, default=2000, help="Number of files uploaded per mode")
+    parser.add_argument("--clients", type=int, default=32, help="Number of concurrent connections")
+    parser.add_argument(
+        "--windows", type=float, nargs="+", default=[0.0, 1.0, 5.0], help="Group commit windows in ms to compare"
+    )
+    parser.add_argument("--directory", default=".", help="Where the server stores files, on the disk under test")
+    args = parser.parse_args()
+    configure_logging(OFF_LEVEL)
+
+    modes = [(DURABILITY_OFF, []), (DURABILITY_FSYNC, ["--durability", DURABILITY_FSYNC])]
+    for window in args.windows:
+        server_args = ["--durability", DURABILITY_GROUP, "--group-commit-window", str(window)]
+        modes.append((f"{DURABILITY_GROUP} {window:g} ms", server_args))
+
+    with tempfile.TemporaryDirectory() as client_directory:
+        filepaths = write_uploads(client_directory, args.count)
+        print(f"{'Durability':<16} {'PUT/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for mode, server_args in modes:
+            elapsed, latencies = measure(server_args, filepaths, args.clients, args.directory)
+            percentiles = statistics.quantiles(latencies, n=100)
+            print(
+                f"{mode:<16} {args.count / elapsed:>8.0f} "
+                f"{statistics.median(latencies) * 1000:>8.2f} {percentiles[98] * 1000:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Microbenchmark: CPU time spent encoding a PUT request, before and after payloads were encoded only once.
+
+The "before" path reproduces the old behaviour, where validating the payload size pickled the whole
+payload and framing it pickled it again. Run with the package importable as file_service:
+
+    python benchmarks/encode_once.py
+"""
+import os
+import pickle
+import time
+from typing import Any, Callable
+
+from file_service.protocol import message as message_protocol, socket as socket_protocol
+from file_service.protocol.message import PUT_VAL
+
+_MEGABYTE = 1024 * 1024
+_SIZES_AND_REPEATS = [(1, 50), (10, 10), (100, 3)]  # (image size in MB, repetitions)
+
+
+def encode_put_before(file_data: bytes) -> bytes:
+    """Encode a PUT request the way construct_payload and frame_message used to: pickling twice."""
+    payload: dict[str, Any] = {
+        message_protocol.COMMAND_KEY: PUT_VAL,
+        message_protocol.FILENAME_KEY: "image.jpg",
+        message_protocol.DETAILS_KEY: None,
+        message_protocol.STATUS_KEY: None,
+        message_protocol.FILE_DATA_KEY: file_data,
+    }
+    if len(pickle.dumps(payload)) > socket_protocol.get_max_payload_size():  # Size validation.
+        raise message_protocol.SizeError("Payload too large.")
+    data = pickle.dumps(payload)  # Framing.
+    return len(data).to_bytes(4, "big") + data
+
+
+def encode_put_after(file_data: bytes) -> bytes:
+    """
+    Encode a PUT request with the current single-encoding path. The frame's header and payload are joined as the old
+    path joined them, so that both pay for the same copy and only the encoding differs.
+    """
+    message = message_protocol.construct_payload(command=PUT_VAL, filename="image.jpg", file_data=file_data)
+    return b"".join(socket_protocol.frame_message(message))
+
+
+def cpu_time_per_call(fn: Callable[[bytes], bytes], file_data: bytes, repeats: int) -> float:
+    """Return the mean CPU time in seconds of calling fn on file_data."""
+    start = time.process_time()
+    for _ in range(repeats):
+        fn(file_data)
+    return (time.process_time() - start) / repeats
+
+
+def main() -> None:
+    print(f"{'Image size':>10}  {'Before (ms)':>12}  {'After (ms)':>11}  {'Speed-up':>8}")
+    for size_mb, repeats in _SIZES_AND_REPEATS:
+        file_data = os.urandom(size_mb * _MEGABYTE)
+        before = cpu_time_per_call(encode_put_before, file_data, repeats)
+        after = cpu_time_per_call(encode_put_after, file_data, repeats)
+        print(f"{size_mb:>7} MB  {before * 1000:>12.2f}  {after * 1000:>11.2f}  {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
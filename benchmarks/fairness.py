@@ -0,0 +1,178 @@
+"""
+Benchmark: latency of small GETs from one client while another client bulk-uploads large images.
+
+Starts the server on loopback in a temporary directory once per scheduling setup. A bulk client uploads large
+images over many connections from one loopback address, while an interactive client on another address GETs a
+thumbnail again and again. Reports the thumbnail GET latency (p50/p99) and the bulk client's upload throughput,
+with no scheduling, with few bulk slots, and with the bulk client's rate limited.
+The bulk client's address must be routed to loopback, as all of 127.0.0.0/8 is on Linux.
+Run with the package importable as file_service:
+
+    python benchmarks/fairness.py [--bulk-connections 8] [--bulk-files 64] [--bulk-size 4] [--bulk-host 127.0.0.2]
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from socket import AF_INET, IPPROTO_TCP, SOCK_STREAM, TCP_NODELAY, create_connection, create_server, socket
+
+import file_service
+from file_service.client import commands
+from file_service.protocol.message import GET_VAL, PUT_VAL
+from file_service.utilities.debug import OFF_LEVEL, configure_logging
+
+_THUMBNAIL_SIZE = 20 * 1024
+_BYTES_PER_MIB = 1024 * 1024
+_SERVER_START_TIMEOUT = 10.0  # Seconds
+
+
+def start_server(directory: str, server_args: list[str]) -> tuple[subprocess.Popen[bytes], int]:
+    """Start the server in directory on a free loopback port. Return it and its port, once it accepts clients."""
+    with create_server(("127.0.0.1", 0)) as probe:
+        port = probe.getsockname()[1]
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(file_service.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_parent, os.environ.get("PYTHONPATH")])))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "file_service.server.main", str(port), "--log-level", "off", *server_args],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except ConnectionRefusedError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start.")
+            time.sleep(0.05)
+
+
+def connect(host: str, port: int) -> socket:
+    """Connect to the server on loopback from host, so that the server tells the connection's client by it."""
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.bind((host, 0))
+    sock.connect(("127.0.0.1", port))
+    # Otherwise a request may wait for a delayed acknowledgement, which would swamp the latency measured.
+    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    commands.negotiate_wire_format(sock)
+    return sock
+
+
+def write_images(directory: str, prefix: str, count: int, size: int) -> list[str]:
+    """Write count images of random content and size bytes. Return their paths."""
+    rng = random.Random(prefix)
+    filepaths = []
+    for i in range(count):
+        filepath = os.path.join(directory, f"{prefix}_{i:05}.jpg")
+        with open(filepath, "wb") as f:
+            f.write(rng.randbytes(size))
+        filepaths.append(filepath)
+    return filepaths
+
+
+def upload(host: str, port: int, filepaths: list[str]) -> None:
+    """Upload files one at a time over a connection from host."""
+    with connect(host, port) as sock:
+        for filepath in filepaths:
+            if not commands.handle_command(sock, PUT_VAL, lambda: filepath):
+                raise RuntimeError(f"Uploading '{filepath}' failed.")
+
+
+def download_until(port: int, filename: str, done: threading.Event, latencies: list[float]) -> None:
+    """GET a file over a connection from 127.0.0.1 until done is set, appending the latency of each in seconds."""
+    with connect("127.0.0.1", port) as sock:
+        while not done.is_set():
+            start = time.perf_counter()
+            if not commands.handle_command(sock, GET_VAL, lambda: filename):
+                raise RuntimeError(f"Downloading '{filename}' failed.")
+            latencies.append(time.perf_counter() - start)
+            os.remove(filename)
+
+
+def measure(
+    server_args: list[str],
+    thumbnail_path: str,
+    bulk_filepaths: list[str],
+    bulk_connections: int,
+    bulk_host: str,
+) -> tuple[list[float], float]:
+    """
+    Upload the bulk files over bulk_connections connections from bulk_host to a fresh server started with
+    server_args, while GETting the thumbnail from another address. Return the latency of each GET and the seconds
+    the bulk upload took.
+    """
+    with tempfile.TemporaryDirectory() as server_directory:
+        server, port = start_server(server_directory, server_args)
+        try:
+            upload("127.0.0.1", port, [thumbnail_path])
+            done = threading.Event()
+            latencies: list[float] = []
+            downloader = threading.Thread(
+                target=download_until, args=(port, os.path.basename(thumbnail_path), done, latencies)
+            )
+            uploaders = [
+                threading.Thread(target=upload, args=(bulk_host, port, bulk_filepaths[i::bulk_connections]))
+                for i in range(bulk_connections)
+            ]
+            downloader.start()
+            start = time.perf_counter()
+            for uploader in uploaders:
+                uploader.start()
+            for uploader in uploaders:
+                uploader.join()
+            elapsed = time.perf_counter() - start
+            done.set()
+            downloader.join()
+        finally:
+            server.terminate()
+            server.wait()
+    return latencies, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure small GETs while another client uploads in bulk.")
+    parser.add_argument("--bulk-connections", type=int, default=8, help="Connections the bulk client uploads over")
+    parser.add_argument("--bulk-files", type=int, default=64, help="Number of large images uploaded")
+    parser.add_argument("--bulk-size", type=float, default=4.0, help="Size of each large image in MiB")
+    parser.add_argument("--bulk-host", default="127.0.0.2", help="Loopback address the bulk client connects from")
+    parser.add_argument("--client-rate", type=float, default=32.0, help="Rate limit to compare, in MiB/s")
+    args = parser.parse_args()
+    configure_logging(OFF_LEVEL)
+    commands.set_local_cache(None)  # Every GET transfers the file.
+
+    setups = [
+        ("no scheduling", ["--bulk-slots", "0"]),
+        ("2 bulk slots", ["--bulk-slots", "2"]),
+        (f"{args.client_rate:g} MiB/s each", ["--bulk-slots", "0", "--client-rate", str(args.client_rate)]),
+    ]
+    with tempfile.TemporaryDirectory() as client_directory:
+        os.chdir(client_directory)  # Downloads are saved in the working directory.
+        upload_directory = os.path.join(client_directory, "uploads")
+        os.mkdir(upload_directory)
+        thumbnail_path = write_images(upload_directory, "thumbnail", 1, _THUMBNAIL_SIZE)[0]
+        bulk_size = int(args.bulk_size * _BYTES_PER_MIB)
+        bulk_filepaths = write_images(upload_directory, "bulk", args.bulk_files, bulk_size)
+        megabytes = args.bulk_files * bulk_size / 1e6
+
+        print(f"{'Scheduling':<18} {'GETs':>6} {'p50 ms':>8} {'p99 ms':>8} {'Bulk MB/s':>10}")
+        for setup, server_args in setups:
+            latencies, elapsed = measure(
+                server_args, thumbnail_path, bulk_filepaths, args.bulk_connections, args.bulk_host
+            )
+            percentiles = statistics.quantiles(latencies, n=100)
+            print(
+                f"{setup:<18} {len(latencies):>6} {statistics.median(latencies) * 1000:>8.2f} "
+                f"{percentiles[98] * 1000:>8.2f} {megabytes / elapsed:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Load test: throughput and latency of the real server under concurrent clients.
+
+Starts the server on loopback in a temporary directory holding a synthetic corpus of images of varied sizes,
+then drives it with each given number of concurrent clients, each a process with its own connection running a
+random mix of PUT, GET and LIST for a fixed time. Reports the throughput, the p50/p95/p99 latency of each command
+and the peak memory of the server's processes, and saves the results as JSON, so that runs of different commits can
+be compared. Run with the package importable as file_service:
+
+    python benchmarks/load_test.py [--clients 1 8 32] [--duration 10] [--mix put=1,get=8,list=1]
+        [--server-args="--engine asyncio --workers 4"] [--output results.json] [--compare baseline.json]
+
+Peak memory is sampled from /proc, so it is only reported on Linux.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from multiprocessing.synchronize import Barrier
+from socket import create_connection, create_server
+from typing import Any
+
+import file_service
+from file_service.client import commands
+from file_service.client.session import ClientSession
+from file_service.utilities.debug import OFF_LEVEL, configure_logging
+
+# Sizes in bytes of the images in the corpus, and how many of every 100 images have each size: mostly small images,
+# with a tail of large ones, as in a typical photo collection.
+_CORPUS_SIZES = ((16 * 1024, 50), (128 * 1024, 30), (1024 * 1024, 15), (4 * 1024 * 1024, 5))
+_UPLOADS_PER_CLIENT = 8  # Files each client uploads, each time under a new name, as the server never replaces one.
+_SERVER_START_TIMEOUT = 10.0  # Seconds
+_RSS_SAMPLE_INTERVAL = 0.1  # Seconds
+_COMMANDS = ("put", "get", "list")
+_PERCENTILES = (50, 95, 99)
+
+# A request made by a client: its command, its start offset in seconds, its latency in seconds, the bytes it
+# transferred and whether it succeeded.
+Sample = tuple[str, float, float, int, bool]
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    """Parse a mix of commands such as 'put=1,get=8,list=1' into the weight of each command."""
+    weights = {}
+    for part in mix.split(","):
+        command, _, weight = part.partition("=")
+        if command not in _COMMANDS or not weight.isdigit():
+            raise argparse.ArgumentTypeError(f"Invalid mix '{mix}': expected e.g. put=1,get=8,list=1.")
+        weights[command] = int(weight)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError(f"Invalid mix '{mix}': at least one command needs a weight.")
+    return weights
+
+
+def write_corpus(directory: str, count: int, seed: int) -> dict[str, int]:
+    """Write count images of random content and varied sizes into directory. Return the size of each by name."""
+    rng = random.Random(seed)
+    sizes, weights = zip(*_CORPUS_SIZES)
+    corpus = {}
+    for i in range(count):
+        filename = f"image_{i:05}.jpg"
+        size = rng.choices(sizes, weights)[0]
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(rng.randbytes(size))  # Incompressible, as the content of real JPEGs is.
+        corpus[filename] = size
+    return corpus
+
+
+def run_client(
+    client_index: int,
+    port: int,
+    corpus: dict[str, int],
+    weights: dict[str, int],
+    duration: float,
+    seed: int,
+    start_barrier: Barrier,
+    results: "multiprocessing.Queue[list[Sample]]",
+) -> None:
+    """
+    Run a random mix of commands over one connection for duration seconds, once every client is connected.
+    Put the list of the samples of its requests on results.
+    """
+    configure_logging(OFF_LEVEL)
+    commands.set_local_cache(None)  # Every GET transfers the file, as a client without the file would.
+    sys.stdout = open(os.devnull, "w")  # Listings are printed in full.
+    rng = random.Random(seed + client_index)
+    filenames = list(corpus)
+    command_names, command_weights = zip(*weights.items())
+    samples: list[Sample] = []
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # Downloads are saved in the working directory.
+        upload_prefix = f"upload_{uuid.uuid4().hex[:8]}"  # Unique to the client, as earlier runs' uploads remain.
+        uploads = []
+        for i in range(_UPLOADS_PER_CLIENT):
+            filename = rng.choice(filenames)
+            upload_path = os.path.join(directory, f"{upload_prefix}_{i}.jpg")
+            with open(upload_path, "wb") as f:
+                f.write(rng.randbytes(corpus[filename]))
+            uploads.append(upload_path)
+        upload_count = len(uploads)
+
+        with ClientSession("127.0.0.1", port) as session:
+            start_barrier.wait()
+            start = time.perf_counter()
+            deadline = start + duration
+            while (request_start := time.perf_counter()) < deadline:
+                command = rng.choices(command_names, command_weights)[0]
+                if command == "put":
+                    index = rng.randrange(len(uploads))
+                    upload_path = os.path.join(directory, f"{upload_prefix}_{upload_count}.jpg")
+                    upload_count += 1
+                    os.rename(uploads[index], upload_path)
+                    uploads[index] = upload_path
+                    with open(upload_path, "r+b") as f:
+                        f.write(rng.randbytes(16))  # New content, so the server cannot reuse what it already stores.
+                    size = os.path.getsize(upload_path)
+                    ok = session.put(upload_path)
+                elif command == "get":
+                    filename = rng.choice(filenames)
+                    size = corpus[filename]
+                    ok = session.get(filename)
+                    if ok:
+                        os.remove(filename)  # A file already downloaded is not downloaded again.
+                else:
+                    size = 0
+                    ok = session.list_files()
+                latency = time.perf_counter() - request_start
+                samples.append((command, request_start - start, latency, size, ok))
+    results.put(samples)
+
+
+def get_process_tree_rss(pid: int) -> int:
+    """Return the resident memory in bytes of a process and all its descendants, or 0 if it has exited."""
+    total = 0
+    pending = [pid]
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending += [int(child) for child in f.read().split()]
+        except (FileNotFoundError, ProcessLookupError):
+            pass  # Exited while being sampled.
+    return total
+
+
+class RssSampler:
+    """Samples the memory of the server's processes in the background, keeping the peak."""
+
+    def __init__(self, pid: int) -> None:
+        self._pid = pid
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(_RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, get_process_tree_rss(self._pid))
+
+
+def start_server(directory: str, server_args: list[str]) -> tuple[subprocess.Popen[bytes], int]:
+    """Start the server in directory on a free loopback port. Return it and its port, once it accepts clients."""
+    with create_server(("127.0.0.1", 0)) as probe:
+        port = probe.getsockname()[1]
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(file_service.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_parent, os.environ.get("PYTHONPATH")])))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "file_service.server.main", str(port), "--log-level", "error", *server_args],
+        cwd=directory,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while True:
+        try:
+            create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except ConnectionRefusedError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start.")
+            time.sleep(0.05)
+
+
+def stop_server(server: subprocess.Popen[bytes]) -> None:
+    """Stop the server, with SIGTERM where there is one, on which a supervisor stops its workers gracefully."""
+    server.terminate()
+    try:
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of sorted values."""
+    index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+    return sorted_values[int(index)]
+
+
+def summarize(samples: list[Sample], duration: float) -> dict[str, Any]:
+    """Return the throughput and latency in milliseconds of the given samples, overall and per command."""
+
+    def describe(command_samples: list[Sample]) -> dict[str, Any]:
+        latencies = sorted(sample[2] * 1000 for sample in command_samples)
+        successes = [sample for sample in command_samples if sample[4]]
+        summary: dict[str, Any] = {
+            "requests": len(command_samples),
+            "errors": len(command_samples) - len(successes),
+            "requests_per_second": round(len(command_samples) / duration, 1),
+            "megabytes_per_second": round(sum(sample[3] for sample in successes) / duration / 1e6, 2),
+        }
+        if latencies:
+            summary["latency_ms"] = {
+                "mean": round(sum(latencies) / len(latencies), 3),
+                **{f"p{p}": round(percentile(latencies, p), 3) for p in _PERCENTILES},
+                "max": round(latencies[-1], 3),
+            }
+        return summary
+
+    by_command = {command: [sample for sample in samples if sample[0] == command] for command in _COMMANDS}
+    return {
+        **describe(samples),
+        "commands": {command: describe(by_command[command]) for command in _COMMANDS if by_command[command]},
+    }
+
+
+def run_load(
+    port: int,
+    server_pid: int,
+    clients: int,
+    corpus: dict[str, int],
+    args: argparse.Namespace,
+) -> dict[str, Any]:
+    """Drive the server with clients concurrent clients. Return their summarized results."""
+    context = multiprocessing.get_context("spawn")  # Clients start fresh, rather than with the benchmark's state.
+    start_barrier = context.Barrier(clients + 1)
+    results: "multiprocessing.Queue[list[Sample]]" = context.Queue()
+    processes = [
+        context.Process(
+            target=run_client,
+            args=(i, port, corpus, args.mix, args.duration, args.seed, start_barrier, results),
+        )
+        for i in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    start_barrier.wait()
+    with RssSampler(server_pid) as sampler:
+        samples = [sample for _ in processes for sample in results.get()]
+    for process in processes:
+        process.join()
+    summary = {"clients": clients, **summarize(samples, args.duration)}
+    summary["peak_server_rss_mib"] = round(sampler.peak / 1024 / 1024, 1) if sampler.peak else None
+    return summary
+
+
+def get_commit() -> str | None:
+    """Return the commit checked out in the repository of the benchmark, if it is one."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(runs: list[dict[str, Any]], baseline_runs: list[dict[str, Any]] | None) -> None:
+    """
+    Print a line per run and command. Under each, print the change from the run of the baseline with as many
+    clients, if there is one.
+    """
+    baseline_by_clients = {run["clients"]: run for run in baseline_runs or []}
+    print(f"{'Clients':>7} {'Command':<7} {'Req/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'Errors':>6} {'RSS MiB':>8}")
+    for run in runs:
+        baseline_run = baseline_by_clients.get(run["clients"], {})
+        for command, summary in [("all", run), *run["commands"].items()]:
+            latency = summary.get("latency_ms", {})
+            rss = run["peak_server_rss_mib"] if command == "all" else None
+            print(
+                f"{run['clients']:>7} {command:<7} {summary['requests_per_second']:>9.1f} "
+                f"{summary['megabytes_per_second']:>8.2f} "
+                + " ".join(f"{latency.get(f'p{p}', 0):>8.2f}" for p in _PERCENTILES)
+                + f" {summary['errors']:>6} {rss or '':>8}"
+            )
+            baseline = baseline_run if command == "all" else baseline_run.get("commands", {}).get(command)
+            if baseline:
+                baseline_latency = baseline.get("latency_ms", {})
+                latency_changes = [_change(latency.get(f"p{p}"), baseline_latency.get(f"p{p}")) for p in _PERCENTILES]
+                print(
+                    f"{'':>7} {'':<7} {_change(summary['requests_per_second'], baseline['requests_per_second']):>9} "
+                    f"{_change(summary['megabytes_per_second'], baseline['megabytes_per_second']):>8} "
+                    + " ".join(f"{change:>8}" for change in latency_changes)
+                )
+
+
+def _change(value: float | None, baseline: float | None) -> str:
+    """Return the relative change from baseline to value, e.g. '+12.5%', or nothing if either is missing."""
+    if not value or not baseline:
+        return ""
+    return f"{(value - baseline) / baseline:+.1%}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the server on loopback.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="Numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each number of clients runs for")
+    parser.add_argument("--mix", type=parse_mix, default="put=1,get=8,list=1", help="Weights of the commands")
+    parser.add_argument("--corpus", type=int, default=200, help="Number of images stored before the test")
+    parser.add_argument("--server-args", type=shlex.split, default=[], help="Options passed on to the server")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the corpus and of the clients' choices")
+    parser.add_argument("--output", help="File to save the results in as JSON")
+    parser.add_argument("--compare", help="Results saved by an earlier run, e.g. of another commit, to compare with")
+    args = parser.parse_args()
+    baseline_runs = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_runs = json.load(f)["runs"]
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = write_corpus(directory, args.corpus, args.seed)
+        server, port = start_server(directory, args.server_args)
+        try:
+            for clients in args.clients:
+                print(f"Running {clients} clients for {args.duration:g} s...", file=sys.stderr)
+                runs.append(run_load(port, server.pid, clients, corpus, args))
+        finally:
+            stop_server(server)
+
+    print_results(runs, baseline_runs)
+    if args.output:
+        results = {
+            "commit": get_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "duration": args.duration,
+                "mix": args.mix,
+                "corpus": args.corpus,
+                "server_args": args.server_args,
+                "seed": args.seed,
+            },
+            "runs": runs,
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Microbenchmark: CPU time the receive loop spends on debug logging while it is turned off.
+
+Receives many small messages over loopback with a copy of the loop that does not log at all, with the old loop,
+which built its debug messages with f-strings (including str(sock)) on every call and every recv_into(),
+and with the current loop at the default log level. Run with the package importable as file_service:
+
+    python benchmarks/logging_overhead.py
+"""
+import threading
+import time
+from socket import socket, create_server, create_connection
+from typing import Callable
+
+from file_service.utilities import socket as socket_utilities
+from file_service.utilities.debug import print_debug
+
+_MESSAGE_SIZE = 4  # Bytes, as small as a frame header, so that the receive loop's own cost dominates.
+_MESSAGE_COUNT = 200_000
+_REPETITIONS = 3
+
+
+def receive_without_logging(sock: socket, buffer: memoryview) -> None:
+    """Fill a buffer the way receive_data_into does, without any logging."""
+    max_byte_count = len(buffer)
+    received_byte_count = 0
+    while received_byte_count < max_byte_count:
+        packet_size = sock.recv_into(buffer[received_byte_count:], max_byte_count - received_byte_count)
+        if not packet_size:
+            raise ConnectionError("Connection closed.")
+        received_byte_count += packet_size
+
+
+def receive_before(sock: socket, buffer: memoryview) -> None:
+    """Fill a buffer the way receive_data_into used to, formatting every debug message eagerly."""
+    max_byte_count = len(buffer)
+    print_debug(
+        f"Receiving {max_byte_count} bytes from the socket..."
+        f"\n\tSocket: {sock}."
+    )
+    received_byte_count = 0
+    while received_byte_count < max_byte_count:
+        leftover_bytes = max_byte_count - received_byte_count
+        print_debug(
+            "Calling recv_into()..."
+            f"\n\tLeftover bytes: {leftover_bytes}"
+        )
+        packet_size = sock.recv_into(buffer[received_byte_count:], leftover_bytes)
+        if not packet_size:
+            print_debug("The next packet is empty, indicating the connection closed.")
+            raise ConnectionError("Connection closed.")
+        received_byte_count += packet_size
+    print_debug("Received all bytes from the socket.")
+
+
+def cpu_time_per_call(receive_fn: Callable[[socket, memoryview], None]) -> float:
+    """Return the mean CPU time in microseconds of receiving one message with receive_fn over loopback."""
+    payload = bytes(_MESSAGE_SIZE * _MESSAGE_COUNT)
+    buffer = memoryview(bytearray(_MESSAGE_SIZE))
+    with create_server(("127.0.0.1", 0)) as listening_socket:
+        sending_socket = create_connection(listening_socket.getsockname())
+        receiving_socket, _ = listening_socket.accept()
+    with receiving_socket, sending_socket:
+        # Sent up front, so that each message is received with a single recv_into() and the sender costs nothing.
+        sender = threading.Thread(target=socket_utilities.send_data, args=(sending_socket, payload))
+        sender.start()
+        time.sleep(0.5)
+        start = time.thread_time()
+        for _ in range(_MESSAGE_COUNT):
+            receive_fn(receiving_socket, buffer)
+        elapsed = time.thread_time() - start
+        sender.join()
+    return elapsed / _MESSAGE_COUNT * 1_000_000
+
+
+def main() -> None:
+    print(f"{'Receive loop':<24} {'Per call (µs)':>14}")
+    for name, receive_fn in [
+        ("no logging", receive_without_logging),
+        ("before (eager f-strings)", receive_before),
+        ("after (lazy, level off)", socket_utilities.receive_data_into),
+    ]:
+        # Take the best of a few runs, as scheduling adds noise.
+        call_time = min(cpu_time_per_call(receive_fn) for _ in range(_REPETITIONS))
+        print(f"{name:<24} {call_time:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark: throughput of receiving large payloads over loopback.
+
+Compares the current receive path, which fills one buffer with recv_into(), doubling it as it fills past the first
+megabyte, against the old path, which grew a bytes object with every packet. Run with the package importable as file_service:
+
+    python benchmarks/receive_throughput.py
+"""
+import os
+import threading
+import time
+from socket import socket, create_server, create_connection
+from typing import Callable
+
+from file_service.utilities import socket as socket_utilities
+
+_MEGABYTE = 1024 * 1024
+_SIZES_MB = [10, 50, 100]  # The old path is quadratic, so larger sizes take minutes.
+
+
+def receive_data_before(sock: socket, max_byte_count: int) -> bytes:
+    """Receive a fixed number of bytes the way receive_data used to: concatenating every packet."""
+    data = b""
+    while len(data) < max_byte_count:
+        packet = sock.recv(max_byte_count - len(data))
+        if not packet:
+            raise ConnectionError("Connection closed.")
+        data += packet
+    return data
+
+
+def receive_data_after(sock: socket, max_byte_count: int) -> bytes:
+    """Receive a fixed number of bytes with the current receive path."""
+    return bytes(socket_utilities.receive_data(sock, max_byte_count))
+
+
+def measure_throughput(receive_fn: Callable[[socket, int], bytes], payload: bytes) -> float:
+    """Return the throughput in MB/s of receiving payload over a loopback socket pair."""
+    with create_server(("127.0.0.1", 0)) as listening_socket:
+        sending_socket = create_connection(listening_socket.getsockname())
+        receiving_socket, _ = listening_socket.accept()
+    with receiving_socket, sending_socket:
+        sender = threading.Thread(target=socket_utilities.send_data, args=(sending_socket, payload))
+        start = time.perf_counter()
+        sender.start()
+        receive_fn(receiving_socket, len(payload))
+        elapsed = time.perf_counter() - start
+        sender.join()
+    return len(payload) / _MEGABYTE / elapsed
+
+
+def main() -> None:
+    print(f"{'Payload size':>12}  {'Before (MB/s)':>14}  {'After (MB/s)':>13}")
+    for size_mb in _SIZES_MB:
+        payload = os.urandom(size_mb * _MEGABYTE)
+        before = measure_throughput(receive_data_before, payload)
+        after = measure_throughput(receive_data_after, payload)
+        print(f"{size_mb:>9} MB  {before:>14.0f}  {after:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
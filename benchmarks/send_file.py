@@ -0,0 +1,66 @@
+"""
+Benchmark: CPU time spent by the sender of a streamed GET body over loopback.
+
+Compares the chunked path, which reads the file into a buffer and sends it from user space, against the
+sendfile path, which lets the kernel copy the file straight to the socket. The receiver drains the socket in
+another thread, so only the sending thread's CPU time is counted. Run with the package importable as file_service:
+
+    python benchmarks/send_file.py
+"""
+import os
+import tempfile
+import threading
+import time
+from io import BufferedReader
+from socket import socket, create_server, create_connection
+from typing import Callable
+
+from file_service.protocol import socket as socket_protocol
+from file_service.utilities import socket as socket_utilities
+
+_MEGABYTE = 1024 * 1024
+_SIZES_MB = [10, 100, 500]
+
+
+def send_chunked(sock: socket, file: BufferedReader, size: int) -> bool:
+    """Send a file through user space in bounded chunks, as streamed bodies were sent before sendfile."""
+    return socket_protocol.stream_body(file.readinto, lambda data: socket_utilities.send_data(sock, data), size)
+
+
+def drain(sock: socket, size: int) -> None:
+    """Receive and drop size bytes."""
+    buffer = memoryview(bytearray(socket_protocol.STREAM_CHUNK_SIZE))
+    remaining = size
+    while remaining:
+        remaining -= sock.recv_into(buffer, min(len(buffer), remaining))
+
+
+def measure(send_fn: Callable[[socket, BufferedReader, int], bool], filepath: str) -> tuple[float, float]:
+    """Return the sender's CPU time in milliseconds and the throughput in MB/s of sending a file over loopback."""
+    size = os.path.getsize(filepath)
+    with create_server(("127.0.0.1", 0)) as listening_socket:
+        sending_socket = create_connection(listening_socket.getsockname())
+        receiving_socket, _ = listening_socket.accept()
+    with receiving_socket, sending_socket, open(filepath, "rb") as file:
+        receiver = threading.Thread(target=drain, args=(receiving_socket, size))
+        receiver.start()
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        send_fn(sending_socket, file, size)
+        cpu_time, elapsed = time.thread_time() - cpu_start, time.perf_counter() - start
+        receiver.join()
+    return cpu_time * 1000, size / _MEGABYTE / elapsed
+
+
+def main() -> None:
+    print(f"{'File size':>9}  {'Chunked CPU (ms)':>16}  {'sendfile CPU (ms)':>17}  {'Chunked MB/s':>12}  {'sendfile MB/s':>13}")
+    for size_mb in _SIZES_MB:
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(os.urandom(size_mb * _MEGABYTE))
+            f.flush()
+            chunked_cpu, chunked_rate = measure(send_chunked, f.name)
+            sendfile_cpu, sendfile_rate = measure(socket_utilities.send_file, f.name)
+        print(f"{size_mb:>6} MB  {chunked_cpu:>16.1f}  {sendfile_cpu:>17.1f}  {chunked_rate:>12.0f}  {sendfile_rate:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark: cost of writing and looking up files as the number of stored files grows, per storage layout.
+
+Stores small files one by one with each backend in a temporary directory and, whenever the count reaches a
+checkpoint, reports the mean time of the writes since the previous checkpoint and of looking up stored and
+missing files. A flat cost down the table means the layout scales. Run with the package importable as
+file_service:
+
+    python benchmarks/storage_layout.py [--count 1000000] [--directory /path/on/the/target/filesystem]
+
+The default of one million files needs about a million free inodes per layout and several minutes.
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from file_service.utilities.storage_backends import LAYOUTS, StorageBackend, create_backend
+
+_DATA = b"\xff\xd8\xff\xe0" + bytes(60)  # A tiny JPEG-like file, so that the cost measured is the directory's.
+_LOOKUP_COUNT = 2000
+
+
+def _filename(i: int) -> str:
+    return f"image_{i:08}.jpg"
+
+
+def _checkpoints(count: int) -> list[int]:
+    """Return 1, 3 and 10 times each power of ten from 1000, up to count, and count itself."""
+    checkpoints = []
+    magnitude = 1000
+    while magnitude < count:
+        checkpoints += [c for c in (magnitude, 3 * magnitude) if c < count]
+        magnitude *= 10
+    return checkpoints + [count]
+
+
+def measure_lookups(backend: StorageBackend, stored_count: int) -> tuple[float, float]:
+    """Return the mean times in microseconds to look up a stored file and a missing file."""
+    names = [_filename(random.randrange(stored_count)) for _ in range(_LOOKUP_COUNT)]
+    start = time.perf_counter()
+    for name in names:
+        backend.stat(name)
+    hit_time = (time.perf_counter() - start) / _LOOKUP_COUNT
+
+    start = time.perf_counter()
+    for i in range(_LOOKUP_COUNT):
+        try:
+            backend.stat(_filename(stored_count + i))
+        except FileNotFoundError:
+            pass
+    miss_time = (time.perf_counter() - start) / _LOOKUP_COUNT
+    return hit_time * 1e6, miss_time * 1e6
+
+
+def run_layout(layout: str, count: int, parent_directory: str | None) -> None:
+    directory = tempfile.mkdtemp(prefix=f"storage-{layout}-", dir=parent_directory)
+    backend = create_backend(layout, directory)
+    try:
+        stored_count = 0
+        for checkpoint in _checkpoints(count):
+            start = time.perf_counter()
+            for i in range(stored_count, checkpoint):
+                backend.save(_filename(i), _DATA)
+            write_time = (time.perf_counter() - start) / (checkpoint - stored_count) * 1e6
+            stored_count = checkpoint
+
+            hit_time, miss_time = measure_lookups(backend, stored_count)
+            print(f"{layout:<8} {stored_count:>10} {write_time:>11.1f} {hit_time:>12.1f} {miss_time:>13.1f}", flush=True)
+    finally:
+        shutil.rmtree(directory)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--directory", default=None, help="Where to create the temporary storage directories.")
+    arguments = parser.parse_args()
+
+    print(f"{'Layout':<8} {'Files':>10} {'Write (us)':>11} {'Lookup (us)':>12} {'Missing (us)':>13}")
+    for layout in LAYOUTS:
+        run_layout(layout, arguments.count, arguments.directory)
+
+
+if __name__ == "__main__":
+    main()
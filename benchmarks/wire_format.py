@@ -0,0 +1,57 @@
+"""
+Benchmark: encoding and decoding cost of the pickle and binary wire formats.
+
+For a range of message types, reports the encoded size and the mean time to encode and decode a
+message in each format. Run with the package importable as file_service:
+
+    python benchmarks/wire_format.py
+"""
+import os
+import timeit
+from typing import Any
+
+from file_service.protocol import message as message_protocol
+from file_service.protocol.message import (
+    PUT_VAL,
+    GET_VAL,
+    LIST_VAL,
+    REQUEST_VAL,
+    OK_VAL,
+    ERROR_VAL,
+    PICKLE_FORMAT,
+    BINARY_FORMAT,
+)
+
+_MESSAGES: dict[str, dict[str, Any]] = {
+    "LIST request": dict(command=LIST_VAL, status=REQUEST_VAL),
+    "GET request": dict(command=GET_VAL, status=REQUEST_VAL, filename="holiday.jpg", stream=True),
+    "ERROR response": dict(command=GET_VAL, status=ERROR_VAL, filename="holiday.jpg", details="Cannot find 'holiday.jpg' on the server"),
+    "LIST response (1000 names)": dict(command=LIST_VAL, status=OK_VAL, details="\n".join(f"image_{i:06}.jpg" for i in range(1000))),
+    "Streamed GET response": dict(command=GET_VAL, status=OK_VAL, filename="holiday.jpg", file_size=4_000_000),
+    "PUT request (1 MB inline)": dict(command=PUT_VAL, status=REQUEST_VAL, filename="holiday.jpg", file_data=os.urandom(1024 * 1024)),
+}
+_REPEATS = 2000
+
+
+def measure(fields: dict[str, Any], wire_format: str) -> tuple[int, float, float]:
+    """Return the encoded size, and the mean encode and decode times in microseconds, of a message."""
+    message = message_protocol.construct_payload(wire_format=wire_format, **fields)
+    encode = message_protocol.get_encoder(wire_format)
+    decode = message_protocol.get_decoder(wire_format)
+    repeats = _REPEATS if message.size < 100_000 else _REPEATS // 20
+
+    encode_time = timeit.timeit(lambda: encode(message.payload), number=repeats) / repeats
+    decode_time = timeit.timeit(lambda: decode(message.data), number=repeats) / repeats
+    return message.size, encode_time * 1e6, decode_time * 1e6
+
+
+def main() -> None:
+    print(f"{'Message':<28} {'Format':<9} {'Bytes':>9} {'Encode (us)':>12} {'Decode (us)':>12}")
+    for name, fields in _MESSAGES.items():
+        for wire_format in (PICKLE_FORMAT, BINARY_FORMAT):
+            size, encode_time, decode_time = measure(fields, wire_format)
+            print(f"{name:<28} {wire_format:<9} {size:>9} {encode_time:>12.2f} {decode_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
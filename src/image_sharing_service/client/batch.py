@@ -0,0 +1,61 @@
+import os
+import time
+from typing import Iterable, Iterator
+
+from file_service.client.pipeline import DEFAULT_WINDOW, Operation
+from file_service.client.session import ClientSession
+from file_service.protocol.message import PUT_VAL, GET_VAL
+from file_service.utilities.debug import print_error
+
+BATCH_COMMAND = "BATCH"
+
+_MEGABYTE = 1024 * 1024
+
+
+def run_batch(session: ClientSession, lines: Iterable[str], window: int = DEFAULT_WINDOW) -> bool:
+    """
+    Run a batch of operations over one session, one per line as "<put|get|list> [<filename>]",
+    keeping up to window requests outstanding. Blank lines and lines starting with "#" are skipped.
+    Print a report for each operation and an aggregate summary. Return whether every operation succeeded.
+    """
+    start = time.perf_counter()
+    results = session.run_pipelined(parse_operations(lines), window)
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(result.success for result in results)
+    byte_count = sum(transferred_byte_count(result.operation) for result in results if result.success)
+    _print_batch_summary(succeeded, len(results) - succeeded, byte_count, elapsed)
+    return succeeded == len(results)
+
+
+def parse_operations(lines: Iterable[str]) -> Iterator[Operation]:
+    """Yield the operation on each line, skipping blank lines and lines starting with "#"."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        command, _, file_str = line.partition(" ")
+        yield Operation(command, file_str.strip())
+
+
+def transferred_byte_count(operation: Operation) -> int:
+    """Return the number of file bytes moved by a successful operation."""
+    command, file_str = operation
+    try:
+        if command.casefold() == PUT_VAL.casefold():
+            return os.path.getsize(file_str)
+        if command.casefold() == GET_VAL.casefold():
+            return os.path.getsize(os.path.basename(file_str))
+    except OSError as e:
+        print_error(f"Cannot measure the size of '{file_str}': {e}.")
+    return 0
+
+
+def _print_batch_summary(succeeded: int, failed: int, byte_count: int, elapsed: float) -> None:
+    """Print the aggregate outcome and throughput of a batch."""
+    total = succeeded + failed
+    elapsed = max(elapsed, 1e-9)
+    print(
+        f"Batch complete: {succeeded}/{total} succeeded, {failed} failed in {elapsed:.2f} s "
+        f"({total / elapsed:.1f} operations/s, {byte_count / _MEGABYTE / elapsed:.2f} MB/s)."
+    )
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from io import BufferedWriter
+
+from file_service.utilities.content_store import compute_digest
+from file_service.utilities.debug import print_debug, print_error
+
+# In the user's cache directory, so that downloads into any working directory share it.
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "image-sharing-service",
+)
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024  # Bytes
+_TEMPORARY_SUFFIX = ".tmp"
+
+
+class LocalCache:
+    """
+    A thread-safe, byte-bounded cache on disk of the files downloaded from servers, so that downloading one again
+    only asks the server whether it changed. Each file is kept under its server, its name and its ETag, the digest
+    the server gave its content. Copies are kept rather than links, so that editing a download cannot change the
+    cached file. The least recently used files are evicted once the cache outgrows its size; the size of files
+    cached by other processes meanwhile is only counted from the next eviction.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIRECTORY, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        if max_size < 0:
+            raise ValueError("Cache size must not be negative.")
+        self._directory = directory
+        self._max_size = max_size
+        self._size: int | None = None  # Counted the first time a file is cached
+        self._lock = threading.Lock()
+
+    def lookup(self, server: str, filename: str) -> str | None:
+        """Return the ETag of the copy of a server's file that is cached, or None if there is none."""
+        try:
+            names = os.listdir(self._entry_path(server, filename))
+        except FileNotFoundError:
+            return None
+        return next((name for name in names if not name.endswith(_TEMPORARY_SUFFIX)), None)
+
+    def restore(self, server: str, filename: str, etag: str, file: BufferedWriter) -> bool:
+        """Copy the cached copy of a server's file with an ETag into an open file. Return False if it is gone."""
+        cached_path = os.path.join(self._entry_path(server, filename), etag)
+        try:
+            with open(cached_path, "rb") as cached_file:
+                shutil.copyfileobj(cached_file, file)
+            os.utime(cached_path)  # Marks it as recently used.
+        except FileNotFoundError:
+            return False
+        print_debug("Restored '%s' from the local cache.\n\tETag: %s", filename, etag)
+        return True
+
+    def store(self, server: str, filename: str, etag: str, filepath: str) -> None:
+        """
+        Cache a copy of a file downloaded from a server with an ETag, replacing any copy with another ETag.
+        A copy whose content does not have the ETag as its digest is not cached, as it would be restored whenever
+        the server reports the file not modified.
+        """
+        size = os.path.getsize(filepath)
+        if size > self._max_size:
+            return
+        entry_path = self._entry_path(server, filename)
+        cached_path = os.path.join(entry_path, etag)
+        try:
+            os.makedirs(entry_path, exist_ok=True)
+            temporary_path = f"{cached_path}.{uuid.uuid4().hex}{_TEMPORARY_SUFFIX}"
+            shutil.copyfile(filepath, temporary_path)
+            with open(temporary_path, "rb") as f:
+                digest = compute_digest(f)
+            if digest != etag:
+                os.remove(temporary_path)
+                print_error(f"Cannot cache '{filename}': its content does not match its ETag.")
+                return
+            os.replace(temporary_path, cached_path)
+            replaced_size = self._remove_other_etags(entry_path, etag)
+        except OSError as e:
+            # Downloading goes on without the cache, which only saves bandwidth.
+            print_error(f"Cannot cache '{filename}': {e}.")
+            return
+        print_debug("Cached '%s'.\n\tETag: %s", filename, etag)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._count_size()
+            else:
+                self._size += size - replaced_size
+            if self._size > self._max_size:
+                self._evict()
+
+    def _entry_path(self, server: str, filename: str) -> str:
+        """Return the directory holding the cached copy of a server's file, named by a hash so any name is safe."""
+        return os.path.join(self._directory, hashlib.sha256(f"{server}/{filename}".encode()).hexdigest())
+
+    def _remove_other_etags(self, entry_path: str, etag: str) -> int:
+        """Remove the copies of a file cached with ETags other than etag. Return how many bytes they held."""
+        removed_size = 0
+        for name in os.listdir(entry_path):
+            if name != etag and not name.endswith(_TEMPORARY_SUFFIX):
+                path = os.path.join(entry_path, name)
+                try:
+                    removed_size += os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass  # Removed by another process
+        return removed_size
+
+    def _list_cached_files(self) -> list[tuple[float, int, str]]:
+        """Return the last use, size and path of every cached file."""
+        cached_files = []
+        for directory, _, names in os.walk(self._directory):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                cached_files.append((stat.st_mtime, stat.st_size, path))
+        return cached_files
+
+    def _count_size(self) -> int:
+        """Return the number of bytes cached. The lock must be held."""
+        return sum(size for _, size, _ in self._list_cached_files())
+
+    def _evict(self) -> None:
+        """Remove the least recently used files until the cache fits its size. The lock must be held."""
+        cached_files = sorted(self._list_cached_files())
+        self._size = sum(size for _, size, _ in cached_files)
+        evicted_count = 0
+        for _, size, path in cached_files:
+            if self._size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+            evicted_count += 1
+        print_debug("Evicted %d files from the local cache.", evicted_count)
@@ -1,5 +1,8 @@
 import sys
+from typing import Iterator
 
+from file_service.client.pipeline import DEFAULT_WINDOW
+from file_service.client.transfer import DEFAULT_CONNECTIONS
 from file_service.utilities.debug import print_debug
 
 
@@ -27,7 +30,56 @@ def get_command() -> str:
 
 
 def get_file_str() -> str:
-    """Retrieve the filename or filepath from command-line arguments."""
-    file_string = sys.argv[4]
+    """Retrieve the filename, filepath or listing prefix from command-line arguments. It is optional for LIST."""
+    file_string = sys.argv[4] if len(sys.argv) > 4 else ""
     print_debug(f"User inputted file string: {file_string}.")
     return file_string
+
+
+def get_file_strs() -> list[str]:
+    """Retrieve the filenames or filepaths of a command acting on many files from command-line arguments."""
+    file_strings = sys.argv[4:]
+    print_debug(f"User inputted file strings: {file_strings}.")
+    return file_strings
+
+
+def get_max_dimension() -> int | None:
+    """Retrieve the longest side in pixels of the variant a GET downloads from command-line arguments, if given."""
+    max_dimension = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    print_debug(f"User inputted max dimension: {max_dimension}.")
+    return max_dimension
+
+
+def get_similar_limit() -> int | None:
+    """Retrieve how many similar images a SIMILAR command finds from command-line arguments, if given."""
+    limit = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    print_debug(f"User inputted similar limit: {limit}.")
+    return limit
+
+
+def get_batch_operations() -> Iterator[str]:
+    """Yield the lines of the batch file named in the command-line arguments, or of stdin if it is "-"."""
+    batch_filepath = sys.argv[4] if len(sys.argv) > 4 else "-"
+    print_debug(f"User inputted batch file: {batch_filepath}.")
+    if batch_filepath == "-":
+        yield from sys.stdin
+        return
+    with open(batch_filepath) as f:
+        yield from f
+
+
+def get_window() -> int:
+    """
+    Retrieve the number of requests a batch, or each connection of a transfer, keeps outstanding
+    from the command-line arguments.
+    """
+    window = int(sys.argv[5]) if len(sys.argv) > 5 else DEFAULT_WINDOW
+    print_debug(f"User inputted window: {window}.")
+    return window
+
+
+def get_connections() -> int:
+    """Retrieve the number of parallel connections a transfer uses from the command-line arguments."""
+    connections = int(sys.argv[6]) if len(sys.argv) > 6 else DEFAULT_CONNECTIONS
+    print_debug(f"User inputted connections: {connections}.")
+    return connections
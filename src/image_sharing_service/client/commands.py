@@ -1,45 +1,160 @@
+import hashlib
+import json
 import os
+from functools import partial
 from socket import socket
-from typing import Callable, Any
+from io import BufferedReader
+from typing import Any, Callable, Iterator, NamedTuple
 
 from file_service.utilities import storage, message as message_utilities
 from file_service.protocol import message as message_protocol
+from file_service.protocol.bundle import ENTRY_ERROR, BundleError
 from file_service.protocol.message import (
     PUT_VAL,
     GET_VAL,
     LIST_VAL,
+    HELLO_VAL,
+    STATS_VAL,
+    MPUT_VAL,
+    MGET_VAL,
+    SIMILAR_VAL,
+    BINARY_FORMAT,
+    WIRE_FORMATS,
+    FEATURES,
+    FEATURES_KEY,
+    HASH_FIRST_FEATURE,
+    MISSING_VAL,
+    NOT_MODIFIED_VAL,
     FILE_DATA_KEY,
+    FILE_SIZE_KEY,
     STATUS_KEY,
     ERROR_VAL,
     DETAILS_KEY,
+    CURSOR_KEY,
+    OFFSET_KEY,
+    ENTRY_COUNT_KEY,
+    DIGEST_KEY,
 )
+from file_service.client.cache import LocalCache
+from file_service.utilities.content_store import compute_digest
+from file_service.utilities.storage import StagingError
 from file_service.utilities.debug import print_debug, print_error, print_command_report
 
 
-def handle_command(sock: socket, command: str, get_file_str_fn: Callable[[], str]) -> None:
-    """Dispatch a client command to the appropriate handler."""
-    print_debug(f"Received the command: {command}.")
+
+class UploadFrom(NamedTuple):
+    """The server lacks the content of a file offered by digest, and has staged it up to offset."""
+    offset: int
+
+
+class DownloadAgain(NamedTuple):
+    """A resumed download did not match the file's digest, so its staged start was discarded to download it whole."""
+
+
+# Handles the server's response to a request that has been sent, returning whether the command succeeded,
+# where to upload from if the server lacks the content that the request referred to by digest,
+# or that a download must be repeated from its start.
+FinishCommandFn = Callable[[dict[str, Any]], bool | UploadFrom | DownloadAgain]
+
+LIST_PAGE_SIZE = 1000  # Number of filenames requested at a time when listing
+
+# The cache of downloaded files, which makes downloading one again a conditional GET, or None to always download.
+_local_cache: LocalCache | None = LocalCache()
+
+
+def set_local_cache(cache: LocalCache | None) -> None:
+    global _local_cache
+    _local_cache = cache
+
+
+def handle_command(sock: socket, command: str, get_file_str_fn: Callable[[], str]) -> bool:
+    """Dispatch a client command to the appropriate handler. Return whether the command succeeded."""
+    if command.casefold() == LIST_VAL.casefold():
+        # Listings are paged, which takes a round trip per page.
+        return handle_list_command(sock, get_file_str_fn)
+    result = _complete_command(sock, start_command(sock, command, get_file_str_fn))
+    if isinstance(result, UploadFrom):
+        # The server lacks the content offered by digest, so upload what it has not staged yet.
+        result = _complete_command(sock, start_command(sock, command, get_file_str_fn, upload_offset=result.offset))
+    elif isinstance(result, DownloadAgain):
+        result = _complete_command(sock, start_command(sock, command, get_file_str_fn))
+    return result is True
+
+
+def start_command(
+    sock: socket,
+    command: str,
+    get_file_str_fn: Callable[[], str],
+    request_id: int | None = None,
+    upload_offset: int | None = None,
+) -> FinishCommandFn | None:
+    """
+    Send the request for a client command without waiting for the response.
+    Uploads offer the file's digest first if the server supports it, unless upload_offset gives where to upload from.
+    Return the function that handles the response, or None if the command failed before a request was sent.
+    """
+    print_debug("Received the command: %s.", command)
 
     def equals_ignore_case(a: str, b: str) -> bool:
         return a.casefold() == b.casefold()
 
     if equals_ignore_case(command, PUT_VAL):
-        handle_put_command(sock, get_file_str_fn)
+        return start_put_command(sock, get_file_str_fn, request_id, upload_offset)
     elif equals_ignore_case(command, GET_VAL):
-        handle_get_command(sock, get_file_str_fn)
+        return start_get_command(sock, get_file_str_fn, request_id)
     elif equals_ignore_case(command, LIST_VAL):
-        handle_list_command(sock)
+        return start_list_command(sock, get_file_str_fn, request_id)
+    elif equals_ignore_case(command, STATS_VAL):
+        return start_stats_command(sock, request_id)
+    elif equals_ignore_case(command, SIMILAR_VAL):
+        return start_similar_command(sock, get_file_str_fn, request_id)
     else:
         print_error(f"Unknown command received: {command}.")
+        return None
+
+
+def negotiate_wire_format(sock: socket) -> None:
+    """Agree with the server on the most efficient wire format that both support."""
+    message = message_protocol.construct_payload(
+        command=HELLO_VAL,
+        details=",".join(WIRE_FORMATS),
+        features=",".join(FEATURES),
+        wire_format=BINARY_FORMAT,
+    )
+    message_utilities.send_handshake(sock, message)
+    # Handshake responses are always encoded in the binary wire format.
+    message_utilities.set_wire_format(sock, BINARY_FORMAT)
+    response = message_utilities.receive_message(sock)
+
+    if response[STATUS_KEY] == ERROR_VAL:
+        print_error(response[DETAILS_KEY])
+        return
+    message_utilities.set_wire_format(sock, response[DETAILS_KEY])
+    message_utilities.set_features(sock, frozenset((response.get(FEATURES_KEY) or "").split(",")) - {""})
+
+
+def handle_put_command(sock: socket, get_file_str_fn: Callable[[], str]) -> bool:
+    """Upload a file to the server. Return whether the upload succeeded."""
+    return handle_command(sock, PUT_VAL, get_file_str_fn)
 
 
-def handle_put_command(sock: socket, get_file_str_fn: Callable[[], str]) -> None:
-    """Upload a file to the server."""
+def start_put_command(
+    sock: socket,
+    get_file_str_fn: Callable[[], str],
+    request_id: int | None = None,
+    upload_offset: int | None = None,
+) -> FinishCommandFn | None:
+    """
+    Send a request uploading a file to the server. Return the function that handles the response.
+    If the server supports it, only the file's digest is sent, so that content the server already stores is not
+    uploaded again. Once the server has asked for the content, upload_offset gives the byte to upload from, which
+    is past the start if an earlier upload was interrupted.
+    """
     filepath = get_file_str_fn()
     filename = os.path.basename(filepath)
 
     try:
-        file_data = storage.get_image(filepath)
+        file = storage.open_image(filepath)
     except (ValueError, FileNotFoundError) as e:
         error_messages = {
             ValueError: str(e),
@@ -48,61 +163,456 @@ def handle_put_command(sock: socket, get_file_str_fn: Callable[[], str]) -> None
         error_message = error_messages[type(e)]
         print_error(error_message)
         print_command_report(sock, PUT_VAL, False, filename, error_message)
-        return
+        return None
 
-    print_debug(f"Sending {PUT_VAL} request for '{filename}'...")
-    response = _send_request(sock, command=PUT_VAL, filename=filename, file_data=file_data)
-    print_debug(f"{PUT_VAL} request for '{filename}' sent successfully.")
+    print_debug("Sending %s request for '%s'...", PUT_VAL, filename)
+    with file:
+        if HASH_FIRST_FEATURE not in message_utilities.get_features(sock):
+            digest = None
+        elif upload_offset is None:
+            _send_request(sock, command=PUT_VAL, filename=filename, digest=compute_digest(file), request_id=request_id)
+            print_debug("%s request for '%s' sent by digest.", PUT_VAL, filename)
+            return partial(_finish_put_command, sock, filename)
+        else:
+            # The server stages the content under its digest, which lets it resume and verify the upload.
+            digest = compute_digest(file)
+            file.seek(upload_offset)
 
-    success = response[STATUS_KEY] != ERROR_VAL
-    print_command_report(sock, PUT_VAL, success, filename, response.get(DETAILS_KEY))
+        file_size = storage.get_file_size(file) - file.tell()
+        _send_stream_request(
+            sock,
+            file,
+            command=PUT_VAL,
+            filename=filename,
+            file_size=file_size,
+            request_id=request_id,
+            digest=digest,
+            offset=upload_offset if digest is not None else None,
+        )
+    print_debug("%s request for '%s' sent successfully.", PUT_VAL, filename)
+    return partial(_finish_put_command, sock, filename)
 
 
-def handle_get_command(sock: socket, get_file_str_fn: Callable[[], str]) -> None:
-    """Download a file from the server."""
+def handle_get_command(sock: socket, get_file_str_fn: Callable[[], str], max_dimension: int | None = None) -> bool:
+    """
+    Download a file from the server, or a downscaled variant of it if max_dimension is given.
+    Return whether the download succeeded.
+    """
+    result = _complete_command(sock, start_get_command(sock, get_file_str_fn, max_dimension=max_dimension))
+    if isinstance(result, DownloadAgain):
+        result = _complete_command(sock, start_get_command(sock, get_file_str_fn, max_dimension=max_dimension))
+    return result is True
+
+
+def start_get_command(
+    sock: socket,
+    get_file_str_fn: Callable[[], str],
+    request_id: int | None = None,
+    max_dimension: int | None = None,
+) -> FinishCommandFn | None:
+    """
+    Send a request downloading a file from the server. Return the function that handles the response.
+    The file is staged as it arrives, so a download that was interrupted asks the same server only for the rest of
+    the file.
+    With max_dimension, the server sends a variant of the image whose longest side is at most about that many pixels,
+    saved under the name given by get_variant_filename.
+    The request is conditional if the local cache has a copy of the file: the server then answers without the file if
+    its digest is still that of the copy.
+    """
     filename = get_file_str_fn()
+    local_filename = filename if max_dimension is None else get_variant_filename(filename, max_dimension)
+    if storage.local_file_exists(local_filename):
+        msg = f"Cannot download '{local_filename}' because it already exists on the client."
+        print_error(msg)
+        print_command_report(sock, GET_VAL, False, local_filename, msg)
+        return None
+
+    etag = _get_cached_etag(sock, filename) if max_dimension is None else None
+    # A variant may be generated afresh between two requests, so its download always starts over.
+    offset = storage.get_staged_size(_get_download_key(sock, local_filename)) if max_dimension is None else 0
+    print_debug("Sending %s request for '%s' from byte %d...", GET_VAL, filename, offset)
+    _send_request(
+        sock,
+        command=GET_VAL,
+        filename=filename,
+        stream=True,
+        offset=offset or None,
+        max_dimension=max_dimension,
+        if_none_match=etag,
+        request_id=request_id,
+    )
+    print_debug("%s request for '%s' sent successfully.", GET_VAL, filename)
+    return partial(_finish_get_command, sock, local_filename)
 
-    print_debug(f"Sending {GET_VAL} request for '{filename}'...")
-    response = _send_request(sock, command=GET_VAL, filename=filename)
-    print_debug(f"{GET_VAL} request for '{filename}' sent successfully.")
 
+def get_variant_filename(filename: str, max_dimension: int) -> str:
+    """Return the name under which a downscaled variant of a file is saved, e.g. 'cat.256.jpg'."""
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.{max_dimension}{extension}"
+
+
+def handle_list_command(sock: socket, get_prefix_fn: Callable[[], str] = lambda: "") -> bool:
+    """
+    Get a list of the files stored on the server whose names start with a prefix, a page at a time.
+    Print them 1 line at a time.
+    Print an error message if no files are stored.
+    Return whether the listing succeeded.
+    """
+    for page_number, response in enumerate(_request_list_pages(sock, get_prefix_fn())):
+        if response[STATUS_KEY] == ERROR_VAL:
+            print_command_report(sock, LIST_VAL, False, error_message=response[DETAILS_KEY])
+            return False
+
+        if page_number == 0:
+            print("Files on the server:")
+        print(response[DETAILS_KEY])  # Each page of filenames is a single string with line breaks between files.
+
+    print_command_report(sock, LIST_VAL, True)
+    return True
+
+
+def handle_mput_command(sock: socket, filepaths: list[str]) -> bool:
+    """
+    Upload many files to the server in a single request, streaming them after it as a bundle.
+    A file that cannot be read is sent as an error in its place. The server answers once with the outcome of each
+    file, whose failures are printed before the bundle is reported once. Return whether every file was saved.
+    """
+    print_debug("Sending %s request for %d files...", MPUT_VAL, len(filepaths))
+    _send_request(sock, command=MPUT_VAL, entry_count=len(filepaths))
+    for filepath in filepaths:
+        filename = os.path.basename(filepath)
+        try:
+            file = storage.open_image(filepath)
+        except (ValueError, FileNotFoundError) as e:
+            error_message = str(e) if isinstance(e, ValueError) else f"Cannot find '{filepath}' on the client"
+            message_utilities.send_bundle_entry_data(sock, filename, error_message.encode(), ENTRY_ERROR)
+            continue
+        with file:
+            message_utilities.send_bundle_entry(sock, filename, file, storage.get_file_size(file))
+    print_debug("%s request for %d files sent successfully.", MPUT_VAL, len(filepaths))
+
+    response = message_utilities.receive_message(sock)
+    if response[STATUS_KEY] == ERROR_VAL:
+        print_command_report(sock, MPUT_VAL, False, f"{len(filepaths)} files", response[DETAILS_KEY])
+        return False
+    return _report_bundle(sock, MPUT_VAL, json.loads(response[DETAILS_KEY]))
+
+
+def handle_mget_command(sock: socket, filenames: list[str]) -> bool:
+    """
+    Download many files from the server in a single request, which the server answers with a bundle of them.
+    Files that already exist on the client are not requested. Each file's failure is printed before the bundle is
+    reported once. Return whether every file was downloaded.
+    """
+    errors: list[str | None] = []
+    requested_filenames = []
+    for filename in filenames:
+        if storage.local_file_exists(filename):
+            errors.append(f"Cannot download '{filename}' because it already exists on the client")
+        else:
+            requested_filenames.append(filename)
+    if not requested_filenames:
+        return _report_bundle(sock, MGET_VAL, errors)
+
+    print_debug("Sending %s request for %d files...", MGET_VAL, len(requested_filenames))
+    _send_request(sock, command=MGET_VAL, details="\n".join(requested_filenames))
+    response = message_utilities.receive_message(sock)
+    if response[STATUS_KEY] == ERROR_VAL:
+        print_command_report(sock, MGET_VAL, False, f"{len(filenames)} files", response[DETAILS_KEY])
+        return False
+    if response[ENTRY_COUNT_KEY] != len(requested_filenames):
+        raise BundleError(f"The server sent {response[ENTRY_COUNT_KEY]} files for {len(requested_filenames)}.")
+
+    for requested_filename in requested_filenames:
+        header, filename = message_utilities.receive_bundle_entry(sock)
+        if filename != requested_filename:
+            raise BundleError(f"The server sent '{filename}' in place of '{requested_filename}'.")
+        if header.status == ENTRY_ERROR:
+            errors.append(message_utilities.receive_bundle_entry_data(sock, header.size).decode(errors="replace"))
+            continue
+        try:
+            key = _get_download_key(sock, filename)
+            message_utilities.receive_staged_stream(sock, key, 0, header.size)
+            _commit_download(key, filename)
+        except StagingError as e:
+            errors.append(f"Cannot download '{filename}': {e}")
+        except FileExistsError:
+            errors.append(f"Cannot download '{filename}' because it already exists on the client")
+        else:
+            errors.append(None)
+    return _report_bundle(sock, MGET_VAL, errors)
+
+
+def fetch_filenames(sock: socket, prefix: str = "") -> list[str]:
+    """
+    Return the names of the files stored on the server that start with a prefix, in name order,
+    fetched a page at a time without printing them. Return an empty list if there are none.
+    """
+    filenames = []
+    for response in _request_list_pages(sock, prefix):
+        if response[STATUS_KEY] == ERROR_VAL:
+            print_debug("No filenames listed: %s", response[DETAILS_KEY])
+            return []
+        filenames += response[DETAILS_KEY].split("\n")
+    return filenames
+
+
+def start_list_command(
+    sock: socket,
+    get_prefix_fn: Callable[[], str] = lambda: "",
+    request_id: int | None = None,
+) -> FinishCommandFn:
+    """
+    Send a request listing every file stored on the server whose name starts with a prefix, in a single page.
+    Return the function that handles the response.
+    """
+    prefix = get_prefix_fn()
+    _send_request(sock, command=LIST_VAL, prefix=prefix or None, request_id=request_id)
+    return partial(_finish_list_command, sock)
+
+
+def start_stats_command(sock: socket, request_id: int | None = None) -> FinishCommandFn:
+    """Send a request for the server's metrics. Return the function that handles the response."""
+    _send_request(sock, command=STATS_VAL, request_id=request_id)
+    return partial(_finish_stats_command, sock)
+
+
+def handle_similar_command(sock: socket, get_file_str_fn: Callable[[], str], limit: int | None = None) -> bool:
+    """
+    Print the images on the server most similar to a stored image, up to limit of them if given.
+    Return whether the search succeeded.
+    """
+    return _complete_command(sock, start_similar_command(sock, get_file_str_fn, limit=limit)) is True
+
+
+def start_similar_command(
+    sock: socket,
+    get_file_str_fn: Callable[[], str],
+    request_id: int | None = None,
+    limit: int | None = None,
+) -> FinishCommandFn:
+    """
+    Send a request for the images on the server most similar to a stored image, up to limit of them if given,
+    or as many as the server answers with by default. Return the function that handles the response.
+    """
+    filename = get_file_str_fn()
+    _send_request(sock, command=SIMILAR_VAL, filename=filename, limit=limit, request_id=request_id)
+    return partial(_finish_similar_command, sock, filename)
+
+
+def _finish_put_command(sock: socket, filename: str, response: dict[str, Any]) -> bool | UploadFrom:
+    """
+    Report the outcome of an upload.
+    Return where to upload from if the server asks for the content of a file sent by digest.
+    """
+    if response[STATUS_KEY] == MISSING_VAL:
+        offset = response.get(OFFSET_KEY) or 0
+        print_debug("The server does not store the content of '%s' yet, and has staged %d bytes.", filename, offset)
+        return UploadFrom(offset)
+    success: bool = response[STATUS_KEY] != ERROR_VAL
+    print_command_report(sock, PUT_VAL, success, filename, response.get(DETAILS_KEY))
+    return success
+
+
+def _finish_get_command(sock: socket, filename: str, response: dict[str, Any]) -> bool | DownloadAgain:
+    """
+    Save a downloaded file and report the outcome of the download.
+    A file the server reports not modified is restored from the local cache.
+    Files that come with their digest are checked against it, and cached. A resumed download that does not match is
+    discarded, to be downloaded again from its start.
+    """
     if response[STATUS_KEY] == ERROR_VAL:
         print_command_report(sock, GET_VAL, False, filename, response[DETAILS_KEY])
-        return
+        return False
 
     try:
-        storage.save_local_file(filename, response[FILE_DATA_KEY])
+        if response[STATUS_KEY] == NOT_MODIFIED_VAL:
+            if not _restore_cached_file(sock, filename, response[DIGEST_KEY]):
+                msg = f"Cannot download '{filename}' because its cached copy is gone; download it again."
+                print_error(msg)
+                print_command_report(sock, GET_VAL, False, filename, msg)
+                return False
+        elif not _save_response_file(sock, filename, response):
+            if response.get(OFFSET_KEY):
+                print_debug("The staged start of '%s' was of another version of it; downloading it whole.", filename)
+                return DownloadAgain()
+            msg = f"Cannot download '{filename}' because it does not match its digest."
+            print_error(msg)
+            print_command_report(sock, GET_VAL, False, filename, msg)
+            return False
+        else:
+            if _local_cache is not None and response.get(DIGEST_KEY) is not None:
+                _local_cache.store(
+                    _get_server_name(sock), filename, response[DIGEST_KEY], storage.get_local_filepath(filename)
+                )
+    except StagingError as e:
+        msg = f"Cannot download '{filename}': {e}"
+        print_error(msg)
+        print_command_report(sock, GET_VAL, False, filename, msg)
+        return False
     except FileExistsError:
         msg = f"Cannot download '{filename}' because it already exists on the client."
         print_error(msg)
         print_command_report(sock, GET_VAL, False, filename, msg)
-        return
+        return False
 
     print_command_report(sock, GET_VAL, True, filename)
+    return True
 
 
-def handle_list_command(sock: socket) -> None:
-    """
-    Get a list of all files and directories stored on the server.
-    Print them 1 line at a time.
-    Print an error message if no files are stored.
-    """
-    response = _send_request(sock, command=LIST_VAL)
-
+def _finish_list_command(sock: socket, response: dict[str, Any]) -> bool:
+    """Print the listed files and report the outcome of the listing."""
     if response[STATUS_KEY] == ERROR_VAL:
-        print_command_report(sock, GET_VAL, False, error_message=response[DETAILS_KEY])
-        return
+        print_command_report(sock, LIST_VAL, False, error_message=response[DETAILS_KEY])
+        return False
 
     filenames = response[DETAILS_KEY]
 
-    print("Files or directories on the server:")
+    print("Files on the server:")
     print(filenames)  # The filenames are send by the server as a single string with line breaks between files.
 
     print_command_report(sock, LIST_VAL, True)
+    return True
+
+
+def _finish_stats_command(sock: socket, response: dict[str, Any]) -> bool:
+    """Print the server's metrics and report the outcome of the request."""
+    if response[STATUS_KEY] == ERROR_VAL:
+        print_command_report(sock, STATS_VAL, False, error_message=response[DETAILS_KEY])
+        return False
+
+    print(json.dumps(json.loads(response[DETAILS_KEY]), indent=2))
+    print_command_report(sock, STATS_VAL, True)
+    return True
+
+
+def _get_cached_etag(sock: socket, filename: str) -> str | None:
+    """Return the ETag of the copy of a file from the server in the local cache, or None if there is none."""
+    return _local_cache.lookup(_get_server_name(sock), filename) if _local_cache is not None else None
+
+
+def _restore_cached_file(sock: socket, filename: str, etag: str) -> bool:
+    """Save the cached copy of a file with an ETag in the working directory. Return False if it is gone."""
+    if _local_cache is None:
+        return False
+    key = _get_download_key(sock, filename)
+    with storage.open_staged_file(key, 0) as f:
+        restored = _local_cache.restore(_get_server_name(sock), filename, etag, f)
+    if not restored:
+        storage.discard_staged_file(key)
+        return False
+    _commit_download(key, filename)
+    return True
 
 
-def _send_request(sock: socket, **kwargs) -> dict[str, Any]:  # type: ignore
-    """Send a request to the server and return its response."""
-    payload = message_protocol.construct_payload(**kwargs)
-    message_utilities.send_message(sock, payload)
-    return message_utilities.receive_message(sock)
+def _get_server_name(sock: socket) -> str:
+    """Return the address of the server a socket is connected to, which the local cache keys files by."""
+    host, port = sock.getpeername()[:2]
+    return f"{host}:{port}"
+
+
+def _finish_similar_command(sock: socket, filename: str, response: dict[str, Any]) -> bool:
+    """Print the similar images found, nearest first, with the number of bits their hashes differ in."""
+    if response[STATUS_KEY] == ERROR_VAL:
+        print_command_report(sock, SIMILAR_VAL, False, filename, response[DETAILS_KEY])
+        return False
+
+    print(f"Images similar to '{filename}':")
+    for similar_filename, distance in json.loads(response[DETAILS_KEY]):
+        print(f"{distance:>3}  {similar_filename}")
+    print_command_report(sock, SIMILAR_VAL, True, filename)
+    return True
+
+
+def _report_bundle(sock: socket, command: str, errors: list[str | None]) -> bool:
+    """
+    Print the error of each file of a bundle that failed, then report the bundle once.
+    Return whether every file succeeded.
+    """
+    failed_count = 0
+    for error in errors:
+        if error is not None:
+            print_error(error)
+            failed_count += 1
+    error_message = f"{failed_count} of {len(errors)} files failed" if failed_count else None
+    print_command_report(sock, command, not failed_count, f"{len(errors)} files", error_message)
+    return not failed_count
+
+
+def _complete_command(sock: socket, finish_fn: FinishCommandFn | None) -> bool | UploadFrom | DownloadAgain:
+    """
+    Wait for the response to a sent request and handle it.
+    Return whether the command succeeded, where to upload from if it must be repeated with the file's content,
+    or that a download must be repeated from its start.
+    """
+    if finish_fn is None:
+        return False
+    return finish_fn(message_utilities.receive_message(sock))
+
+
+def _request_list_pages(sock: socket, prefix: str) -> Iterator[dict[str, Any]]:
+    """Yield the response for each page of a listing, stopping after the last page or an error."""
+    cursor = None
+    while True:
+        _send_request(sock, command=LIST_VAL, prefix=prefix or None, cursor=cursor, limit=LIST_PAGE_SIZE)
+        response = message_utilities.receive_message(sock)
+        yield response
+        cursor = response.get(CURSOR_KEY)
+        if response[STATUS_KEY] == ERROR_VAL or cursor is None:
+            return
+
+
+def _send_request(sock: socket, **kwargs) -> None:  # type: ignore
+    """Send a request to the server."""
+    message = message_protocol.construct_payload(wire_format=message_utilities.get_wire_format(sock), **kwargs)
+    message_utilities.send_message(sock, message)
+
+
+def _send_stream_request(sock: socket, file: BufferedReader, **kwargs) -> None:  # type: ignore
+    """Send a request followed by the streamed body of a file."""
+    message = message_protocol.construct_payload(wire_format=message_utilities.get_wire_format(sock), **kwargs)
+    message_utilities.send_message(sock, message)
+    message_utilities.send_stream(sock, file, message.payload[FILE_SIZE_KEY])
+
+
+def _save_response_file(sock: socket, filename: str, response: dict[str, Any]) -> bool:
+    """
+    Save the file carried by a response, whether inline or streamed after it, to its staged file from the offset
+    the response starts at. Servers that ignore ranges send the whole file, with no offset, so staging restarts.
+    Move the file into place once complete and, if the response carries the file's digest, found to match it.
+    Return False, discarding the staged file, if it does not match.
+    Raise FileExistsError if a file of that name appeared meanwhile.
+    """
+    key = _get_download_key(sock, filename)
+    offset, file_size = response.get(OFFSET_KEY) or 0, response.get(FILE_SIZE_KEY)
+    if file_size is None:
+        with storage.open_staged_file(key, offset) as f:
+            f.write(response[FILE_DATA_KEY])
+    else:
+        message_utilities.receive_staged_stream(sock, key, offset, file_size)
+    digest = response.get(DIGEST_KEY)
+    if digest is not None and storage.compute_staged_digest(key) != digest:
+        storage.discard_staged_file(key)
+        return False
+    _commit_download(key, filename)
+    return True
+
+
+def _get_download_key(sock: socket, filename: str) -> str:
+    """
+    Return the key a download of a file is staged under, which names the server it comes from too, so that only a
+    download from the same server is ever resumed.
+    """
+    return hashlib.sha256(f"{_get_server_name(sock)}/{filename}".encode()).hexdigest()
+
+
+def _commit_download(key: str, filename: str) -> None:
+    """
+    Move a completed download from its staged file into place.
+    Raise FileExistsError, discarding the staged file, if a file of that name appeared meanwhile.
+    """
+    try:
+        storage.commit_staged_file(key, filename)
+    except FileExistsError:
+        storage.discard_staged_file(key)
+        raise
@@ -1,16 +1,40 @@
-from socket import socket, AF_INET, SOCK_STREAM
-
-from file_service.client import client_io, commands
+from file_service.client import client_io
+from file_service.client.batch import BATCH_COMMAND, run_batch
+from file_service.client.session import ClientSession
+from file_service.client.transfer import PUSH_COMMAND, PULL_COMMAND, run_transfer
+from file_service.protocol.message import GET_VAL, MPUT_VAL, MGET_VAL, SIMILAR_VAL
 
 
 def run_client(server_host: str, server_port: int) -> None:
-    """Start the client and handle a single command."""
-    sock = socket(AF_INET, SOCK_STREAM)
-    sock.connect((server_host, server_port))
-    with sock:
-        command = client_io.get_command()
-        commands.handle_command(
-            sock,
+    """
+    Start the client and handle a single command, or a batch of commands, over one connection,
+    or push or pull many files over parallel connections.
+    """
+    command = client_io.get_command()
+    if command.casefold() in (PUSH_COMMAND.casefold(), PULL_COMMAND.casefold()):
+        run_transfer(
+            server_host,
+            server_port,
             command,
-            client_io.get_file_str,  # Pass the function itself.
+            client_io.get_file_str(),
+            client_io.get_window(),
+            client_io.get_connections(),
         )
+        return
+
+    with ClientSession(server_host, server_port) as session:
+        if command.casefold() == BATCH_COMMAND.casefold():
+            run_batch(session, client_io.get_batch_operations(), client_io.get_window())
+        elif command.casefold() == GET_VAL.casefold():
+            session.get(client_io.get_file_str(), client_io.get_max_dimension())
+        elif command.casefold() == MPUT_VAL.casefold():
+            session.mput(client_io.get_file_strs())
+        elif command.casefold() == MGET_VAL.casefold():
+            session.mget(client_io.get_file_strs())
+        elif command.casefold() == SIMILAR_VAL.casefold():
+            session.similar(client_io.get_file_str(), client_io.get_similar_limit())
+        else:
+            session.run(
+                command,
+                client_io.get_file_str,  # Pass the function itself.
+            )
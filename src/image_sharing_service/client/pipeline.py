@@ -0,0 +1,164 @@
+from socket import socket
+from itertools import groupby
+from threading import BoundedSemaphore, Condition, Thread
+from typing import Any, Callable, Iterable, NamedTuple
+
+from file_service.client import commands
+from file_service.client.commands import DownloadAgain, FinishCommandFn, UploadFrom
+from file_service.protocol.message import PUT_VAL, REQUEST_ID_KEY
+from file_service.utilities import message as message_utilities
+from file_service.utilities.debug import print_debug, print_error
+
+DEFAULT_WINDOW = 8  # Number of requests kept outstanding at once
+
+
+class Operation(NamedTuple):
+    """A client command and the filename or filepath it applies to."""
+    command: str
+    file_str: str = ""
+
+
+class OperationResult(NamedTuple):
+    """The outcome of an operation."""
+    operation: Operation
+    success: bool
+
+
+def run_pipelined(
+    sock: socket,
+    operations: Iterable[Operation],
+    window: int = DEFAULT_WINDOW,
+    result_fn: Callable[[OperationResult], None] | None = None,
+) -> list[OperationResult]:
+    """
+    Run operations over one connection, keeping up to window requests outstanding instead of waiting
+    for each response before sending the next request. Responses are matched to requests by request ID.
+    Uploads offer digests first; those whose content the server lacks are then uploaded in a second pass,
+    which completes before any later operation that is not an upload is sent, so that it sees every upload.
+    Downloads resumed from a stale staged start are repeated whole in a second pass too.
+    Return the result of every operation, in the order in which they completed,
+    passing each to result_fn, if given, as soon as it is known.
+    """
+    if window < 1:
+        raise ValueError("Window must be at least 1.")
+
+    results: list[OperationResult] = []
+    for uploads, run in groupby(operations, key=_is_upload):
+        run_results, retries = _run_pass(sock, ((operation, None) for operation in run), window, result_fn)
+        results.extend(run_results)
+        if retries:
+            print_debug("Repeating %d operations, with content the server lacks or downloading whole.", len(retries))
+            retried_results, _ = _run_pass(sock, retries, window, result_fn)
+            results.extend(retried_results)
+    return results
+
+
+def _run_pass(
+    sock: socket,
+    operations: Iterable[tuple[Operation, int | None]],
+    window: int,
+    result_fn: Callable[[OperationResult], None] | None = None,
+) -> tuple[list[OperationResult], list[tuple[Operation, int | None]]]:
+    """
+    Run operations over one connection with up to window requests outstanding. Each operation comes with the
+    byte to upload from, or None to offer the file's digest first.
+    Return the results of the operations that completed and the operations that must be repeated, with the byte to
+    upload from, or None for downloads. Each result is also passed to result_fn, if given, as soon as it is known.
+    """
+    results: list[OperationResult] = []
+    retries: list[tuple[Operation, int | None]] = []
+    pending: dict[int, tuple[Operation, FinishCommandFn]] = {}
+    outstanding = BoundedSemaphore(window)
+    condition = Condition()
+    sending_done = False
+
+    def add_result(result: OperationResult) -> None:
+        results.append(result)
+        if result_fn is not None:
+            result_fn(result)
+
+    def send_requests() -> None:
+        """Send every request, blocking while window requests are outstanding."""
+        nonlocal sending_done
+        try:
+            for request_id, (operation, upload_offset) in enumerate(operations):
+                outstanding.acquire()
+                try:
+                    finish_fn = commands.start_command(
+                        sock,
+                        operation.command,
+                        lambda: operation.file_str,
+                        request_id,
+                        upload_offset,
+                    )
+                except Exception:
+                    # Report the operation whose request could not be sent, so that it is not lost.
+                    with condition:
+                        add_result(OperationResult(operation, False))
+                    raise
+                with condition:
+                    if finish_fn is None:
+                        add_result(OperationResult(operation, False))
+                        outstanding.release()
+                    else:
+                        pending[request_id] = (operation, finish_fn)
+                    condition.notify()
+        except Exception as e:
+            print_error(f"Stopped sending pipelined requests: {e}.")
+        finally:
+            with condition:
+                sending_done = True
+                condition.notify()
+
+    sender = Thread(target=send_requests, daemon=True)
+    sender.start()
+
+    # Receive responses on this thread, so that sending large bodies never blocks reading responses.
+    while True:
+        with condition:
+            condition.wait_for(lambda: pending or sending_done)
+            if not pending:
+                break
+
+        response = message_utilities.receive_message(sock)
+        with condition:
+            request_id = _match_response(response, pending, condition, lambda: sending_done)
+            if request_id is None:
+                print_error(f"Ignoring a response to an unknown request: {response.get(REQUEST_ID_KEY)}.")
+                continue
+            operation, finish_fn = pending.pop(request_id)
+        print_debug("Received the response to pipelined request %s.", request_id)
+
+        result = finish_fn(response)
+        if isinstance(result, UploadFrom):
+            retries.append((operation, result.offset))
+        elif isinstance(result, DownloadAgain):
+            retries.append((operation, None))
+        else:
+            add_result(OperationResult(operation, result))
+        outstanding.release()
+
+    sender.join()
+    return results, retries
+
+
+def _match_response(
+    response: dict[str, Any],
+    pending: dict[int, tuple[Operation, FinishCommandFn]],
+    condition: Condition,
+    is_sending_done_fn: Callable[[], bool],
+) -> int | None:
+    """
+    Return the ID of the pending request a response answers, waiting until that request is registered.
+    Servers that do not echo request IDs answer in arrival order, so the oldest pending request is used.
+    Return None if the request will never be registered.
+    """
+    request_id: int | None = response.get(REQUEST_ID_KEY)
+    if request_id is None:
+        return min(pending)
+    condition.wait_for(lambda: request_id in pending or is_sending_done_fn())
+    return request_id if request_id in pending else None
+
+
+def _is_upload(operation: Operation) -> bool:
+    return operation.command.casefold() == PUT_VAL.casefold()
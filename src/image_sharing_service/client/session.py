@@ -0,0 +1,84 @@
+from socket import socket, AF_INET, SOCK_STREAM
+from types import TracebackType
+from typing import Callable, Iterable
+
+from file_service.client import commands
+from file_service.client.pipeline import DEFAULT_WINDOW, Operation, OperationResult, run_pipelined
+from file_service.protocol.message import PUT_VAL, GET_VAL, LIST_VAL, STATS_VAL
+
+
+class ClientSession:
+    """A connection to the server that is reused for any number of commands."""
+
+    def __init__(self, server_host: str, server_port: int) -> None:
+        self.server_address = (server_host, server_port)
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.connect(self.server_address)
+        commands.negotiate_wire_format(self.sock)
+
+    def run(self, command: str, get_file_str_fn: Callable[[], str]) -> bool:
+        """Run a command over the connection. Return whether it succeeded."""
+        return commands.handle_command(self.sock, command, get_file_str_fn)
+
+    def put(self, filepath: str) -> bool:
+        """Upload a file to the server. Return whether the upload succeeded."""
+        return self.run(PUT_VAL, lambda: filepath)
+
+    def get(self, filename: str, max_dimension: int | None = None) -> bool:
+        """
+        Download a file from the server, or a downscaled variant of it if max_dimension is given.
+        Return whether the download succeeded.
+        """
+        if max_dimension is not None:
+            return commands.handle_get_command(self.sock, lambda: filename, max_dimension)
+        return self.run(GET_VAL, lambda: filename)
+
+    def mput(self, filepaths: list[str]) -> bool:
+        """Upload many files to the server in a single request. Return whether every upload succeeded."""
+        return commands.handle_mput_command(self.sock, filepaths)
+
+    def mget(self, filenames: list[str]) -> bool:
+        """Download many files from the server in a single request. Return whether every download succeeded."""
+        return commands.handle_mget_command(self.sock, filenames)
+
+    def list_files(self, prefix: str = "") -> bool:
+        """Print the files stored on the server whose names start with prefix. Return whether the listing succeeded."""
+        return self.run(LIST_VAL, lambda: prefix)
+
+    def similar(self, filename: str, limit: int | None = None) -> bool:
+        """
+        Print the images on the server most similar to a stored image, up to limit of them if given.
+        Return whether the search succeeded.
+        """
+        return commands.handle_similar_command(self.sock, lambda: filename, limit)
+
+    def stats(self) -> bool:
+        """Print the server's metrics. Return whether the server sent them."""
+        return self.run(STATS_VAL, lambda: "")
+
+    def run_pipelined(
+        self,
+        operations: Iterable[Operation],
+        window: int = DEFAULT_WINDOW,
+        result_fn: Callable[[OperationResult], None] | None = None,
+    ) -> list[OperationResult]:
+        """
+        Run operations over the connection with up to window requests outstanding at once,
+        passing each result to result_fn, if given, as soon as it is known.
+        """
+        return run_pipelined(self.sock, operations, window, result_fn)
+
+    def close(self) -> None:
+        """Close the connection to the server."""
+        self.sock.close()
+
+    def __enter__(self) -> "ClientSession":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
@@ -0,0 +1,327 @@
+import fnmatch
+import glob
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+from file_service.client import commands
+from file_service.client.batch import transferred_byte_count
+from file_service.client.pipeline import DEFAULT_WINDOW, Operation, OperationResult
+from file_service.client.session import ClientSession
+from file_service.protocol.message import PUT_VAL, GET_VAL
+from file_service.utilities import storage
+from file_service.utilities.debug import print_debug, print_error
+
+PUSH_COMMAND = "PUSH"
+PULL_COMMAND = "PULL"
+
+DEFAULT_CONNECTIONS = 4
+DEFAULT_ATTEMPTS = 3  # Times a file is tried before it counts as failed
+
+_RECONNECT_DELAY = 0.5  # Seconds before reconnecting after a connection is lost, doubled while reconnecting fails
+_MAX_RECONNECTS = 5  # Consecutive failed connections after which a connection stops trying
+# Windows of operations a connection takes at a time. Taking a few at a time leaves the rest to be stolen by
+# connections that finish early; a hash-first pass would otherwise take everything, as digests are answered quickly.
+_WINDOWS_PER_RUN = 4
+_PROGRESS_INTERVAL = 1.0  # Seconds between progress reports
+_GLOB_CHARACTERS = "*?["
+_MEGABYTE = 1024 * 1024
+
+
+class _Run:
+    """One connection's use of the work queues, which stops taking work once abandoned."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index  # Of the connection, and of its deque
+        self.stopped = False
+
+
+class _WorkQueues:
+    """
+    The operations left to run, split into a deque per connection.
+    Each connection takes from the front of its own deque and, once that is empty, steals from the back of the
+    fullest other one, so that a connection that runs out of work helps those that still have a backlog.
+    An operation is in flight from when it is taken until its result is reported. Failed operations are queued
+    again until they run out of attempts.
+    """
+
+    def __init__(self, operations: Iterable[Operation], connection_count: int, max_attempts: int) -> None:
+        self._deques: list[deque[Operation]] = [deque() for _ in range(connection_count)]
+        for i, operation in enumerate(operations):
+            self._deques[i % connection_count].append(operation)
+        self._max_attempts = max_attempts
+        self._attempts: dict[Operation, int] = {}
+        self._in_flight: dict[Operation, _Run] = {}
+        self._condition = threading.Condition()
+        self.retry_count = 0
+
+    def iterate(self, run: _Run, limit: int) -> Iterator[Operation]:
+        """Yield up to limit operations for a run, stopping early if none are left to take or the run is abandoned."""
+        for _ in range(limit):
+            operation = self._take(run)
+            if operation is None:
+                return
+            yield operation
+
+    def report(self, result: OperationResult) -> bool | None:
+        """
+        Record the result of an operation in flight.
+        Return whether it succeeded, or None if it failed and is queued again to be retried.
+        """
+        with self._condition:
+            run = self._in_flight.pop(result.operation, None)
+            if run is None:
+                return None  # Already queued again when its connection was abandoned.
+            outcome = True if result.success else self._retry(result.operation, run.index)
+            self._condition.notify_all()
+            return outcome
+
+    def abandon(self, run: _Run) -> tuple[int, list[Operation]]:
+        """
+        Stop a run whose connection was lost and queue its operations in flight again, as failed attempts.
+        Return how many were queued again, and the operations that ran out of attempts.
+        """
+        with self._condition:
+            run.stopped = True
+            operations = [operation for operation, owner in self._in_flight.items() if owner is run]
+            exhausted = []
+            for operation in operations:
+                del self._in_flight[operation]
+                if self._retry(operation, run.index) is False:
+                    exhausted.append(operation)
+            self._condition.notify_all()
+            return len(operations) - len(exhausted), exhausted
+
+    def wait_for_work(self) -> bool:
+        """
+        Wait until there are operations to take or none are in flight.
+        Return whether there are operations to take; if not, the transfer is over.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._has_queued() or not self._in_flight)
+            return self._has_queued()
+
+    def drain(self) -> list[Operation]:
+        """Remove and return every queued operation, once no connection is left to run them."""
+        with self._condition:
+            drained = [operation for operations in self._deques for operation in operations]
+            for operations in self._deques:
+                operations.clear()
+            return drained
+
+    def _take(self, run: _Run) -> Operation | None:
+        with self._condition:
+            if run.stopped:
+                return None
+            own = self._deques[run.index]
+            if own:
+                operation = own.popleft()
+            else:
+                fullest = max(self._deques, key=len)
+                if not fullest:
+                    return None
+                operation = fullest.pop()
+            self._in_flight[operation] = run
+            return operation
+
+    def _retry(self, operation: Operation, index: int) -> bool | None:
+        """
+        Queue a failed operation again, on the deque at index, if it has attempts left.
+        Return None if it was queued again, or False if it ran out of attempts.
+        """
+        attempts = self._attempts.get(operation, 1)
+        if attempts >= self._max_attempts:
+            return False
+        self._attempts[operation] = attempts + 1
+        self.retry_count += 1
+        self._deques[index].append(operation)
+        return None
+
+    def _has_queued(self) -> bool:
+        return any(self._deques)
+
+
+class _Progress:
+    """Counts of a transfer's outcomes, reported periodically while it runs."""
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.byte_count = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation: Operation, success: bool) -> None:
+        byte_count = transferred_byte_count(operation) if success else 0
+        with self._lock:
+            if success:
+                self.succeeded += 1
+                self.byte_count += byte_count
+            else:
+                self.failed += 1
+
+    def print_report(self) -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        completed = self.succeeded + self.failed
+        print(
+            f"Progress: {completed}/{self.total} files ({completed / max(self.total, 1):.1%}), {self.failed} failed, "
+            f"{self.byte_count / _MEGABYTE:.1f} MB at {self.byte_count / _MEGABYTE / elapsed:.2f} MB/s.\n",
+            end="",
+            flush=True,
+        )
+
+
+def run_transfer(
+    server_host: str,
+    server_port: int,
+    command: str,
+    source: str,
+    window: int = DEFAULT_WINDOW,
+    connection_count: int = DEFAULT_CONNECTIONS,
+    max_attempts: int = DEFAULT_ATTEMPTS,
+) -> bool:
+    """
+    Push every image matching a directory or glob to the server, or pull every image on the server matching a
+    glob, over connection_count connections in parallel, each keeping up to window requests outstanding.
+    Files already at the destination are skipped. Failed files are retried up to max_attempts times in all.
+    Print progress periodically and a summary at the end. Return whether every file was transferred.
+    """
+    if connection_count < 1:
+        raise ValueError("Connections must be at least 1.")
+    server_address = (server_host, server_port)
+    with ClientSession(*server_address) as session:
+        if command.casefold() == PUSH_COMMAND.casefold():
+            operations = _find_push_operations(session, source)
+        else:
+            operations = _find_pull_operations(session, source)
+    if not operations:
+        print("Nothing to transfer.")
+        return True
+
+    queues = _WorkQueues(operations, connection_count, max_attempts)
+    progress = _Progress(len(operations))
+
+    def report_result(result: OperationResult) -> None:
+        outcome = queues.report(result)
+        if outcome is not None:
+            progress.record(result.operation, outcome)
+
+    connections = [
+        threading.Thread(
+            target=_run_connection,
+            args=(server_address, index, queues, progress, window, report_result),
+            daemon=True,
+        )
+        for index in range(min(connection_count, len(operations)))
+    ]
+    for connection in connections:
+        connection.start()
+    alive = connections
+    while alive:
+        # Wait for a connection to finish, or until the next progress report is due.
+        alive[0].join(_PROGRESS_INTERVAL)
+        alive = [connection for connection in connections if connection.is_alive()]
+        if alive:
+            progress.print_report()
+
+    for operation in queues.drain():
+        print_error(f"Gave up on '{operation.file_str}': no connection to the server is left.")
+        progress.record(operation, False)
+    _print_transfer_summary(progress, queues.retry_count)
+    return progress.failed == 0
+
+
+def _run_connection(
+    server_address: tuple[str, int],
+    index: int,
+    queues: _WorkQueues,
+    progress: _Progress,
+    window: int,
+    report_result_fn: Callable[[OperationResult], None],
+) -> None:
+    """
+    Run operations over one connection until none are left, reconnecting if the connection is lost.
+    Operations in flight on a lost connection are queued again.
+    """
+    session: ClientSession | None = None
+    reconnect_delay = _RECONNECT_DELAY
+    failed_connections = 0
+    while True:
+        run = _Run(index)
+        try:
+            if session is None:
+                session = ClientSession(*server_address)
+            session.run_pipelined(queues.iterate(run, window * _WINDOWS_PER_RUN), window, report_result_fn)
+            failed_connections, reconnect_delay = 0, _RECONNECT_DELAY
+        except Exception as e:
+            requeued_count, exhausted = queues.abandon(run)
+            for operation in exhausted:
+                progress.record(operation, False)
+            if session is not None:
+                session.close()
+                session = None
+            failed_connections += 1
+            if failed_connections > _MAX_RECONNECTS:
+                print_error(f"Connection {index} gave up after {_MAX_RECONNECTS} reconnections: {e}.")
+                return
+            print_error(
+                f"Connection {index} lost with {requeued_count} files queued again: {e}. "
+                f"Reconnecting in {reconnect_delay:.1f} s."
+            )
+            time.sleep(reconnect_delay)
+            reconnect_delay *= 2
+            continue
+
+        if not queues.wait_for_work():
+            break
+    print_debug(f"Connection {index} has no work left.")
+    if session is not None:
+        session.close()
+
+
+def _find_push_operations(session: ClientSession, source: str) -> list[Operation]:
+    """Return an upload for every image in a directory, or matching a glob, that is not on the server yet."""
+    if os.path.isdir(source):
+        with os.scandir(source) as it:
+            filepaths = sorted(entry.path for entry in it)
+    else:
+        filepaths = sorted(glob.glob(source, recursive=True))
+    filepaths = [filepath for filepath in filepaths if os.path.isfile(filepath) and storage.is_image_file(filepath)]
+
+    stored = set(commands.fetch_filenames(session.sock))
+    operations = [Operation(PUT_VAL, filepath) for filepath in filepaths if os.path.basename(filepath) not in stored]
+    _print_skipped_count(len(filepaths) - len(operations), "on the server")
+    return operations
+
+
+def _find_pull_operations(session: ClientSession, pattern: str) -> list[Operation]:
+    """Return a download for every image on the server whose name matches a glob and that is not stored locally."""
+    literal_prefix = pattern
+    for character in _GLOB_CHARACTERS:
+        literal_prefix = literal_prefix.partition(character)[0]
+    filenames = [
+        filename for filename in commands.fetch_filenames(session.sock, literal_prefix)
+        if fnmatch.fnmatchcase(filename, pattern) and storage.is_image_file(filename)
+    ]
+
+    operations = [Operation(GET_VAL, filename) for filename in filenames if not storage.local_file_exists(filename)]
+    _print_skipped_count(len(filenames) - len(operations), "locally")
+    return operations
+
+
+def _print_skipped_count(skipped_count: int, where: str) -> None:
+    if skipped_count:
+        print(f"Skipping {skipped_count} files already stored {where}.")
+
+
+def _print_transfer_summary(progress: _Progress, retry_count: int) -> None:
+    """Print the aggregate outcome and throughput of a transfer."""
+    elapsed = max(time.perf_counter() - progress.start, 1e-9)
+    print(
+        f"Transfer complete: {progress.succeeded}/{progress.total} succeeded, {progress.failed} failed, "
+        f"{retry_count} retries in {elapsed:.2f} s ({progress.total / elapsed:.1f} files/s, "
+        f"{progress.byte_count / _MEGABYTE / elapsed:.2f} MB/s)."
+    )
@@ -0,0 +1,51 @@
+import struct
+from typing import NamedTuple
+
+# A bundle carries many files in one request or response, as a sequence of entries streamed after the message,
+# which gives their number. Each entry is a header, the filename, and a raw body of the size in the header:
+#   header: status, filename length, body size
+# The body of an entry whose status is an error is the error message rather than a file.
+_ENTRY_HEADER = struct.Struct(">BHQ")
+ENTRY_HEADER_SIZE = _ENTRY_HEADER.size
+
+# Entry statuses
+ENTRY_OK = 0
+ENTRY_ERROR = 1
+_ENTRY_STATUSES = {ENTRY_OK, ENTRY_ERROR}
+
+
+class BundleError(Exception):
+    """Raised when an entry of a bundle cannot be encoded or decoded."""
+    pass
+
+
+class EntryHeader(NamedTuple):
+    """What precedes the body of an entry: its status, the length of its filename and the size of its body."""
+    status: int
+    filename_length: int
+    size: int
+
+
+def encode_entry_header(filename: str, size: int, status: int = ENTRY_OK) -> bytes:
+    """Return the header and filename preceding the body of an entry."""
+    encoded_filename = filename.encode()
+    try:
+        return _ENTRY_HEADER.pack(status, len(encoded_filename), size) + encoded_filename
+    except struct.error as e:
+        raise BundleError(f"Cannot encode the bundle entry of '{filename}': {e}.")
+
+
+def decode_entry_header(data: bytes | bytearray) -> EntryHeader:
+    """Decode the header of an entry, which its filename follows."""
+    header = EntryHeader(*_ENTRY_HEADER.unpack(data))
+    if header.status not in _ENTRY_STATUSES:
+        raise BundleError(f"Unknown bundle entry status: {header.status}.")
+    return header
+
+
+def decode_entry_filename(data: bytes | bytearray) -> str:
+    """Decode the filename of an entry."""
+    try:
+        return data.decode()
+    except UnicodeDecodeError as e:
+        raise BundleError(f"Malformed filename in a bundle entry: {e!r}.")
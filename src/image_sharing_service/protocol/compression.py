@@ -0,0 +1,93 @@
+import lzma
+import zlib
+from typing import Callable, Iterable, NamedTuple
+
+# Compression codecs, each also the name of the protocol feature that lets a connection use it.
+ZLIB_CODEC = "zlib"
+LZMA_CODEC = "lzma"
+CODECS = (ZLIB_CODEC, LZMA_CODEC)  # In order of preference
+
+# Frame flags naming how a payload was compressed
+UNCOMPRESSED_FLAG = 0
+_ZLIB_FLAG = 1
+_LZMA_FLAG = 2
+
+MIN_COMPRESSED_SIZE = 512  # Smaller payloads have too little to save to be worth compressing.
+_MIN_SAVING_FRACTION = 8  # Payloads are sent compressed only if that saves at least an eighth of their size.
+_SAMPLE_SIZE = 16 * 1024  # Bytes of a large payload compressed first, to tell cheaply whether it compresses at all
+_LZMA_PRESET = 1  # Higher presets save little more on payloads while costing several times the CPU.
+
+
+class CompressionError(Exception):
+    """Raised when a compressed payload cannot be decompressed."""
+    pass
+
+
+class Codec(NamedTuple):
+    """How a codec compresses data, and how it decompresses data up to a maximum size."""
+    flag: int
+    compress_fn: Callable[[bytes], bytes]
+    decompress_fn: Callable[[bytes | bytearray, int], bytes]
+
+
+def _decompress_zlib(data: bytes | bytearray, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    decompressed = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise CompressionError(f"Decompressed payload is truncated or larger than {max_size} bytes.")
+    return decompressed
+
+
+def _decompress_lzma(data: bytes | bytearray, max_size: int) -> bytes:
+    decompressor = lzma.LZMADecompressor()
+    decompressed = decompressor.decompress(data, max_size)
+    if not decompressor.eof:
+        raise CompressionError(f"Decompressed payload is truncated or larger than {max_size} bytes.")
+    return decompressed
+
+
+_CODECS = {
+    ZLIB_CODEC: Codec(_ZLIB_FLAG, zlib.compress, _decompress_zlib),
+    LZMA_CODEC: Codec(_LZMA_FLAG, lambda data: lzma.compress(data, preset=_LZMA_PRESET), _decompress_lzma),
+}
+_CODECS_BY_FLAG = {codec.flag: codec for codec in _CODECS.values()}
+
+
+def choose_codec(codecs: Iterable[str]) -> str | None:
+    """Return the preferred codec among those negotiated on a connection, or None if there are none."""
+    available = set(codecs)
+    return next((codec for codec in CODECS if codec in available), None)
+
+
+def compress(data: bytes, codec: str | None) -> tuple[int, bytes]:
+    """
+    Compress a payload with a codec. Return the frame flag and the data to send,
+    which is the payload as it is if no codec is given or compressing it saves too little.
+    Large payloads are only compressed if a sample from their middle, compressed quickly, saves enough.
+    """
+    if codec is None:
+        return UNCOMPRESSED_FLAG, data
+    if len(data) > 4 * _SAMPLE_SIZE:
+        start = (len(data) - _SAMPLE_SIZE) // 2
+        if not _saves_enough(len(zlib.compress(data[start:start + _SAMPLE_SIZE], 1)), _SAMPLE_SIZE):
+            return UNCOMPRESSED_FLAG, data
+    compressed = _CODECS[codec].compress_fn(data)
+    if not _saves_enough(len(compressed), len(data)):
+        return UNCOMPRESSED_FLAG, data
+    return _CODECS[codec].flag, compressed
+
+
+def decompress(flag: int, data: bytes | bytearray, max_size: int) -> bytes | bytearray:
+    """Return a payload as it was before compression. Raise CompressionError if it cannot be decompressed."""
+    if flag == UNCOMPRESSED_FLAG:
+        return data
+    if flag not in _CODECS_BY_FLAG:
+        raise CompressionError(f"Unknown compression flag: {flag}.")
+    try:
+        return _CODECS_BY_FLAG[flag].decompress_fn(data, max_size)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise CompressionError(f"Corrupt compressed payload: {e}.")
+
+
+def _saves_enough(compressed_size: int, size: int) -> bool:
+    return compressed_size <= size - size // _MIN_SAVING_FRACTION
@@ -1,6 +1,10 @@
-from typing import Any
+import pickle
+import struct
+from typing import Any, Callable
 
 from file_service.protocol import socket as socket_protocol
+from file_service.protocol.compression import CODECS
+from file_service.protocol.socket import EncodedMessage
 
 # Keys
 COMMAND_KEY = "COMMAND"
@@ -8,16 +12,46 @@ STATUS_KEY = "STATUS"
 DETAILS_KEY = "DETAILS"
 FILENAME_KEY = "FILENAME"
 FILE_DATA_KEY = "FILE_DATA"
+FILE_SIZE_KEY = "FILE_SIZE"  # Set when the file is streamed as a raw body after the message.
+STREAM_KEY = "STREAM"  # Set on requests whose sender accepts a streamed file in the response.
+REQUEST_ID_KEY = "REQUEST_ID"  # Chosen by the client and echoed in the response, to match pipelined requests.
+PREFIX_KEY = "PREFIX"  # Restricts a listing to filenames starting with it.
+CURSOR_KEY = "CURSOR"  # A listing continues after this filename; responses carry the cursor of the next page.
+LIMIT_KEY = "LIMIT"  # Maximum number of filenames in one page of a listing, or in the answer to SIMILAR.
+DIGEST_KEY = "DIGEST"  # SHA-256 of a file's content; a PUT carrying only a digest asks to reuse stored content.
+OFFSET_KEY = "OFFSET"  # Byte of the file at which a streamed body, or a requested range, starts.
+LENGTH_KEY = "LENGTH"  # Maximum number of bytes in a requested range; the rest of the file if unset.
+FEATURES_KEY = "FEATURES"  # Comma-separated protocol features offered in a HELLO request, or accepted in its response.
+MAX_DIMENSION_KEY = "MAX_DIMENSION"  # Longest side in pixels of the downscaled variant of an image asked for by a GET.
+ENTRY_COUNT_KEY = "ENTRY_COUNT"  # Number of entries in the bundle streamed after the message.
+IF_NONE_MATCH_KEY = "IF_NONE_MATCH"  # A GET for a file whose digest is still this is answered without the file.
 
 # Command values
 PUT_VAL = "PUT"
 GET_VAL = "GET"
 LIST_VAL = "LIST"
+HELLO_VAL = "HELLO"  # Negotiates the wire format; DETAILS lists the formats offered or the one chosen.
+STATS_VAL = "STATS"  # Asks for the server's metrics, answered in DETAILS as a JSON object.
+MPUT_VAL = "MPUT"  # Uploads the files in the bundle after the request, answered with the outcome of each in DETAILS.
+MGET_VAL = "MGET"  # Downloads the files named in DETAILS, one per line, answered with a bundle of them.
+SIMILAR_VAL = "SIMILAR"  # Finds the images most like the file named, answered in DETAILS as a JSON list.
 
 # Status values
 REQUEST_VAL = "REQUEST"
 OK_VAL = "OK"
 ERROR_VAL = "ERROR"
+MISSING_VAL = "MISSING"  # The server does not have the content a request refers to by digest.
+NOT_MODIFIED_VAL = "NOT_MODIFIED"  # The file of a conditional GET still has the digest the client has a copy of.
+
+# Wire formats
+PICKLE_FORMAT = "pickle/1"
+BINARY_FORMAT = "binary/1"
+WIRE_FORMATS = (BINARY_FORMAT, PICKLE_FORMAT)  # In order of preference.
+
+# Protocol features, negotiated by HELLO
+HASH_FIRST_FEATURE = "hash-first"  # PUT may send a digest first, uploading the body only if the server lacks it.
+# Each compression codec is a feature too: frames are flagged and their payloads may be compressed with it.
+FEATURES = (HASH_FIRST_FEATURE, *CODECS)
 
 
 class SizeError(Exception):
@@ -30,23 +64,57 @@ class CommandError(Exception):
     pass
 
 
+class WireFormatError(Exception):
+    """Raised when a message cannot be encoded or decoded in the binary wire format."""
+    pass
+
+
 def construct_payload(
     command: str | None = None,
     status: str | None = None,
     details: str | None = None,
     filename: str | None = None,
     file_data: bytes | None = None,
-) -> dict[str, Any]:
-    """Construct a payload dictionary with all required keys."""
+    file_size: int | None = None,
+    stream: bool | None = None,
+    request_id: int | None = None,
+    prefix: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+    digest: str | None = None,
+    offset: int | None = None,
+    length: int | None = None,
+    features: str | None = None,
+    max_dimension: int | None = None,
+    entry_count: int | None = None,
+    if_none_match: str | None = None,
+    wire_format: str = PICKLE_FORMAT,
+) -> EncodedMessage:
+    """Construct a payload dictionary with all required keys and encode it in a wire format, ready to be sent."""
     payload = {
         COMMAND_KEY: command,
         FILENAME_KEY: filename,
         DETAILS_KEY: details,
         STATUS_KEY: status,
         FILE_DATA_KEY: file_data,
+        FILE_SIZE_KEY: file_size,
+        STREAM_KEY: stream,
+        REQUEST_ID_KEY: request_id,
+        PREFIX_KEY: prefix,
+        CURSOR_KEY: cursor,
+        LIMIT_KEY: limit,
+        DIGEST_KEY: digest,
+        OFFSET_KEY: offset,
+        LENGTH_KEY: length,
+        FEATURES_KEY: features,
+        MAX_DIMENSION_KEY: max_dimension,
+        ENTRY_COUNT_KEY: entry_count,
+        IF_NONE_MATCH_KEY: if_none_match,
     }
     validate_payload(payload)
-    return payload
+    message = socket_protocol.encode_message(payload, get_encoder(wire_format))
+    validate_message_size(message)
+    return message
 
 
 def validate_payload(payload: dict[str, Any]) -> None:
@@ -60,6 +128,19 @@ def validate_payload(payload: dict[str, Any]) -> None:
             DETAILS_KEY,
             FILENAME_KEY,
             FILE_DATA_KEY,
+            FILE_SIZE_KEY,
+            STREAM_KEY,
+            REQUEST_ID_KEY,
+            PREFIX_KEY,
+            CURSOR_KEY,
+            LIMIT_KEY,
+            DIGEST_KEY,
+            OFFSET_KEY,
+            LENGTH_KEY,
+            FEATURES_KEY,
+            MAX_DIMENSION_KEY,
+            ENTRY_COUNT_KEY,
+            IF_NONE_MATCH_KEY,
         }
         missing = required - payload.keys()
         if missing:
@@ -77,20 +158,221 @@ def validate_payload(payload: dict[str, Any]) -> None:
             raise TypeError("Filename must be a string or None.")
         if not isinstance(payload[FILE_DATA_KEY], (bytes, type(None))):
             raise TypeError("File data must be bytes or None.")
-
-    def validate_size() -> None:
-        """Ensure the payload does not exceed the size limit."""
-        size = socket_protocol.get_payload_size(payload)
-        max_size = socket_protocol.get_max_payload_size()
-        if size > max_size:
-            raise SizeError(f"Payload too large (max {max_size} bytes).")
+        if not isinstance(payload[FILE_SIZE_KEY], (int, type(None))):
+            raise TypeError("File size must be an integer or None.")
+        if not isinstance(payload[STREAM_KEY], (bool, type(None))):
+            raise TypeError("Stream must be a boolean or None.")
+        if not isinstance(payload[REQUEST_ID_KEY], (int, type(None))):
+            raise TypeError("Request ID must be an integer or None.")
+        if not isinstance(payload[PREFIX_KEY], (str, type(None))):
+            raise TypeError("Prefix must be a string or None.")
+        if not isinstance(payload[CURSOR_KEY], (str, type(None))):
+            raise TypeError("Cursor must be a string or None.")
+        if not isinstance(payload[LIMIT_KEY], (int, type(None))):
+            raise TypeError("Limit must be an integer or None.")
+        if not isinstance(payload[DIGEST_KEY], (str, type(None))):
+            raise TypeError("Digest must be a string or None.")
+        if not isinstance(payload[OFFSET_KEY], (int, type(None))):
+            raise TypeError("Offset must be an integer or None.")
+        if not isinstance(payload[LENGTH_KEY], (int, type(None))):
+            raise TypeError("Length must be an integer or None.")
+        if not isinstance(payload[FEATURES_KEY], (str, type(None))):
+            raise TypeError("Features must be a string or None.")
+        if not isinstance(payload[MAX_DIMENSION_KEY], (int, type(None))):
+            raise TypeError("Max dimension must be an integer or None.")
+        if not isinstance(payload[ENTRY_COUNT_KEY], (int, type(None))):
+            raise TypeError("Entry count must be an integer or None.")
+        if not isinstance(payload[IF_NONE_MATCH_KEY], (str, type(None))):
+            raise TypeError("If-none-match must be a string or None.")
 
     def validate_command() -> None:
         """Ensure the command is valid."""
-        if payload[COMMAND_KEY] not in [PUT_VAL, GET_VAL, LIST_VAL]:
+        commands = [PUT_VAL, GET_VAL, LIST_VAL, HELLO_VAL, STATS_VAL, MPUT_VAL, MGET_VAL, SIMILAR_VAL]
+        if payload[COMMAND_KEY] not in commands:
             raise CommandError(f"Invalid command: {payload[COMMAND_KEY]}.")
 
     validate_keys()
     validate_value_types()
-    validate_size()
     validate_command()
+
+
+def validate_message_size(message: EncodedMessage) -> None:
+    """Ensure an encoded payload does not exceed the size limit."""
+    max_size = socket_protocol.get_max_payload_size()
+    if message.size > max_size:
+        raise SizeError(f"Payload too large (max {max_size} bytes).")
+
+
+def get_encoder(wire_format: str) -> Callable[[dict[str, Any]], bytes]:
+    """Return the function encoding payloads in a wire format."""
+    encoders: dict[str, Callable[[dict[str, Any]], bytes]] = {
+        PICKLE_FORMAT: pickle.dumps,
+        BINARY_FORMAT: encode_binary_payload,
+    }
+    return encoders[wire_format]
+
+
+def get_decoder(wire_format: str) -> Callable[[bytes | bytearray], dict[str, Any]]:
+    """Return the function decoding payloads from a wire format."""
+    decoders: dict[str, Callable[[bytes | bytearray], dict[str, Any]]] = {
+        PICKLE_FORMAT: pickle.loads,
+        BINARY_FORMAT: decode_binary_payload,
+    }
+    return decoders[wire_format]
+
+
+# Binary wire format:
+#   header: version, command opcode, status opcode, presence flags, filename length,
+#           details length, file data length, extension count
+#   body:   filename, details, extensions, file data
+# Each extension carries one further payload key as: key length, key, value type, value.
+_BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct(">BBBBHIQH")
+_EXTENSION_KEY_LENGTH = struct.Struct(">B")
+_EXTENSION_TYPE = struct.Struct(">B")
+_EXTENSION_INT = struct.Struct(">q")
+_EXTENSION_LENGTH = struct.Struct(">I")
+
+_COMMAND_OPCODES = {
+    None: 0, PUT_VAL: 1, GET_VAL: 2, LIST_VAL: 3, HELLO_VAL: 4, STATS_VAL: 5, MPUT_VAL: 6, MGET_VAL: 7, SIMILAR_VAL: 8,
+}
+_STATUS_OPCODES = {None: 0, REQUEST_VAL: 1, OK_VAL: 2, ERROR_VAL: 3, MISSING_VAL: 4, NOT_MODIFIED_VAL: 5}
+_COMMAND_VALUES = {opcode: value for value, opcode in _COMMAND_OPCODES.items()}
+_STATUS_VALUES = {opcode: value for value, opcode in _STATUS_OPCODES.items()}
+
+_HAS_FILENAME = 1 << 0
+_HAS_DETAILS = 1 << 1
+_HAS_FILE_DATA = 1 << 2
+
+_BOOL_TYPE = 0
+_INT_TYPE = 1
+_STR_TYPE = 2
+_BYTES_TYPE = 3
+
+_FIXED_KEYS = {COMMAND_KEY, STATUS_KEY, DETAILS_KEY, FILENAME_KEY, FILE_DATA_KEY}
+
+
+def encode_binary_payload(payload: dict[str, Any]) -> bytes:
+    """Encode a payload in the binary wire format. Keys whose value is None are omitted."""
+    filename = _encode_optional_str(payload[FILENAME_KEY])
+    details = _encode_optional_str(payload[DETAILS_KEY])
+    file_data = payload[FILE_DATA_KEY]
+
+    flags = 0
+    if filename is not None:
+        flags |= _HAS_FILENAME
+    if details is not None:
+        flags |= _HAS_DETAILS
+    if file_data is not None:
+        flags |= _HAS_FILE_DATA
+
+    extensions = [
+        _encode_extension(key, value)
+        for key, value in payload.items()
+        if key not in _FIXED_KEYS and value is not None
+    ]
+
+    try:
+        header = _BINARY_HEADER.pack(
+            _BINARY_VERSION,
+            _COMMAND_OPCODES[payload[COMMAND_KEY]],
+            _STATUS_OPCODES[payload[STATUS_KEY]],
+            flags,
+            len(filename or b""),
+            len(details or b""),
+            len(file_data or b""),
+            len(extensions),
+        )
+    except (KeyError, struct.error) as e:
+        raise WireFormatError(f"Cannot encode payload in the binary wire format: {e}.")
+
+    return b"".join([header, filename or b"", details or b"", *extensions, file_data or b""])
+
+
+def decode_binary_payload(data: bytes | bytearray) -> dict[str, Any]:
+    """Decode a payload from the binary wire format."""
+    try:
+        return _decode_binary_payload(memoryview(data))
+    except (struct.error, KeyError, IndexError, UnicodeDecodeError) as e:
+        raise WireFormatError(f"Malformed message in the binary wire format: {e!r}.")
+
+
+def _encode_optional_str(value: str | None) -> bytes | None:
+    return None if value is None else value.encode()
+
+
+def _encode_extension(key: str, value: Any) -> bytes:
+    """Encode one extension key and its value."""
+    encoded_key = key.encode()
+    prefix = _EXTENSION_KEY_LENGTH.pack(len(encoded_key)) + encoded_key
+
+    if isinstance(value, bool):
+        return prefix + _EXTENSION_TYPE.pack(_BOOL_TYPE) + bytes([value])
+    if isinstance(value, int):
+        return prefix + _EXTENSION_TYPE.pack(_INT_TYPE) + _EXTENSION_INT.pack(value)
+    if isinstance(value, str):
+        encoded_value = value.encode()
+        return prefix + _EXTENSION_TYPE.pack(_STR_TYPE) + _EXTENSION_LENGTH.pack(len(encoded_value)) + encoded_value
+    if isinstance(value, bytes):
+        return prefix + _EXTENSION_TYPE.pack(_BYTES_TYPE) + _EXTENSION_LENGTH.pack(len(value)) + value
+    raise WireFormatError(f"Cannot encode '{key}' of type {type(value).__name__} in the binary wire format.")
+
+
+def _decode_binary_payload(view: memoryview) -> dict[str, Any]:
+    (
+        version,
+        command_opcode,
+        status_opcode,
+        flags,
+        filename_length,
+        details_length,
+        file_data_length,
+        extension_count,
+    ) = _BINARY_HEADER.unpack_from(view)
+    if version != _BINARY_VERSION:
+        raise WireFormatError(f"Unsupported binary wire format version: {version}.")
+
+    offset = _BINARY_HEADER.size
+    filename = str(view[offset:offset + filename_length], "utf-8")
+    offset += filename_length
+    details = str(view[offset:offset + details_length], "utf-8")
+    offset += details_length
+
+    payload: dict[str, Any] = {
+        COMMAND_KEY: _COMMAND_VALUES[command_opcode],
+        STATUS_KEY: _STATUS_VALUES[status_opcode],
+        FILENAME_KEY: filename if flags & _HAS_FILENAME else None,
+        DETAILS_KEY: details if flags & _HAS_DETAILS else None,
+    }
+    for _ in range(extension_count):
+        key, value, offset = _decode_extension(view, offset)
+        payload[key] = value
+
+    if len(view) - offset != file_data_length:
+        raise WireFormatError("File data length does not match the message length.")
+    payload[FILE_DATA_KEY] = bytes(view[offset:]) if flags & _HAS_FILE_DATA else None
+    return payload
+
+
+def _decode_extension(view: memoryview, offset: int) -> tuple[str, Any, int]:
+    """Decode one extension starting at offset. Return its key, its value and the offset after it."""
+    (key_length,) = _EXTENSION_KEY_LENGTH.unpack_from(view, offset)
+    offset += _EXTENSION_KEY_LENGTH.size
+    key = str(view[offset:offset + key_length], "utf-8")
+    offset += key_length
+    (value_type,) = _EXTENSION_TYPE.unpack_from(view, offset)
+    offset += _EXTENSION_TYPE.size
+
+    if value_type == _BOOL_TYPE:
+        return key, bool(view[offset]), offset + 1
+    if value_type == _INT_TYPE:
+        (int_value,) = _EXTENSION_INT.unpack_from(view, offset)
+        return key, int_value, offset + _EXTENSION_INT.size
+    if value_type in (_STR_TYPE, _BYTES_TYPE):
+        (length,) = _EXTENSION_LENGTH.unpack_from(view, offset)
+        offset += _EXTENSION_LENGTH.size
+        if offset + length > len(view):
+            raise WireFormatError("Message ended inside an extension.")
+        value = bytes(view[offset:offset + length])
+        return key, value.decode() if value_type == _STR_TYPE else value, offset + length
+    raise WireFormatError(f"Unknown extension value type: {value_type}.")
@@ -1,9 +1,13 @@
+from dataclasses import dataclass
 from typing import Any, Callable, Literal
 import pickle
 
 # Message protocol constants
 _PAYLOAD_SIZE_BYTES_COUNT = 4  # Number of prefix bytes describing payload size
+_FLAGS_BYTES_COUNT = 1  # Number of bytes after the size in flagged frames, naming how the payload is compressed
 _ENDIANNESS: Literal["big", "little"] = "big"
+STREAM_CHUNK_SIZE = 64 * 1024  # Maximum number of bytes of a streamed body held in memory at once
+HANDSHAKE_MARKER = bytes(_PAYLOAD_SIZE_BYTES_COUNT)  # An empty frame, which no encoded payload produces
 
 
 def get_max_payload_size(size_bytes_count: int = _PAYLOAD_SIZE_BYTES_COUNT) -> int:
@@ -12,29 +16,115 @@ def get_max_payload_size(size_bytes_count: int = _PAYLOAD_SIZE_BYTES_COUNT) -> i
     return size
 
 
-def get_payload_size(payload: Any) -> int:
-    """Return the number of bytes used to encode a payload."""
-    data = pickle.dumps(payload)
-    return len(data)
+@dataclass(frozen=True)
+class EncodedMessage:
+    """A payload together with its encoding, so that it is only ever encoded once."""
+    payload: Any
+    data: bytes
 
+    @property
+    def size(self) -> int:
+        """Return the number of bytes used to encode the payload."""
+        return len(self.data)
 
-def frame_message(payload: Any) -> bytes:
-    """Wrap a pickled payload with its length prefix."""
-    data = pickle.dumps(payload)
-    size = len(data)
-    header = size.to_bytes(_PAYLOAD_SIZE_BYTES_COUNT, _ENDIANNESS)
-    return header + data
 
+def encode_message(payload: Any, encode_fn: Callable[[Any], bytes] = pickle.dumps) -> EncodedMessage:
+    """Encode a payload once, keeping both the payload and its bytes."""
+    return EncodedMessage(payload, encode_fn(payload))
+
+
+def frame_message(
+    message: EncodedMessage,
+    compress_fn: Callable[[bytes], tuple[int, bytes]] | None = None,
+) -> tuple[bytes, bytes]:
+    """
+    Return the header and the encoded payload of a message.
+    They are kept as separate buffers so that they can be sent without being joined.
+    The header is the length prefix, followed in flagged frames by the flag that compress_fn returns with the
+    payload to send. Frames are flagged only if compress_fn is given.
+    """
+    if compress_fn is None:
+        return message.size.to_bytes(_PAYLOAD_SIZE_BYTES_COUNT, _ENDIANNESS), message.data
+    flag, data = compress_fn(message.data)
+    header = len(data).to_bytes(_PAYLOAD_SIZE_BYTES_COUNT, _ENDIANNESS) + flag.to_bytes(_FLAGS_BYTES_COUNT, _ENDIANNESS)
+    return header, data
+
+
+def frame_handshake(message: EncodedMessage) -> tuple[bytes, bytes, bytes]:
+    """Return the handshake marker followed by the length prefix and the encoded payload of a message."""
+    return HANDSHAKE_MARKER, *frame_message(message)
+
+
+def unframe_message(
+    receive_data_from_sock_fn: Callable[[int], bytes | bytearray],
+    decode_fn: Callable[[bytes | bytearray], Any] = pickle.loads,
+    handshake_decode_fn: Callable[[bytes | bytearray], Any] | None = None,
+    decompress_fn: Callable[[int, bytes | bytearray], bytes | bytearray] | None = None,
+) -> Any:
+    """
+    Receive and decode a framed message from a socket.
+    A message following the handshake marker is decoded with handshake_decode_fn instead.
+    Frames are flagged only if decompress_fn is given, which restores their payload given the flag.
+    Handshakes, which are never flagged, are only accepted on connections whose frames are not flagged.
+    """
+    if decompress_fn is not None:
+        # Receive the flag along with the length prefix, saving a call per message.
+        header = receive_data_from_sock_fn(_PAYLOAD_SIZE_BYTES_COUNT + _FLAGS_BYTES_COUNT)
+        size = int.from_bytes(header[:_PAYLOAD_SIZE_BYTES_COUNT], _ENDIANNESS)
+        flag = int.from_bytes(header[_PAYLOAD_SIZE_BYTES_COUNT:], _ENDIANNESS)
+        return decode_fn(decompress_fn(flag, receive_data_from_sock_fn(size)))
 
-def unframe_message(receive_data_from_sock_fn: Callable[[int], bytes]) -> Any:
-    """Receive and unpickle a framed message from a socket."""
     header = receive_data_from_sock_fn(_PAYLOAD_SIZE_BYTES_COUNT)
+    if header == HANDSHAKE_MARKER and handshake_decode_fn is not None:
+        return unframe_message(receive_data_from_sock_fn, handshake_decode_fn)
+
     size = int.from_bytes(header, _ENDIANNESS)
     data = receive_data_from_sock_fn(size)
-    payload = pickle.loads(data)
+    payload = decode_fn(data)
     return payload
 
 
+def stream_body(
+    read_chunk_into_fn: Callable[[memoryview], int],
+    send_data_fn: Callable[[memoryview], bool],
+    size: int,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> bool:
+    """
+    Send a raw body of a known size as a sequence of bounded chunks, reusing a single chunk buffer.
+    Return False if the connection closed before the whole body was sent.
+    """
+    buffer = memoryview(bytearray(min(chunk_size, size)))
+    remaining = size
+    while remaining:
+        chunk_length = read_chunk_into_fn(buffer[:min(chunk_size, remaining)])
+        if not chunk_length:
+            raise EOFError(f"Body ended {remaining} bytes before its announced size.")
+        if not send_data_fn(buffer[:chunk_length]):
+            return False
+        remaining -= chunk_length
+    return True
+
+
+def unstream_body(
+    receive_data_into_fn: Callable[[memoryview], None],
+    write_chunk_fn: Callable[[memoryview], Any],
+    size: int,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> None:
+    """
+    Receive a raw body of a known size in bounded chunks, reusing a single chunk buffer.
+    Each chunk is passed on as it arrives.
+    """
+    buffer = memoryview(bytearray(min(chunk_size, size)))
+    remaining = size
+    while remaining:
+        chunk = buffer[:min(chunk_size, remaining)]
+        receive_data_into_fn(chunk)
+        write_chunk_fn(chunk)
+        remaining -= len(chunk)
+
+
 def _validate_payload_size_bytes_count(count: int) -> None:
     """Ensure the byte count for payload size is within the valid range."""
     _MIN_COUNT = 1
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import NamedTuple
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024  # Bytes
+_MAX_ENTRY_FRACTION = 8  # A single file may use at most this fraction of the cache.
+
+
+class CacheStats(NamedTuple):
+    """Counters describing how well a cache is sized for its workload."""
+    hits: int
+    misses: int
+    evictions: int
+    entry_count: int
+    size: int
+    max_size: int
+
+
+class ImageCache:
+    """
+    A thread-safe, byte-bounded LRU cache of file contents, keyed by filename.
+    Files are stored exactly as they are sent as a streamed body, so a hit skips both disk and encoding.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        if max_size < 0:
+            raise ValueError("Cache size must not be negative.")
+        self._max_size = max_size
+        self._max_entry_size = max_size // _MAX_ENTRY_FRACTION
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = Lock()
+
+    def admits(self, file_size: int) -> bool:
+        """Return whether a file of this size would be cached."""
+        return 0 < file_size <= self._max_entry_size
+
+    def get(self, filename: str) -> bytes | None:
+        """Return the cached contents of a file, or None if it is not cached."""
+        with self._lock:
+            file_data = self._entries.get(filename)
+            if file_data is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(filename)
+            self._hits += 1
+            return file_data
+
+    def put(self, filename: str, file_data: bytes) -> None:
+        """Cache the contents of a file, evicting the least recently used files to make room."""
+        if not self.admits(len(file_data)):
+            return
+        with self._lock:
+            self._remove(filename)
+            self._entries[filename] = file_data
+            self._size += len(file_data)
+            while self._size > self._max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._evictions += 1
+
+    def invalidate(self, filename: str) -> None:
+        """Drop a file from the cache, if it is cached."""
+        with self._lock:
+            self._remove(filename)
+
+    def get_stats(self) -> CacheStats:
+        """Return the cache's counters."""
+        with self._lock:
+            return CacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self._size,
+                self._max_size,
+            )
+
+    def _remove(self, filename: str) -> None:
+        """Drop a file from the cache. The lock must be held."""
+        file_data = self._entries.pop(filename, None)
+        if file_data is not None:
+            self._size -= len(file_data)
@@ -1,10 +1,52 @@
 from file_service.server.networking import run_server
-from file_service.server.server_io import get_port
+from file_service.server.server_io import (
+    get_port,
+    get_engine,
+    get_max_connections,
+    get_wire_formats,
+    get_cache_size,
+    get_persist_catalog,
+    get_storage_layout,
+    get_codecs,
+    get_workers,
+    get_collect_metrics,
+    get_variant_processes,
+    get_durability,
+    get_group_commit_window,
+    get_max_client_connections,
+    get_client_rate,
+    get_bulk_slots,
+    get_idle_timeout,
+    get_read_timeout,
+    get_log_level,
+    get_log_queue,
+)
+from file_service.utilities.debug import configure_logging
 
 
 def main() -> None:
     """Start the server on the selected port."""
-    run_server(get_port())
+    configure_logging(get_log_level(), get_log_queue())
+    run_server(
+        get_port(),
+        get_engine(),
+        get_max_connections(),
+        get_wire_formats(),
+        get_cache_size(),
+        get_persist_catalog(),
+        get_storage_layout(),
+        get_codecs(),
+        get_workers(),
+        get_collect_metrics(),
+        get_variant_processes(),
+        get_durability(),
+        get_group_commit_window(),
+        get_max_client_connections(),
+        get_client_rate(),
+        get_bulk_slots(),
+        get_idle_timeout(),
+        get_read_timeout(),
+    )
 
 
 if __name__ == "__main__":
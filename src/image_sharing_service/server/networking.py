@@ -1,21 +1,116 @@
-from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+import asyncio
+import socket as socket_module
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from socket import socket, AF_INET, MSG_PEEK, SHUT_WR, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from threading import BoundedSemaphore, Condition, Event
+from typing import Callable, Iterator, cast
 
-from file_service.server import requests
-from file_service.utilities.debug import print_error
+from file_service.protocol.bundle import BundleError
+from file_service.protocol.compression import CODECS, CompressionError
+from file_service.protocol.message import WIRE_FORMATS, WireFormatError
+from file_service.server import requests, workers as worker_processes
+from file_service.server.cache import DEFAULT_CACHE_SIZE, ImageCache
+from file_service.server.scheduler import (
+    DEFAULT_BULK_SLOTS,
+    DEFAULT_CLIENT_RATE,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_CLIENT_CONNECTIONS,
+    DEFAULT_READ_TIMEOUT,
+    Scheduler,
+)
+from file_service.server.stream_socket import StreamSocket
+from file_service.server.similarity import PerceptualHasher
+from file_service.server.variants import CAN_RESIZE, DEFAULT_VARIANT_PROCESSES, VariantGenerator
+from file_service.utilities import metrics, storage
+from file_service.utilities.durability import (
+    DEFAULT_GROUP_COMMIT_WINDOW,
+    DURABILITY_GROUP,
+    DURABILITY_MODES,
+    DURABILITY_OFF,
+    create_syncer,
+)
+from file_service.utilities.storage_backends import FLAT_LAYOUT, LAYOUTS, create_backend
+from file_service.utilities.debug import print_debug, print_error, print_info
 
 _HOST = "0.0.0.0"
 
+# Concurrency engines
+SEQUENTIAL_ENGINE = "sequential"
+THREADS_ENGINE = "threads"
+ASYNCIO_ENGINE = "asyncio"
+ENGINES = (SEQUENTIAL_ENGINE, THREADS_ENGINE, ASYNCIO_ENGINE)
 
-def run_server(port: int) -> None:
-    """Start the server and handle incoming client connections."""
-    listening_socket = socket(AF_INET, SOCK_STREAM)
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_WORKERS = 1
 
-    # Allow immediate reuse of the address and port to prevent
-    # "Address already in use" errors when restarting the server.
-    listening_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+_ACCEPT_TIMEOUT = 0.5  # Seconds
+_LINGER_TIMEOUT = 1.0  # Seconds a connection closed by a stopping server waits for the client to close it too
+_LINGER_BUFFER_SIZE = 64 * 1024
+
+# Lets each worker process listen on its own socket, the kernel spreading connections evenly across them.
+# Without it, workers accept from one socket they inherit.
+_CAN_REUSE_PORT = hasattr(socket_module, "SO_REUSEPORT")
 
+# Set once the server stops accepting clients, to let the requests in progress finish before it exits.
+_stopping = Event()
+# Stops the asyncio engine accepting clients, once it has started. The other engines check between accepts.
+_stop_accepting_fn: Callable[[], None] | None = None
+_requests_in_progress = 0
+_requests_in_progress_changed = Condition()
+
+# Shares the server between clients: limits each one's connections and rate, and applies the timeouts.
+_scheduler = Scheduler()
+
+
+def run_server(
+    port: int,
+    engine: str = THREADS_ENGINE,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    wire_formats: tuple[str, ...] = WIRE_FORMATS,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    persist_catalog: bool = False,
+    storage_layout: str = FLAT_LAYOUT,
+    codecs: tuple[str, ...] = CODECS,
+    workers: int = DEFAULT_WORKERS,
+    collect_metrics: bool = False,
+    variant_processes: int = DEFAULT_VARIANT_PROCESSES,
+    durability: str = DURABILITY_OFF,
+    group_commit_window: float = DEFAULT_GROUP_COMMIT_WINDOW,
+    max_client_connections: int = DEFAULT_MAX_CLIENT_CONNECTIONS,
+    client_rate: float = DEFAULT_CLIENT_RATE,
+    bulk_slots: int = DEFAULT_BULK_SLOTS,
+    idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    read_timeout: float = DEFAULT_READ_TIMEOUT,
+) -> None:
+    """
+    Start the server and handle incoming client connections.
+    With more than one worker, clients are served by that many forked processes, sharing the stored files.
+    If collect_metrics is set, requests are measured and clients may fetch the measurements with STATS.
+    Downscaled variants of images are generated by variant_processes processes, if Pillow is installed; 0 disables them.
+    The same processes compute the perceptual hashes of images that SIMILAR requests search.
+    With a durability mode other than off, uploads are synced to disk before they are acknowledged; in group mode,
+    concurrent uploads share each sync, committed at least group_commit_window seconds after the first of them.
+    Each client, told apart by its IP address, may be served on up to max_client_connections connections at once,
+    and send and receive up to client_rate bytes per second. Transfers of large files take turns in bulk_slots slots,
+    ahead of which smaller requests go. Connections idle for idle_timeout seconds between requests, or stalled for
+    read_timeout seconds during one, are closed. A value of 0 disables any of these.
+    """
     try:
         _validate_port(port)
+        _validate_engine(engine)
+        _validate_max_connections(max_connections)
+        _validate_wire_formats(wire_formats)
+        _validate_cache_size(cache_size)
+        _validate_storage_layout(storage_layout)
+        _validate_codecs(codecs)
+        _validate_workers(workers)
+        _validate_variant_processes(variant_processes)
+        _validate_durability(durability, group_commit_window)
+        _validate_client_limits(max_client_connections, client_rate)
+        _validate_bulk_slots(bulk_slots)
+        _validate_timeouts(idle_timeout, read_timeout)
     except (ValueError, OSError) as e:
         error_messages = {
             ValueError: str(e),
@@ -25,31 +120,322 @@ def run_server(port: int) -> None:
         print_error(error_message)
         return
 
-    listening_socket.bind((_HOST, port))
-    listening_socket.listen()
+    # Set up once: workers inherit all of this when they are forked.
+    global _scheduler
+    _scheduler = Scheduler(max_client_connections, client_rate, bulk_slots, idle_timeout, read_timeout)
+    requests.set_scheduler(_scheduler)
+    requests.set_accepted_wire_formats(wire_formats)
+    requests.set_accepted_codecs(codecs)
+    requests.set_image_cache(ImageCache(cache_size))
+    storage.set_backend(create_backend(storage_layout))
+    storage.set_syncer(create_syncer(durability, group_commit_window))
+    storage.open_content_store()
+    storage.clean_staging_area()
+    catalog = storage.open_catalog(persist_catalog, shared=workers > 1)
+    if collect_metrics:
+        metrics.enable()
+    if variant_processes and CAN_RESIZE:
+        # The pool is started by the first request for a variant, in whichever worker serves it.
+        variant_generator = VariantGenerator(variant_processes)
+        requests.set_variant_generator(variant_generator)
+        requests.set_perceptual_hasher(PerceptualHasher(variant_generator, variant_processes))
+        similarity_index = storage.open_similarity_index()
+        print_debug("Indexed the perceptual hashes of %s stored images.", len(similarity_index))
     print(f"Server up and running on {_HOST}:{port}...")
+    print_debug("Using the %s engine with at most %s concurrent clients.", engine, max_connections)
+    print_debug("Caching at most %s bytes of hot images.", cache_size)
+    print_debug("Catalogued %s stored files.", len(catalog))
+    print_debug("Collecting metrics: %s.", collect_metrics)
+    print_debug("Durability: %s.", durability)
+    print_debug(
+        "Each client may use %s connections at %s bytes per second; %s bulk transfers at once.",
+        max_client_connections or "unlimited",
+        client_rate or "unlimited",
+        bulk_slots or "unlimited",
+    )
+    print_debug("Timeouts: %s seconds idle, %s seconds stalled.", idle_timeout or "none", read_timeout or "none")
+    if variant_processes and not CAN_RESIZE:
+        print_debug("Resized variants and similarity search are not available, as Pillow is not installed.")
 
-    with listening_socket:
+    if workers == 1:
+        try:
+            with _listen(port) as listening_socket:
+                serve(listening_socket, engine, max_connections)
+        finally:
+            requests.close_variant_generator()
+    elif _CAN_REUSE_PORT:
+        print_debug("Each of %s workers listens on its own socket.", workers)
+        worker_processes.run_workers(
+            workers,
+            lambda: serve(_listen(port, reuse_port=True), engine, max_connections),
+            stop_serving,
+        )
+    else:
+        print_debug("%s workers share one listening socket.", workers)
+        with _listen(port) as listening_socket:
+            worker_processes.run_workers(
+                workers,
+                partial(serve, listening_socket, engine, max_connections),
+                stop_serving,
+            )
+
+
+def serve(listening_socket: socket, engine: str, max_connections: int) -> None:
+    """Handle the clients connecting to a listening socket with a concurrency engine, until it stops accepting."""
+    # Accepting wakes up periodically to check whether the server is stopping. Accepted sockets still block.
+    listening_socket.settimeout(_ACCEPT_TIMEOUT)
+    # Each worker tries, so that a replacement takes over the backfill of a worker that stopped midway.
+    requests.start_perceptual_hash_backfill()
+    if engine == SEQUENTIAL_ENGINE:
         handle_clients(listening_socket)
+    elif engine == THREADS_ENGINE:
+        handle_clients_threaded(listening_socket, max_connections)
+    else:
+        asyncio.run(handle_clients_asyncio(listening_socket, max_connections))
+
+
+def stop_serving(timeout: float) -> bool:
+    """
+    Stop accepting clients, then wait up to timeout seconds for the requests in progress to finish.
+    Return whether they did. From then on, each connection is closed once its current request is handled.
+    """
+    _stopping.set()
+    if _stop_accepting_fn is not None:
+        _stop_accepting_fn()
+    with _requests_in_progress_changed:
+        finished = _requests_in_progress_changed.wait_for(lambda: _requests_in_progress == 0, timeout)
+    requests.close_variant_generator()
+    return finished
 
 
 def handle_clients(listening_socket: socket) -> None:
     """Accept and handle client connections one at a time."""
-    while True:
-        client_socket, client_address = listening_socket.accept()
-        handle_client(client_socket, client_address)
+    while not _stopping.is_set():
+        client = _accept(listening_socket)
+        if client is not None and _admit(*client):
+            try:
+                handle_client(*client)
+            finally:
+                _scheduler.release(client[1][0])
+
+
+def handle_clients_threaded(listening_socket: socket, max_connections: int) -> None:
+    """Accept client connections and handle each one on a bounded pool of worker threads."""
+    slots = BoundedSemaphore(max_connections)
+
+    def handle_client_in_slot(client_socket: socket, client_address: tuple[str, int]) -> None:
+        try:
+            handle_client(client_socket, client_address)
+        except Exception as e:
+            print_error("Unexpected error while handling %s: %s.", client_address, e)
+        finally:
+            _scheduler.release(client_address[0])
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        while not _stopping.is_set():
+            # Apply backpressure: stop accepting while every slot is busy,
+            # leaving new clients queued in the listen backlog.
+            slots.acquire()
+            client = _accept(listening_socket)
+            if client is None or not _admit(*client):
+                slots.release()
+                continue
+            executor.submit(handle_client_in_slot, *client)
+
+
+async def handle_clients_asyncio(listening_socket: socket, max_connections: int) -> None:
+    """
+    Accept client connections on an event loop.
+    Idle connections cost no thread; each request is handled on a bounded pool of worker threads.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(max_connections)
+    executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client_address = writer.get_extra_info("peername")
+        if not _scheduler.admit(client_address[0]):
+            print_info("%s was refused, as it has too many connections already.", client_address)
+            writer.close()
+            return
+        try:
+            # Apply backpressure: connections beyond the limit wait here without being read.
+            async with slots:
+                print_info("%s has connected.", client_address)
+                stream_socket = StreamSocket(reader, writer, loop, _scheduler.read_timeout)
+                # The handlers only use the socket methods that StreamSocket provides.
+                client_socket = _scheduler.throttle(cast(socket, stream_socket), client_address[0])
+                requests.open_connection(client_socket)
+                metrics.open_connection()
+                try:
+                    while True:
+                        # Wait for the start of the next request on the event loop,
+                        # then hand it to the synchronous handlers.
+                        try:
+                            first_byte = await asyncio.wait_for(reader.read(1), _scheduler.idle_timeout)
+                        except asyncio.TimeoutError:
+                            print_info("%s disconnected after being idle for too long.", client_address)
+                            break
+                        if not first_byte:
+                            raise ConnectionError("Connection closed.")
+                        stream_socket.unread(first_byte)
+                        with _request_in_progress():
+                            await loop.run_in_executor(executor, requests.handle_request, client_socket)
+                            if _stopping.is_set():
+                                await _linger_asyncio(reader, writer)
+                                print_info("%s disconnected as the server is stopping.", client_address)
+                                break
+                except ConnectionError:
+                    print_info("%s has disconnected.", client_address)
+                except TimeoutError:
+                    print_info("%s disconnected after stalling mid-request.", client_address)
+                except (WireFormatError, CompressionError, BundleError) as e:
+                    print_error("Disconnecting %s: %s", client_address, e)
+                except Exception as e:
+                    print_error("Unexpected error while handling %s: %s.", client_address, e)
+                finally:
+                    metrics.close_connection()
+                    writer.close()
+        finally:
+            _scheduler.release(client_address[0])
+
+    global _stop_accepting_fn
+    with executor:
+        server = await asyncio.start_server(handle_connection, sock=listening_socket)
+
+        def stop_accepting() -> None:
+            loop.call_soon_threadsafe(server.close)
+
+        _stop_accepting_fn = stop_accepting
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                if not _stopping.is_set():
+                    raise
+            # No longer accepting: keep serving the connections already accepted until the process exits.
+            await asyncio.Future()
 
 
 def handle_client(client_socket: socket, client_address: tuple[str, int]) -> None:
-    """Handle messages from a connected client until disconnection."""
-    print(f"{client_address} has connected.")
+    """Handle messages from a connected client, admitted by the scheduler, until disconnection."""
+    print_info("%s has connected.", client_address)
+    connection = _scheduler.throttle(client_socket, client_address[0])
+    requests.open_connection(connection)
+    metrics.open_connection()
     with client_socket:
-        while True:
+        try:
+            _handle_requests(client_socket, connection, client_address)
+        finally:
+            metrics.close_connection()
+
+
+def _handle_requests(client_socket: socket, connection: socket, client_address: tuple[str, int]) -> None:
+    """
+    Handle the requests on a connection until it closes, until it is idle or stalled for too long, or until the
+    server stops. The requests are handled through connection, a view of the client socket that may throttle it.
+    """
+    while True:
+        try:
+            # Wait for the start of the next request before counting it as in progress.
+            client_socket.settimeout(_scheduler.idle_timeout)
             try:
-                requests.handle_request(client_socket)
-            except ConnectionError:
-                print(f"{client_address} has disconnected.")
+                if not client_socket.recv(1, MSG_PEEK):
+                    raise ConnectionError("Connection closed.")
+            except TimeoutError:
+                print_info("%s disconnected after being idle for too long.", client_address)
                 break
+            client_socket.settimeout(_scheduler.read_timeout)
+            with _request_in_progress():
+                requests.handle_request(connection)
+                if _stopping.is_set():
+                    _linger(client_socket)
+                    print_info("%s disconnected as the server is stopping.", client_address)
+                    break
+        except ConnectionError:
+            print_info("%s has disconnected.", client_address)
+            break
+        except TimeoutError:
+            print_info("%s disconnected after stalling mid-request.", client_address)
+            break
+        except (WireFormatError, CompressionError, BundleError) as e:
+            print_error("Disconnecting %s: %s", client_address, e)
+            break
+
+
+def _listen(port: int, reuse_port: bool = False) -> socket:
+    """Return a socket listening on a port, which other sockets may listen on too if reuse_port is set."""
+    listening_socket = socket(AF_INET, SOCK_STREAM)
+
+    # Allow immediate reuse of the address and port to prevent
+    # "Address already in use" errors when restarting the server.
+    listening_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    if reuse_port:
+        listening_socket.setsockopt(SOL_SOCKET, socket_module.SO_REUSEPORT, 1)
+    listening_socket.bind((_HOST, port))
+    listening_socket.listen()
+    return listening_socket
+
+
+def _accept(listening_socket: socket) -> tuple[socket, tuple[str, int]] | None:
+    """Accept a client connection, or return None if none arrives before the accept timeout."""
+    try:
+        return listening_socket.accept()
+    except TimeoutError:
+        return None
+
+
+def _admit(client_socket: socket, client_address: tuple[str, int]) -> bool:
+    """
+    Admit an accepted connection with the scheduler, which must be told once it closes. Return whether it was admitted;
+    if not, because its client has too many connections already, it is closed.
+    """
+    if _scheduler.admit(client_address[0]):
+        return True
+    print_info("%s was refused, as it has too many connections already.", client_address)
+    client_socket.close()
+    return False
+
+
+def _linger(client_socket: socket) -> None:
+    """
+    Prepare to close a connection between requests without losing the responses sent on it:
+    stop sending, then discard any requests the client sent meanwhile until it closes the connection too.
+    Closing with requests unread would reset the connection, discarding responses the client has not read yet.
+    The client sees the connection closed, and sends the discarded requests again on another.
+    """
+    try:
+        client_socket.shutdown(SHUT_WR)
+        client_socket.settimeout(_LINGER_TIMEOUT)
+        while client_socket.recv(_LINGER_BUFFER_SIZE):
+            pass
+    except OSError:
+        pass
+
+
+async def _linger_asyncio(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Prepare to close a connection between requests on an event loop without losing the responses sent on it."""
+    try:
+        writer.write_eof()
+        while await asyncio.wait_for(reader.read(_LINGER_BUFFER_SIZE), _LINGER_TIMEOUT):
+            pass
+    except (OSError, asyncio.TimeoutError):
+        pass
+
+
+@contextmanager
+def _request_in_progress() -> Iterator[None]:
+    """Count a request as in progress while it is handled, so that stopping can wait for it to finish."""
+    global _requests_in_progress
+    with _requests_in_progress_changed:
+        _requests_in_progress += 1
+    try:
+        yield
+    finally:
+        with _requests_in_progress_changed:
+            _requests_in_progress -= 1
+            _requests_in_progress_changed.notify_all()
 
 
 def _validate_port(port: int) -> None:
@@ -60,6 +446,86 @@ def _validate_port(port: int) -> None:
     if not _MIN_PORT <= port <= _MAX_PORT:
         raise ValueError(f"Port must be between {_MIN_PORT} and {_MAX_PORT}.")
 
-    # Raises OSError if the port is already in use or unavailable.
+    # Raises OSError if the port is already in use or unavailable. Like the listening socket, the test ignores
+    # connections lingering from a previous run, which the server closes first when stopping.
     with socket(AF_INET, SOCK_STREAM) as test_socket:
+        test_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
         test_socket.bind((_HOST, port))
+
+
+def _validate_engine(engine: str) -> None:
+    """Validate that the concurrency engine is supported."""
+    if engine not in ENGINES:
+        raise ValueError(f"Engine must be one of: {', '.join(ENGINES)}.")
+
+
+def _validate_max_connections(max_connections: int) -> None:
+    """Validate that at least one client can be served at a time."""
+    if max_connections < 1:
+        raise ValueError("Maximum connections must be at least 1.")
+
+
+def _validate_wire_formats(wire_formats: tuple[str, ...]) -> None:
+    """Validate that at least one wire format is accepted and that all of them are supported."""
+    if not wire_formats or not set(wire_formats) <= set(WIRE_FORMATS):
+        raise ValueError(f"Wire formats must be one or more of: {', '.join(WIRE_FORMATS)}.")
+
+
+def _validate_cache_size(cache_size: int) -> None:
+    """Validate that the image cache size is not negative. A size of 0 disables the cache."""
+    if cache_size < 0:
+        raise ValueError("Cache size must not be negative.")
+
+
+def _validate_storage_layout(storage_layout: str) -> None:
+    """Validate that the storage layout is supported."""
+    if storage_layout not in LAYOUTS:
+        raise ValueError(f"Storage layout must be one of: {', '.join(LAYOUTS)}.")
+
+
+def _validate_codecs(codecs: tuple[str, ...]) -> None:
+    """Validate that every compression codec is supported. No codecs disables compression."""
+    if not set(codecs) <= set(CODECS):
+        raise ValueError(f"Compression codecs must be among: {', '.join(CODECS)}.")
+
+
+def _validate_workers(workers: int) -> None:
+    """Validate that at least one process serves clients, and that several can be started on this platform."""
+    if workers < 1:
+        raise ValueError("Workers must be at least 1.")
+    if workers > 1 and not worker_processes.CAN_FORK:
+        raise ValueError("Several workers need a platform that can fork processes.")
+
+
+def _validate_variant_processes(variant_processes: int) -> None:
+    """Validate the number of processes generating variants, 0 disabling variants."""
+    if variant_processes < 0:
+        raise ValueError("Variant processes must not be negative.")
+
+
+def _validate_durability(durability: str, group_commit_window: float) -> None:
+    """Validate the durability mode, and the group commit window if it commits in groups."""
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Durability must be one of: {', '.join(DURABILITY_MODES)}.")
+    if durability == DURABILITY_GROUP and group_commit_window < 0:
+        raise ValueError("Group commit window must not be negative.")
+
+
+def _validate_client_limits(max_client_connections: int, client_rate: float) -> None:
+    """Validate the connections and rate each client is limited to, 0 leaving them unlimited."""
+    if max_client_connections < 0:
+        raise ValueError("Maximum connections per client must not be negative.")
+    if client_rate < 0:
+        raise ValueError("Client rate must not be negative.")
+
+
+def _validate_bulk_slots(bulk_slots: int) -> None:
+    """Validate the number of bulk transfers served at once, 0 leaving it unlimited."""
+    if bulk_slots < 0:
+        raise ValueError("Bulk slots must not be negative.")
+
+
+def _validate_timeouts(idle_timeout: float, read_timeout: float) -> None:
+    """Validate the idle and read timeouts, 0 disabling them."""
+    if idle_timeout < 0 or read_timeout < 0:
+        raise ValueError("Timeouts must not be negative.")
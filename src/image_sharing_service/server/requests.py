@@ -1,63 +1,248 @@
+import json
+from io import BufferedReader
 from socket import socket
 from typing import Any
 
-from file_service.utilities import storage, message as message_utilities
+from file_service.server.cache import ImageCache
+from file_service.server.scheduler import Scheduler
+from file_service.server.similarity import DEFAULT_SIMILAR_LIMIT, MAX_SIMILAR_LIMIT, PerceptualHasher, SimilarityError
+from file_service.server.variants import VariantError, VariantGenerator
+from file_service.utilities import metrics, storage, message as message_utilities
+from file_service.utilities.content_store import DigestError, validate_digest
+from file_service.utilities.durability import DurabilityError
+from file_service.utilities.storage import StagingError
 from file_service.protocol import message as message_protocol
+from file_service.protocol.bundle import ENTRY_ERROR
+from file_service.protocol.compression import CODECS
 from file_service.protocol.message import (
     COMMAND_KEY,
+    DETAILS_KEY,
     FILENAME_KEY,
     FILE_DATA_KEY,
+    FILE_SIZE_KEY,
+    STREAM_KEY,
+    REQUEST_ID_KEY,
+    PREFIX_KEY,
+    CURSOR_KEY,
+    LIMIT_KEY,
+    DIGEST_KEY,
+    OFFSET_KEY,
+    LENGTH_KEY,
+    FEATURES_KEY,
+    MAX_DIMENSION_KEY,
+    ENTRY_COUNT_KEY,
+    IF_NONE_MATCH_KEY,
     PUT_VAL,
     GET_VAL,
     LIST_VAL,
+    HELLO_VAL,
+    STATS_VAL,
+    MPUT_VAL,
+    MGET_VAL,
+    SIMILAR_VAL,
     OK_VAL,
     ERROR_VAL,
+    MISSING_VAL,
+    NOT_MODIFIED_VAL,
+    FEATURES,
+    PICKLE_FORMAT,
+    BINARY_FORMAT,
+    WIRE_FORMATS,
     CommandError,
 )
-from file_service.utilities.debug import print_debug, print_error, print_command_report
+from file_service.protocol.socket import EncodedMessage
+from file_service.utilities.debug import debug_enabled, print_debug, print_error, print_command_report
+from file_service.utilities.metrics import SERIALIZE_PHASE
+
+# Wire formats that clients may negotiate, in order of preference.
+_accepted_wire_formats: tuple[str, ...] = WIRE_FORMATS
+
+# Compression codecs that clients may negotiate.
+_accepted_codecs: tuple[str, ...] = CODECS
+
+# Contents of recently requested files, served to GET requests without touching the disk.
+_image_cache = ImageCache()
+
+# Lets small requests go ahead of bulk transfers, which take turns.
+_scheduler = Scheduler()
+
+# Generates the downscaled variants of images asked for by GET requests, or None if variants are not available.
+_variant_generator: VariantGenerator | None = None
+
+# Computes the perceptual hashes of saved images, to answer SIMILAR requests by, or None if they are not available.
+_perceptual_hasher: PerceptualHasher | None = None
+
+
+def set_accepted_wire_formats(wire_formats: tuple[str, ...]) -> None:
+    """Set the wire formats that clients may negotiate, in order of preference."""
+    global _accepted_wire_formats
+    _accepted_wire_formats = wire_formats
+
+
+def set_accepted_codecs(codecs: tuple[str, ...]) -> None:
+    """Set the compression codecs that clients may negotiate."""
+    global _accepted_codecs
+    _accepted_codecs = codecs
+
+
+def set_image_cache(image_cache: ImageCache) -> None:
+    """Set the cache serving GET requests."""
+    global _image_cache
+    _image_cache = image_cache
+
+
+def set_scheduler(scheduler: Scheduler) -> None:
+    """Set what schedules the transfers of files, letting small requests go ahead of bulk ones."""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def set_variant_generator(variant_generator: VariantGenerator | None) -> None:
+    """Set what generates downscaled variants of images, or None if they are not available."""
+    global _variant_generator
+    _variant_generator = variant_generator
+
+
+def set_perceptual_hasher(perceptual_hasher: PerceptualHasher | None) -> None:
+    """Set what computes the perceptual hashes of images, or None if similarity search is not available."""
+    global _perceptual_hasher
+    _perceptual_hasher = perceptual_hasher
+
+
+def start_perceptual_hash_backfill() -> None:
+    """Hash the stored images whose hashes are not recorded in the background, if similarity search is available."""
+    if _perceptual_hasher is not None:
+        _perceptual_hasher.start_backfill()
+
+
+def close_variant_generator() -> None:
+    """
+    Stop the processes generating variants and perceptual hashes, if any were started, e.g. before the server exits.
+    """
+    if _perceptual_hasher is not None:
+        _perceptual_hasher.close()
+    if _variant_generator is not None:
+        _variant_generator.close()
+
+
+def get_image_cache() -> ImageCache:
+    """Return the cache serving GET requests, e.g. to read its counters."""
+    return _image_cache
+
+
+def open_connection(sock: socket) -> None:
+    """Prepare a newly accepted connection. If pickle is not accepted, clients must negotiate another format."""
+    if PICKLE_FORMAT not in _accepted_wire_formats:
+        message_utilities.set_wire_format(sock, BINARY_FORMAT)
 
 
 def handle_request(sock: socket) -> None:
-    """Handle a single client request and perform the corresponding action."""
+    """
+    Handle a single client request and perform the corresponding action.
+    Clients may pipeline several requests: they wait in the socket buffer and are answered in arrival order,
+    each response tagged with the ID of its request.
+    If metrics are enabled, the request is measured from when it starts arriving until its response is sent.
+    """
+    metrics.start_request()
     request = message_utilities.receive_message(sock)
     command = request[COMMAND_KEY]
-    print_debug(f"Received a request with command: {command}.")
-
-    if command == PUT_VAL:
-        handle_put_request(sock, request)
-    elif command == GET_VAL:
-        handle_get_request(sock, request)
-    elif command == LIST_VAL:
-        handle_list_request(sock, request)
-    else:
-        raise CommandError(f"Unknown command received from client: {command}.")
+    print_debug("Received a request with command: %s.", command)
+
+    try:
+        if command == PUT_VAL:
+            handle_put_request(sock, request)
+        elif command == GET_VAL:
+            handle_get_request(sock, request)
+        elif command == LIST_VAL:
+            handle_list_request(sock, request)
+        elif command == HELLO_VAL:
+            handle_hello_request(sock, request)
+        elif command == STATS_VAL:
+            handle_stats_request(sock, request)
+        elif command == MPUT_VAL:
+            handle_mput_request(sock, request)
+        elif command == MGET_VAL:
+            handle_mget_request(sock, request)
+        elif command == SIMILAR_VAL:
+            handle_similar_request(sock, request)
+        else:
+            raise CommandError(f"Unknown command received from client: {command}.")
+    finally:
+        metrics.finish_request(command)
 
 
 def handle_put_request(sock: socket, request: dict[str, Any]) -> None:
-    """Handle a PUT request from the client."""
-    filename, file_data = request[FILENAME_KEY], request[FILE_DATA_KEY]
+    """
+    Handle a PUT request from the client, whose file is either inline, streamed after the request,
+    or stored content referred to by its digest.
+    A streamed file carrying its digest is staged under it, so an interrupted upload can resume from where it stopped.
+    If durable writes are enabled, the file is synced to disk before the upload is acknowledged.
+    A large streamed file is received once a bulk slot is free.
+    """
+    filename, file_size = request[FILENAME_KEY], request.get(FILE_SIZE_KEY)
+    digest = request.get(DIGEST_KEY)
     try:
-        storage.save_local_file(filename, file_data)
-    except (ValueError, FileExistsError) as e:
+        if file_size is None and request[FILE_DATA_KEY] is None and digest is not None:
+            if not storage.link_local_file(filename, digest):
+                offset = storage.get_staged_size(digest)
+                print_debug("Asking for the content of '%s' from byte %d.\n\tDigest: %s", filename, offset, digest)
+                _send_response(sock, request, MISSING_VAL, offset=offset)
+                return
+        elif file_size is None:
+            storage.save_local_file(filename, request[FILE_DATA_KEY])
+        else:
+            with _scheduler.transfer(file_size):
+                if digest is not None:
+                    _receive_resumable_file(sock, filename, digest, request.get(OFFSET_KEY) or 0, file_size)
+                else:
+                    message_utilities.receive_local_file(sock, filename, file_size)
+    except (ValueError, FileExistsError, DurabilityError) as e:
         error_messages = {
             ValueError: f"Cannot save '{filename}' on the server because it is empty",
+            DigestError: f"Cannot save '{filename}' on the server because its digest is invalid",
+            StagingError: f"Cannot save '{filename}' on the server: {e}",
             FileExistsError: f"Cannot save '{filename}' on the server since it already exists",
+            DurabilityError: f"Cannot save '{filename}' on the server durably: {e}",
         }
-        error_message = error_messages[type(e)]
+        # Other subclasses of ValueError, such as UnicodeDecodeError, describe themselves.
+        error_message = error_messages.get(type(e), f"Cannot save '{filename}' on the server: {e}")
         print_error(error_message)
         print_command_report(sock, PUT_VAL, False, filename, error_message)
         _send_error_response(sock, request, error_message)
         return
 
+    _image_cache.invalidate(filename)
+    _hash_later(filename)
     print_command_report(sock, PUT_VAL, True, filename)
     _send_ok_response(sock, request)
 
 
 def handle_get_request(sock: socket, request: dict[str, Any]) -> None:
-    """Handle a GET request from the client."""
+    """
+    Handle a GET request from the client, streaming the file if the client accepts it.
+    Small files are served from, and added to, the image cache; others are streamed straight from the storage file.
+    Large files are sent once a bulk slot is free.
+    A request with an offset or length gets only that range of the file, read from disk.
+    A request with a max dimension gets a downscaled variant of the image instead.
+    Responses carry the digest of the file's content, its ETag: a request whose if-none-match is still the digest
+    is answered NOT_MODIFIED, without the file.
+    """
+    if request.get(MAX_DIMENSION_KEY) is not None:
+        _handle_variant_request(sock, request)
+        return
+
     filename = request[FILENAME_KEY]
+    offset, length = request.get(OFFSET_KEY), request.get(LENGTH_KEY)
+    is_ranged = offset is not None or length is not None
     try:
-        file_data = storage.get_local_file(filename)
+        digest = storage.get_local_digest(filename)
+        if digest is not None and request.get(IF_NONE_MATCH_KEY) == digest:
+            print_command_report(sock, GET_VAL, True, filename)
+            print_debug("'%s' is not modified.", filename)
+            _send_response(sock, request, NOT_MODIFIED_VAL, digest=digest)
+            return
+        file_data = None if is_ranged else _image_cache.get(filename)
+        file = storage.open_local_file(filename) if file_data is None else None
     except FileNotFoundError:
         error_message = f"Cannot find '{filename}' on the server"
         print_error(error_message)
@@ -65,52 +250,354 @@ def handle_get_request(sock: socket, request: dict[str, Any]) -> None:
         _send_error_response(sock, request, error_message)
         return
 
-    print_command_report(sock, GET_VAL, True, filename)
-    _send_ok_response(sock, request, file_data=file_data)
+    if file is None:
+        print_command_report(sock, GET_VAL, True, filename)
+        if debug_enabled():
+            print_debug("Serving '%s' from the image cache.\n\tStats: %s", filename, _image_cache.get_stats())
+        with _scheduler.transfer(len(file_data or b"")):
+            _send_file_data(sock, request, file_data or b"", digest=digest)
+        return
+
+    with file:
+        file_data = _send_file(sock, request, file, digest=digest)
+    if file_data is not None:
+        _image_cache.put(filename, file_data)
 
 
 def handle_list_request(sock: socket, request: dict[str, Any]) -> None:
-    """Handle a LIST request from the client."""
-    filenames = storage.get_local_list()
+    """
+    Handle a LIST request from the client, answering with one page of the filenames starting with the requested
+    prefix and the cursor of the next page. Clients that send no limit receive every matching filename.
+    """
+    prefix = request.get(PREFIX_KEY) or ""
+    limit = request.get(LIMIT_KEY)
+    if limit is not None and limit < 1:
+        error_message = "List limit must be at least 1"
+        print_command_report(sock, LIST_VAL, False, error_message=error_message)
+        _send_error_response(sock, request, error_message)
+        return
 
-    if not filenames:
-        error_message = "There are no local files or directories stored on the server"
+    entries, next_cursor = storage.get_local_list(prefix, request.get(CURSOR_KEY), limit)
+    if not entries and request.get(CURSOR_KEY) is None:
+        error_message = "There are no local files stored on the server"
+        if prefix:
+            error_message += f" whose names start with '{prefix}'"
         print_command_report(sock, LIST_VAL, False, error_message=error_message)
         _send_error_response(sock, request, error_message)
+        return
 
     print_command_report(sock, LIST_VAL, True)
-    _send_ok_response(sock, request, details="\n".join(filenames))
+    _send_ok_response(sock, request, details="\n".join(entry.name for entry in entries), cursor=next_cursor)
+
+
+def handle_hello_request(sock: socket, request: dict[str, Any]) -> None:
+    """Handle a HELLO request from the client, choosing the wire format for the rest of the connection."""
+    offered_wire_formats = (request[DETAILS_KEY] or "").split(",")
+    # Handshake responses are always encoded in the binary wire format.
+    message_utilities.set_wire_format(sock, BINARY_FORMAT)
+
+    wire_format = next((f for f in _accepted_wire_formats if f in offered_wire_formats), None)
+    if wire_format is None:
+        error_message = f"None of the offered wire formats are accepted: {', '.join(_accepted_wire_formats)}"
+        print_error(error_message)
+        print_command_report(sock, HELLO_VAL, False, error_message=error_message)
+        _send_error_response(sock, request, error_message)
+        return
+
+    offered_features = (request.get(FEATURES_KEY) or "").split(",")
+    features = frozenset(
+        f for f in FEATURES if f in offered_features and (f not in CODECS or f in _accepted_codecs)
+    )
 
+    print_command_report(sock, HELLO_VAL, True)
+    _send_ok_response(sock, request, details=wire_format, features=",".join(sorted(features)) or None)
+    message_utilities.set_wire_format(sock, wire_format)
+    message_utilities.set_features(sock, features)
 
 
-def _send_ok_response(
+def handle_stats_request(sock: socket, request: dict[str, Any]) -> None:
+    """Handle a STATS request from the client, answering with the server's metrics and image cache counters."""
+    server_metrics = metrics.get_metrics()
+    if server_metrics is None:
+        error_message = "Metrics are not enabled on the server"
+        print_command_report(sock, STATS_VAL, False, error_message=error_message)
+        _send_error_response(sock, request, error_message)
+        return
+
+    stats = server_metrics.snapshot()
+    stats["cache"] = _image_cache.get_stats()._asdict()
+    print_command_report(sock, STATS_VAL, True)
+    _send_ok_response(sock, request, details=json.dumps(stats))
+
+
+def handle_mput_request(sock: socket, request: dict[str, Any]) -> None:
+    """
+    Handle an MPUT request from the client, saving in turn each file of the bundle streamed after it, in a bulk slot.
+    Entries may carry the error that kept the client from reading a file instead.
+    Answer once for the whole bundle, with a JSON list in DETAILS holding for each entry, in order,
+    None if its file was saved or the error message if it was not. The request is reported once too.
+    """
+    errors: list[str | None] = []
+    # The size of a bundle is only known once it is received, so each one is a bulk transfer.
+    with _scheduler.transfer():
+        for _ in range(request.get(ENTRY_COUNT_KEY) or 0):
+            header, filename = message_utilities.receive_bundle_entry(sock)
+            if header.status == ENTRY_ERROR:
+                errors.append(message_utilities.receive_bundle_entry_data(sock, header.size).decode(errors="replace"))
+            else:
+                errors.append(_receive_bundle_file(sock, filename, header.size))
+
+    _report_bundle(sock, MPUT_VAL, errors)
+    _send_ok_response(sock, request, details=json.dumps(errors))
+
+
+def handle_mget_request(sock: socket, request: dict[str, Any]) -> None:
+    """
+    Handle an MGET request from the client, answering with a bundle holding an entry for each file named in
+    DETAILS, one per line, in order: the file, or the error message if it cannot be sent.
+    The bundle is sent in a bulk slot, and the request is reported once for the whole bundle.
+    """
+    filenames = request[DETAILS_KEY].split("\n") if request[DETAILS_KEY] else []
+    _send_ok_response(sock, request, entry_count=len(filenames))
+    with _scheduler.transfer():
+        errors = [_send_bundle_file(sock, filename) for filename in filenames]
+    _report_bundle(sock, MGET_VAL, errors)
+
+
+def handle_similar_request(sock: socket, request: dict[str, Any]) -> None:
+    """
+    Handle a SIMILAR request from the client, answering with the stored images whose perceptual hashes are nearest
+    that of the image named, nearest first, as a JSON list of [filename, distance] pairs in DETAILS. The distance
+    is the number of bits in which the hashes differ. The request's limit, if any, is how many images to answer with.
+    """
+    filename = request[FILENAME_KEY]
+    limit = request.get(LIMIT_KEY)
+    limit = DEFAULT_SIMILAR_LIMIT if limit is None else limit
+    try:
+        if _perceptual_hasher is None:
+            raise SimilarityError("similarity search is not available on the server")
+        if not 1 <= limit <= MAX_SIMILAR_LIMIT:
+            raise SimilarityError(f"the limit must be between 1 and {MAX_SIMILAR_LIMIT}")
+        perceptual_hash = _perceptual_hasher.get_hash(filename)
+    except (FileNotFoundError, SimilarityError) as e:
+        error_messages = {
+            FileNotFoundError: f"Cannot find '{filename}' on the server",
+            SimilarityError: f"Cannot find images similar to '{filename}': {e}",
+        }
+        error_message = error_messages[type(e)]
+        print_error(error_message)
+        print_command_report(sock, SIMILAR_VAL, False, filename, error_message)
+        _send_error_response(sock, request, error_message)
+        return
+
+    similar_files = storage.find_similar_files(perceptual_hash, limit, exclude=filename)
+    print_command_report(sock, SIMILAR_VAL, True, filename)
+    _send_ok_response(sock, request, details=json.dumps(similar_files))
+
+
+def _handle_variant_request(sock: socket, request: dict[str, Any]) -> None:
+    """Handle a GET request for a downscaled variant of an image, generating the variant if it is not cached."""
+    filename, max_dimension = request[FILENAME_KEY], request[MAX_DIMENSION_KEY]
+    try:
+        if _variant_generator is None:
+            raise VariantError("resized variants are not available on the server")
+        if max_dimension < 1:
+            raise VariantError("the max dimension must be at least 1")
+        file, dimension = _variant_generator.open_variant(filename, max_dimension)
+    except (FileNotFoundError, VariantError) as e:
+        error_messages = {
+            FileNotFoundError: f"Cannot find '{filename}' on the server",
+            VariantError: f"Cannot resize '{filename}': {e}",
+        }
+        error_message = error_messages[type(e)]
+        print_error(error_message)
+        print_command_report(sock, GET_VAL, False, filename, error_message)
+        _send_error_response(sock, request, error_message)
+        return
+
+    with file:
+        _send_file(sock, request, file, max_dimension=dimension)
+
+
+def _send_file(sock: socket, request: dict[str, Any], file: BufferedReader, **kwargs) -> bytes | None:  # type: ignore
+    """
+    Send an open file, or the range of it requested, in answer to a GET request.
+    Return the file's content if it was read whole and the image cache would keep it, or None.
+    """
+    file_size = storage.get_file_size(file)
+    offset, length = request.get(OFFSET_KEY), request.get(LENGTH_KEY)
+    with _scheduler.transfer(file_size if length is None else min(length, file_size)):
+        if offset is not None or length is not None:
+            _send_file_range(sock, request, file, file_size, offset or 0, length, **kwargs)
+            return None
+        print_command_report(sock, GET_VAL, True, request[FILENAME_KEY])
+        if request.get(STREAM_KEY) and not _image_cache.admits(file_size):
+            _send_ok_response(sock, request, file_size=file_size, **kwargs)
+            message_utilities.send_stream(sock, file, file_size)
+            return None
+        file_data = file.read()
+        _send_file_data(sock, request, file_data, **kwargs)
+    return file_data
+
+
+def _receive_bundle_file(sock: socket, filename: str, size: int) -> str | None:
+    """
+    Save the body of an MPUT entry as a new local file. Return None if it was saved, or the error message if not,
+    after draining the body.
+    """
+    try:
+        message_utilities.receive_local_file(sock, filename, size)
+    except (FileExistsError, DurabilityError) as e:
+        error_messages = {
+            FileExistsError: f"Cannot save '{filename}' on the server since it already exists",
+            DurabilityError: f"Cannot save '{filename}' on the server durably: {e}",
+        }
+        error_message = error_messages[type(e)]
+        print_debug("%s.", error_message)
+        return error_message
+    _image_cache.invalidate(filename)
+    _hash_later(filename)
+    return None
+
+
+def _send_bundle_file(sock: socket, filename: str) -> str | None:
+    """
+    Send a file as an entry of an MGET bundle, from the image cache if it holds it, adding it if it would keep it.
+    Return None if it was sent, or the error message sent in its place if it cannot be.
+    """
+    file_data = _image_cache.get(filename)
+    if file_data is not None:
+        message_utilities.send_bundle_entry_data(sock, filename, file_data)
+        return None
+    try:
+        file = storage.open_local_file(filename)
+    except FileNotFoundError:
+        error_message = f"Cannot find '{filename}' on the server"
+        print_debug("%s.", error_message)
+        message_utilities.send_bundle_entry_data(sock, filename, error_message.encode(), ENTRY_ERROR)
+        return error_message
+
+    with file:
+        file_size = storage.get_file_size(file)
+        if not _image_cache.admits(file_size):
+            message_utilities.send_bundle_entry(sock, filename, file, file_size)
+            return None
+        file_data = file.read()
+    message_utilities.send_bundle_entry_data(sock, filename, file_data)
+    _image_cache.put(filename, file_data)
+    return None
+
+
+def _hash_later(filename: str) -> None:
+    """Compute the perceptual hash of a newly saved image in the background, if similarity search is available."""
+    if _perceptual_hasher is not None and storage.is_image_file(filename):
+        _perceptual_hasher.hash_later(filename)
+
+
+def _report_bundle(sock: socket, command: str, errors: list[str | None]) -> None:
+    """Report the outcome of a bundle once, given the error message of each entry, None for those that succeeded."""
+    failed_count = sum(error is not None for error in errors)
+    if failed_count:
+        metrics.record_error()
+    print_command_report(
+        sock,
+        command,
+        not failed_count,
+        f"{len(errors)} files",
+        f"{failed_count} of {len(errors)} files failed" if failed_count else None,
+    )
+
+
+def _receive_resumable_file(sock: socket, filename: str, digest: str, offset: int, size: int) -> None:
+    """
+    Receive the streamed body of a PUT request into the file staged under its digest, from offset,
+    and save the file once its content is complete and matches the digest.
+    Raise FileExistsError or DigestError, after draining the body, if the file already exists or the digest is
+    malformed, StagingError if the body cannot be written from offset, and DigestError if the content does not
+    match, in which case the staged file is discarded so that the upload starts over. The staged file is also
+    discarded if another upload saved the file first.
+    """
+    try:
+        validate_digest(digest)
+        if storage.local_file_exists(filename):
+            raise FileExistsError(f"'{filename}' already exists.")
+    except (DigestError, FileExistsError):
+        message_utilities.discard_stream(sock, size)
+        raise
+
+    message_utilities.receive_staged_stream(sock, digest, offset, size)
+    if storage.compute_staged_digest(digest) != digest:
+        storage.discard_staged_file(digest)
+        raise DigestError(f"The content uploaded for '{filename}' does not match its digest.")
+    try:
+        storage.commit_staged_file(digest, filename, digest)
+    except FileExistsError:
+        storage.discard_staged_file(digest)
+        raise
+
+
+def _send_file_range(  # type: ignore
     sock: socket,
     request: dict[str, Any],
-    details: str | None = None,
-    file_data: bytes | None = None,
+    file: BufferedReader,
+    file_size: int,
+    offset: int,
+    length: int | None,
+    **kwargs,
 ) -> None:
+    """Send the range of an open file requested by a GET request, streamed if the client accepts it."""
+    filename = request[FILENAME_KEY]
+    if offset < 0 or offset > file_size or (length is not None and length < 0):
+        error_message = f"Cannot send bytes from {offset} of '{filename}', which has {file_size}"
+        print_error(error_message)
+        print_command_report(sock, GET_VAL, False, filename, error_message)
+        _send_error_response(sock, request, error_message)
+        return
+
+    range_size = file_size - offset if length is None else min(length, file_size - offset)
+    print_command_report(sock, GET_VAL, True, filename)
+    file.seek(offset)
+    if request.get(STREAM_KEY):
+        _send_ok_response(sock, request, file_size=range_size, offset=offset, **kwargs)
+        message_utilities.send_stream(sock, file, range_size)
+    else:
+        _send_ok_response(sock, request, file_data=file.read(range_size), offset=offset, **kwargs)
+
+
+def _send_file_data(sock: socket, request: dict[str, Any], file_data: bytes, **kwargs) -> None:  # type: ignore
+    """Send a success response carrying a file that is in memory, streamed if the client accepts it."""
+    if not request.get(STREAM_KEY):
+        _send_ok_response(sock, request, file_data=file_data, **kwargs)
+        return
+    message = _construct_response(sock, request, OK_VAL, file_size=len(file_data), **kwargs)
+    message_utilities.send_message(sock, message, body=file_data)
+
+
+def _send_ok_response(sock: socket, request: dict[str, Any], **kwargs) -> None:  # type: ignore
     """Send a success response to the client."""
-    _send_response(sock, request, OK_VAL, details, file_data)
+    _send_response(sock, request, OK_VAL, **kwargs)
 
 
 def _send_error_response(sock: socket, request: dict[str, Any], error_message: str) -> None:
     """Send an error response to the client."""
-    _send_response(sock, request, ERROR_VAL, error_message)
+    metrics.record_error()
+    _send_response(sock, request, ERROR_VAL, details=error_message)
 
 
-def _send_response(
-    sock: socket,
-    request: dict[str, Any],
-    status: str,
-    details: str | None = None,
-    file_data: bytes | None = None,
-) -> None:
+def _send_response(sock: socket, request: dict[str, Any], status: str, **kwargs) -> None:  # type: ignore
     """Send a response message to the client."""
-    payload = message_protocol.construct_payload(
-        request[COMMAND_KEY],
-        status,
-        details,
-        request[FILENAME_KEY],
-        file_data,
-    )
-    message_utilities.send_message(sock, payload)
+    message = _construct_response(sock, request, status, **kwargs)
+    message_utilities.send_message(sock, message)
+
+
+def _construct_response(sock: socket, request: dict[str, Any], status: str, **kwargs) -> EncodedMessage:  # type: ignore
+    """Construct a response to a request, encoded in the connection's wire format."""
+    with metrics.phase(SERIALIZE_PHASE):
+        return message_protocol.construct_payload(
+            request[COMMAND_KEY],
+            status,
+            filename=request[FILENAME_KEY],
+            request_id=request.get(REQUEST_ID_KEY),
+            wire_format=message_utilities.get_wire_format(sock),
+            **kwargs,
+        )
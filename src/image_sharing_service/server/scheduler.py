@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import nullcontext
+from socket import socket
+from typing import Any, BinaryIO, ContextManager, cast
+
+from file_service.protocol.socket import STREAM_CHUNK_SIZE
+
+DEFAULT_MAX_CLIENT_CONNECTIONS = 0  # No limit
+DEFAULT_CLIENT_RATE = 0  # Bytes per second; no limit
+DEFAULT_BULK_SLOTS = 8
+DEFAULT_IDLE_TIMEOUT = 300.0  # Seconds
+DEFAULT_READ_TIMEOUT = 60.0  # Seconds
+
+# Transfers of at least this many bytes are bulk transfers, which take turns in the bulk slots.
+BULK_THRESHOLD = 1024 * 1024
+
+_BURST_DURATION = 1.0  # Seconds of its rate that a client may send or receive at once, after pausing
+_THROTTLE_CHUNK_SIZE = STREAM_CHUNK_SIZE  # Most bytes sent at a time on a throttled connection
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket, limiting the average rate at which bytes are taken from it while letting bursts of
+    up to its capacity through at once. Taking more bytes than it holds leaves it in debt, which the taker waits
+    out; concurrent takers are thus served in turn, each at the rate left over by the others.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, byte_count: int) -> None:
+        """Take byte_count tokens, waiting until the bucket has refilled enough to pay for them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate) - byte_count
+            self._updated_at = now
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledSocket:
+    """
+    A socket-like view of a connection that limits the rates at which bytes are received and sent with the token
+    buckets of its client, shared by all of the client's connections.
+    """
+
+    def __init__(self, sock: socket, receive_bucket: TokenBucket, send_bucket: TokenBucket) -> None:
+        self._sock = sock
+        self._receive_bucket = receive_bucket
+        self._send_bucket = send_bucket
+
+    def recv_into(self, buffer: memoryview, byte_count: int = 0) -> int:
+        """Receive up to byte_count bytes into a buffer, returning how many were received, once they are paid for."""
+        received_byte_count = self._sock.recv_into(buffer, byte_count)
+        self._receive_bucket.take(received_byte_count)
+        return received_byte_count
+
+    def sendall(self, data: bytes | memoryview) -> None:
+        """Send all bytes of data, a chunk at a time, each once it is paid for."""
+        view = memoryview(data)
+        for start in range(0, len(view), _THROTTLE_CHUNK_SIZE):
+            chunk = view[start:start + _THROTTLE_CHUNK_SIZE]
+            self._send_bucket.take(len(chunk))
+            self._sock.sendall(chunk)
+
+    def sendmsg(self, buffers: list[memoryview]) -> int:
+        """
+        Send as many bytes of buffers as fit in one system call, returning how many were sent, once they are paid for.
+        Small responses thus still leave in a single segment, rather than waiting for the peer to acknowledge a header.
+        Where the connection cannot gather buffers, they are all sent one after another.
+        """
+        if not hasattr(self._sock, "sendmsg"):
+            for buffer in buffers:
+                self.sendall(buffer)
+            return sum(len(buffer) for buffer in buffers)
+        sent_byte_count = self._sock.sendmsg(buffers)
+        self._send_bucket.take(sent_byte_count)
+        return sent_byte_count
+
+    def sendfile(self, file: BinaryIO, offset: int = 0, count: int | None = None) -> int:
+        """Send a file a chunk at a time, each once it is paid for. Return the bytes sent."""
+        sent_byte_count = 0
+        while count is None or sent_byte_count < count:
+            chunk_size = _THROTTLE_CHUNK_SIZE if count is None else min(_THROTTLE_CHUNK_SIZE, count - sent_byte_count)
+            self._send_bucket.take(chunk_size)
+            chunk_sent_byte_count = self._sock.sendfile(file, offset + sent_byte_count, chunk_size)
+            sent_byte_count += chunk_sent_byte_count
+            if chunk_sent_byte_count < chunk_size:
+                break
+        return sent_byte_count
+
+    def getpeername(self) -> Any:
+        """Return the address of the connected peer."""
+        return self._sock.getpeername()
+
+
+class _Client:
+    """The connections of a client being served, and the token buckets they share."""
+
+    def __init__(self, rate: float) -> None:
+        self.connection_count = 0
+        self.receive_bucket = TokenBucket(rate, rate * _BURST_DURATION) if rate else None
+        self.send_bucket = TokenBucket(rate, rate * _BURST_DURATION) if rate else None
+
+
+class Scheduler:
+    """
+    Shares the server fairly between its clients, told apart by their IP addresses. Each client may be limited to a
+    number of connections at once, and to a rate in bytes per second in each direction, shared by its connections.
+    Bulk transfers take turns in a few slots, so that however many are under way, small requests such as LISTs and
+    small GETs are never queued behind them. Connections are closed once idle or stalled for too long, so that
+    clients that stop sending or reading cannot hold on to the server's threads.
+    A value of 0 disables a limit or timeout.
+    """
+
+    def __init__(
+        self,
+        max_client_connections: int = DEFAULT_MAX_CLIENT_CONNECTIONS,
+        client_rate: float = DEFAULT_CLIENT_RATE,
+        bulk_slots: int = DEFAULT_BULK_SLOTS,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+    ) -> None:
+        self._max_client_connections = max_client_connections
+        self._client_rate = client_rate
+        self._bulk_slots = threading.BoundedSemaphore(bulk_slots) if bulk_slots else None
+        self.idle_timeout = idle_timeout or None  # Seconds a connection may wait between requests, or None
+        self.read_timeout = read_timeout or None  # Seconds a request may make no progress for, or None
+        self._clients: dict[str, _Client] = {}
+        self._lock = threading.Lock()
+
+    def admit(self, host: str) -> bool:
+        """
+        Count a new connection from a client, unless the client already has as many as it may.
+        Return whether it was counted; a connection that was not must be closed.
+        """
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = self._clients[host] = _Client(self._client_rate)
+            elif self._max_client_connections and client.connection_count >= self._max_client_connections:
+                return False
+            client.connection_count += 1
+            return True
+
+    def release(self, host: str) -> None:
+        """Count a connection from a client as closed, forgetting the client once it has none left."""
+        with self._lock:
+            client = self._clients[host]
+            client.connection_count -= 1
+            if not client.connection_count:
+                del self._clients[host]
+
+    def throttle(self, sock: socket, host: str) -> socket:
+        """Return a view of an admitted connection from a client that keeps to the client's rate, if it has one."""
+        with self._lock:
+            client = self._clients[host]
+        if client.receive_bucket is None or client.send_bucket is None:
+            return sock
+        # The handlers only use the socket methods that ThrottledSocket provides.
+        return cast(socket, ThrottledSocket(sock, client.receive_bucket, client.send_bucket))
+
+    def transfer(self, size: int | None = None) -> ContextManager[Any]:
+        """
+        Return a context in which to transfer size bytes of files. A bulk transfer, of at least BULK_THRESHOLD bytes
+        or of an unknown size, waits for a bulk slot and holds it until the context exits.
+        """
+        if self._bulk_slots is None or (size is not None and size < BULK_THRESHOLD):
+            return nullcontext()
+        return self._bulk_slots
@@ -1,12 +1,192 @@
+import argparse
 import sys
+from functools import cache
 
-from file_service.utilities.debug import print_debug
+from file_service.protocol.compression import CODECS
+from file_service.protocol.message import WIRE_FORMATS
+from file_service.server.cache import DEFAULT_CACHE_SIZE
+from file_service.server.networking import ENGINES, THREADS_ENGINE, DEFAULT_MAX_CONNECTIONS, DEFAULT_WORKERS
+from file_service.server.scheduler import (
+    DEFAULT_BULK_SLOTS,
+    DEFAULT_CLIENT_RATE,
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_CLIENT_CONNECTIONS,
+    DEFAULT_READ_TIMEOUT,
+)
+from file_service.server.variants import DEFAULT_VARIANT_PROCESSES
+from file_service.utilities.debug import DEFAULT_LOG_LEVEL, LOG_LEVELS, print_debug
+from file_service.utilities.durability import DEFAULT_GROUP_COMMIT_WINDOW, DURABILITY_MODES, DURABILITY_OFF
+from file_service.utilities.storage_backends import FLAT_LAYOUT, LAYOUTS
 
+_BYTES_PER_MIB = 1024 * 1024
+_MILLISECONDS_PER_SECOND = 1000
 
 # Erroneous user inputs are not caught because the brief did not specify that such validation was required.
 
 def get_port() -> int:
     """Retrieve the port number from the command-line arguments."""
-    port = int(sys.argv[1])
+    port: int = _parse_arguments().port
     print_debug(f"User inputted port: {port}.")
     return port
+
+
+def get_engine() -> str:
+    """Retrieve the concurrency engine from the command-line arguments."""
+    engine: str = _parse_arguments().engine
+    print_debug(f"User inputted engine: {engine}.")
+    return engine
+
+
+def get_max_connections() -> int:
+    """Retrieve the maximum number of concurrently served clients from the command-line arguments."""
+    max_connections: int = _parse_arguments().max_connections
+    print_debug(f"User inputted max connections: {max_connections}.")
+    return max_connections
+
+
+def get_wire_formats() -> tuple[str, ...]:
+    """Retrieve the wire formats that clients may negotiate from the command-line arguments."""
+    wire_formats = tuple(_parse_arguments().wire_formats)
+    print_debug(f"User inputted wire formats: {', '.join(wire_formats)}.")
+    return wire_formats
+
+
+def get_cache_size() -> int:
+    """Retrieve the image cache size in bytes from the command-line arguments, which give it in MiB."""
+    cache_size = int(_parse_arguments().cache_size * _BYTES_PER_MIB)
+    print_debug(f"User inputted cache size: {cache_size} bytes.")
+    return cache_size
+
+
+def get_persist_catalog() -> bool:
+    """Retrieve whether the storage catalog is persisted across restarts from the command-line arguments."""
+    persist_catalog: bool = _parse_arguments().persist_catalog
+    print_debug(f"User inputted persist catalog: {persist_catalog}.")
+    return persist_catalog
+
+
+def get_storage_layout() -> str:
+    """Retrieve the layout of the storage directory from the command-line arguments."""
+    storage_layout: str = _parse_arguments().storage_layout
+    print_debug(f"User inputted storage layout: {storage_layout}.")
+    return storage_layout
+
+
+def get_codecs() -> tuple[str, ...]:
+    """Retrieve the compression codecs that clients may negotiate from the command-line arguments."""
+    codecs = tuple(_parse_arguments().compression)
+    print_debug(f"User inputted compression codecs: {', '.join(codecs) or 'none'}.")
+    return codecs
+
+
+def get_workers() -> int:
+    """Retrieve the number of worker processes serving clients from the command-line arguments."""
+    workers: int = _parse_arguments().workers
+    print_debug(f"User inputted workers: {workers}.")
+    return workers
+
+
+def get_collect_metrics() -> bool:
+    """Retrieve whether the server collects metrics, served by the STATS command, from the command-line arguments."""
+    collect_metrics: bool = _parse_arguments().metrics
+    print_debug(f"User inputted metrics: {collect_metrics}.")
+    return collect_metrics
+
+
+def get_variant_processes() -> int:
+    """Retrieve the number of processes generating downscaled variants of images from the command-line arguments."""
+    variant_processes: int = _parse_arguments().variant_processes
+    print_debug(f"User inputted variant processes: {variant_processes}.")
+    return variant_processes
+
+
+def get_durability() -> str:
+    """Retrieve how uploads are synced to disk before they are acknowledged from the command-line arguments."""
+    durability: str = _parse_arguments().durability
+    print_debug(f"User inputted durability: {durability}.")
+    return durability
+
+
+def get_group_commit_window() -> float:
+    """Retrieve the group commit window in seconds from the command-line arguments, which give it in milliseconds."""
+    group_commit_window: float = _parse_arguments().group_commit_window / _MILLISECONDS_PER_SECOND
+    print_debug(f"User inputted group commit window: {group_commit_window} seconds.")
+    return group_commit_window
+
+
+def get_max_client_connections() -> int:
+    """Retrieve the maximum number of connections served per client from the command-line arguments."""
+    max_client_connections: int = _parse_arguments().max_client_connections
+    print_debug(f"User inputted max client connections: {max_client_connections}.")
+    return max_client_connections
+
+
+def get_client_rate() -> float:
+    """Retrieve the bytes per second each client may send and receive from the command-line arguments, in MiB."""
+    client_rate: float = _parse_arguments().client_rate * _BYTES_PER_MIB
+    print_debug(f"User inputted client rate: {client_rate} bytes per second.")
+    return client_rate
+
+
+def get_bulk_slots() -> int:
+    """Retrieve the number of bulk transfers served at once from the command-line arguments."""
+    bulk_slots: int = _parse_arguments().bulk_slots
+    print_debug(f"User inputted bulk slots: {bulk_slots}.")
+    return bulk_slots
+
+
+def get_idle_timeout() -> float:
+    """Retrieve the seconds a connection may be idle between requests from the command-line arguments."""
+    idle_timeout: float = _parse_arguments().idle_timeout
+    print_debug(f"User inputted idle timeout: {idle_timeout} seconds.")
+    return idle_timeout
+
+
+def get_read_timeout() -> float:
+    """Retrieve the seconds a request may make no progress for from the command-line arguments."""
+    read_timeout: float = _parse_arguments().read_timeout
+    print_debug(f"User inputted read timeout: {read_timeout} seconds.")
+    return read_timeout
+
+
+def get_log_level() -> str:
+    """Retrieve the level of the messages the server prints from the command-line arguments."""
+    log_level: str = _parse_arguments().log_level
+    print_debug(f"User inputted log level: {log_level}.")
+    return log_level
+
+
+def get_log_queue() -> bool:
+    """Retrieve whether messages are printed by a background thread from the command-line arguments."""
+    log_queue: bool = _parse_arguments().log_queue
+    print_debug(f"User inputted log queue: {log_queue}.")
+    return log_queue
+
+
+@cache
+def _parse_arguments() -> argparse.Namespace:
+    """Parse the server's command-line arguments once."""
+    parser = argparse.ArgumentParser(description="Image sharing service server.")
+    parser.add_argument("port", type=int)
+    parser.add_argument("--engine", choices=ENGINES, default=THREADS_ENGINE)
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--wire-formats", nargs="+", choices=WIRE_FORMATS, default=list(WIRE_FORMATS))
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_SIZE / _BYTES_PER_MIB)
+    parser.add_argument("--persist-catalog", action="store_true")
+    parser.add_argument("--storage-layout", choices=LAYOUTS, default=FLAT_LAYOUT)
+    parser.add_argument("--compression", nargs="*", choices=CODECS, default=list(CODECS))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--metrics", action="store_true")
+    parser.add_argument("--variant-processes", type=int, default=DEFAULT_VARIANT_PROCESSES)
+    parser.add_argument("--durability", choices=DURABILITY_MODES, default=DURABILITY_OFF)
+    parser.add_argument(
+        "--group-commit-window", type=float, default=DEFAULT_GROUP_COMMIT_WINDOW * _MILLISECONDS_PER_SECOND
+    )
+    parser.add_argument("--max-client-connections", type=int, default=DEFAULT_MAX_CLIENT_CONNECTIONS)
+    parser.add_argument("--client-rate", type=float, default=DEFAULT_CLIENT_RATE / _BYTES_PER_MIB)
+    parser.add_argument("--bulk-slots", type=int, default=DEFAULT_BULK_SLOTS)
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT)
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default=DEFAULT_LOG_LEVEL)
+    parser.add_argument("--log-queue", action="store_true")
+    return parser.parse_args(sys.argv[1:])
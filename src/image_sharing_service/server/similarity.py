@@ -0,0 +1,144 @@
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BufferedWriter
+
+try:
+    from PIL import Image, UnidentifiedImageError
+except ImportError:  # Pillow is optional; without it, similarity search is not available.
+    Image = UnidentifiedImageError = None  # type: ignore[assignment, misc]
+
+from file_service.server.variants import VariantGenerator
+from file_service.utilities import storage
+from file_service.utilities.debug import print_debug, print_error
+
+DEFAULT_SIMILAR_LIMIT = 10  # Images a SIMILAR request is answered with, unless it asks for another number
+MAX_SIMILAR_LIMIT = 1000
+
+# Size in pixels of the grayscale thumbnail a hash is computed from: each row of 9 pixels gives 8 bits.
+_THUMBNAIL_WIDTH = 9
+_THUMBNAIL_HEIGHT = 8
+_HASH_TIMEOUT = 30.0  # Seconds a request waits for a hash before giving up
+_BACKFILL_LOCK_FILENAME = "backfill.lock"  # Held by the process hashing the stored images in the background
+_BACKFILL_TASKS_PER_PROCESS = 2  # Hashes the backfill queues at a time per pool process, leaving room for requests
+
+
+class SimilarityError(Exception):
+    """Raised when the perceptual hash of a stored image cannot be computed."""
+    pass
+
+
+class PerceptualHasher:
+    """
+    Computes the perceptual hashes of stored images in the pool of processes generating variants, and records them
+    in the catalog, whose similarity index answers SIMILAR requests. Images are hashed in the background as they are
+    saved; those saved before, or while no process was hashing, are hashed by a backfill.
+    """
+
+    def __init__(self, variant_generator: VariantGenerator, process_count: int) -> None:
+        self._variant_generator = variant_generator
+        self._backfill_slots = threading.Semaphore(process_count * _BACKFILL_TASKS_PER_PROCESS)
+        self._stopping = threading.Event()
+
+    def hash_later(self, filename: str) -> None:
+        """Compute and record the perceptual hash of a newly saved image in the background."""
+        try:
+            self._submit(filename)
+        except RuntimeError:
+            pass  # The server is stopping; the next backfill hashes the image.
+
+    def get_hash(self, filename: str) -> int:
+        """
+        Return the perceptual hash of a stored image, computing and recording it first if it is not recorded yet.
+        Raise FileNotFoundError if the image is missing, and SimilarityError if it cannot be hashed.
+        """
+        perceptual_hash = storage.get_perceptual_hash(filename)
+        if perceptual_hash is not None:
+            return perceptual_hash
+        try:
+            return self._submit(filename).result(_HASH_TIMEOUT)
+        except RuntimeError:
+            raise SimilarityError("the server is stopping")
+        except FutureTimeoutError:
+            raise SimilarityError(f"hashing it took longer than {_HASH_TIMEOUT:.0f} seconds")
+        except BrokenProcessPool:
+            raise SimilarityError("the process hashing it exited unexpectedly")
+
+    def start_backfill(self) -> None:
+        """
+        Hash the stored images whose hashes are not recorded, in a background thread, unless another process
+        sharing the storage is already doing so.
+        """
+        lock_file = storage.lock_metadata_file(_BACKFILL_LOCK_FILENAME)
+        if lock_file is None:
+            print_debug("Another process is hashing the stored images.")
+            return
+        threading.Thread(target=self._backfill, args=(lock_file,), daemon=True).start()
+
+    def close(self) -> None:
+        """Stop the backfill. Hashes in progress are left to the pool, which stops when the variant generator does."""
+        self._stopping.set()
+
+    def _backfill(self, lock_file: BufferedWriter) -> None:
+        """Hash the stored images whose hashes are not recorded, a few at a time, holding the backfill lock."""
+        with lock_file:
+            filenames = storage.list_unhashed_images()
+            print_debug("Hashing %d stored images in the background.", len(filenames))
+            for filename in filenames:
+                self._backfill_slots.acquire()
+                if self._stopping.is_set():
+                    return
+                try:
+                    future = self._submit(filename)
+                except RuntimeError:
+                    return
+                future.add_done_callback(lambda _: self._backfill_slots.release())
+            print_debug("Queued the hashes of %d stored images.", len(filenames))
+
+    def _submit(self, filename: str) -> Future[int]:
+        """Compute the perceptual hash of a stored image in the pool, and record it once it is computed."""
+        future = self._variant_generator.submit(_compute_perceptual_hash, storage.get_local_filepath(filename))
+        future.add_done_callback(partial(_record_perceptual_hash, filename))
+        return future
+
+
+def _record_perceptual_hash(filename: str, future: Future[int]) -> None:
+    """Record the perceptual hash of an image computed in the pool, or report why it could not be computed."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        if not isinstance(error, BrokenProcessPool):
+            print_error(f"Cannot hash '{filename}': {error}.")
+        return
+    try:
+        storage.record_perceptual_hash(filename, future.result())
+    except FileNotFoundError:
+        return  # Removed behind the server's back
+    print_debug("Hashed '%s'.\n\tPerceptual hash: %016x", filename, future.result())
+
+
+def _compute_perceptual_hash(source_path: str) -> int:
+    """
+    Return the difference hash of an image, whose bits tell whether each pixel of a small grayscale thumbnail is
+    brighter than the pixel to its right. Rescaling, recompressing or lightly editing an image changes few of them.
+    Runs in a pool process. Raise SimilarityError if the image cannot be decoded.
+    """
+    try:
+        with Image.open(source_path) as image:
+            # Decodes JPEGs at a reduced scale straight away, far faster than decoding at full size.
+            image.draft("L", (_THUMBNAIL_WIDTH * 8, _THUMBNAIL_HEIGHT * 8))
+            thumbnail = image.convert("L").resize((_THUMBNAIL_WIDTH, _THUMBNAIL_HEIGHT), Image.Resampling.LANCZOS)
+            pixels = thumbnail.tobytes()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        if isinstance(e, UnidentifiedImageError):
+            raise SimilarityError("it is not an image that can be decoded")
+        raise SimilarityError(f"it could not be decoded: {e}")
+
+    perceptual_hash = 0
+    for row in range(_THUMBNAIL_HEIGHT):
+        row_pixels = pixels[row * _THUMBNAIL_WIDTH:(row + 1) * _THUMBNAIL_WIDTH]
+        for left, right in zip(row_pixels, row_pixels[1:]):
+            perceptual_hash = perceptual_hash << 1 | (left > right)
+    return perceptual_hash
@@ -0,0 +1,87 @@
+import asyncio
+from typing import Any, BinaryIO, Coroutine, TypeVar
+
+_T = TypeVar("_T")
+
+_SENDFILE_CHUNK_SIZE = 1024 * 1024  # Most bytes of a file sent within a single timeout
+
+
+class StreamSocket:
+    """
+    A blocking, socket-like view of an asyncio stream.
+    Lets the synchronous request handlers run in a worker thread while the event loop owns the connection.
+    Like a socket with a timeout, each call raises TimeoutError if the stream makes no progress for timeout seconds.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        loop: asyncio.AbstractEventLoop,
+        timeout: float | None = None,
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._loop = loop
+        self._timeout = timeout
+        self._pending = b""  # Bytes read by the event loop before a handler took over.
+
+    def unread(self, data: bytes) -> None:
+        """Push bytes back so that the next recv() returns them first."""
+        self._pending = data + self._pending
+
+    def recv(self, byte_count: int) -> bytes:
+        """Receive up to byte_count bytes, returning b"" once the peer has closed the stream."""
+        if self._pending:
+            data, self._pending = self._pending[:byte_count], self._pending[byte_count:]
+            return data
+        return self._run(self._reader.read(byte_count))
+
+    def recv_into(self, buffer: memoryview, byte_count: int = 0) -> int:
+        """Receive up to byte_count bytes into a buffer, returning how many were received."""
+        data = self.recv(byte_count or len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def sendall(self, data: bytes | memoryview) -> None:
+        """Send all bytes of data, waiting for the stream to drain."""
+        self._run(self._write(data))
+
+    def sendfile(self, file: BinaryIO, offset: int = 0, count: int | None = None) -> int:
+        """
+        Send a file, using the platform's sendfile where the transport supports it. Return the bytes sent.
+        The file is sent in chunks, each within the timeout, so that a large file is not mistaken for a stalled one.
+        """
+        sent_byte_count = 0
+        while count is None or sent_byte_count < count:
+            chunk_size = _SENDFILE_CHUNK_SIZE if count is None else min(_SENDFILE_CHUNK_SIZE, count - sent_byte_count)
+            chunk_sent_byte_count = self._run(self._sendfile(file, offset + sent_byte_count, chunk_size))
+            sent_byte_count += chunk_sent_byte_count
+            if chunk_sent_byte_count < chunk_size:
+                break
+        return sent_byte_count
+
+    def getpeername(self) -> Any:
+        """Return the address of the connected peer."""
+        return self._writer.get_extra_info("peername")
+
+    async def _write(self, data: bytes | memoryview) -> None:
+        # The transport may keep a reference to what it could not send yet, and callers reuse their buffers.
+        self._writer.write(bytes(data))
+        await self._writer.drain()
+
+    async def _sendfile(self, file: BinaryIO, offset: int, count: int | None) -> int:
+        # Earlier writes may still be buffered in the transport, and must reach the peer first.
+        await self._writer.drain()
+        return await self._loop.sendfile(self._writer.transport, file, offset, count)
+
+    def _run(self, coroutine: Coroutine[Any, Any, _T]) -> _T:
+        """
+        Run a coroutine on the event loop and block the calling thread until it finishes.
+        Raise TimeoutError if it does not finish within the timeout.
+        """
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait_for(coroutine, self._timeout), self._loop)
+        try:
+            return future.result()
+        except asyncio.TimeoutError:  # Distinct from the built-in TimeoutError before Python 3.11
+            raise TimeoutError("The stream made no progress before the timeout.")
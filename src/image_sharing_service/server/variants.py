@@ -0,0 +1,210 @@
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import BufferedReader
+from typing import Any, Callable
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow is optional; without it, the server serves original images only.
+    Image = ImageOps = UnidentifiedImageError = None  # type: ignore[assignment, misc]
+
+from file_service.utilities import storage
+from file_service.utilities.debug import print_debug, print_error
+
+# Longest sides in pixels of the variants that are cached. Requests are rounded up to one of them, so that
+# clients asking for arbitrary sizes cannot fill the disk with variants of every size.
+VARIANT_SIZES = (64, 128, 256, 512, 1024, 2048)
+DEFAULT_VARIANT_PROCESSES = 2
+
+# Whether variants can be generated at all, which needs Pillow.
+CAN_RESIZE = Image is not None
+
+_GENERATION_TIMEOUT = 30.0  # Seconds a request waits for its variant before giving up
+_JPEG_QUALITY = 85  # Previews lose no visible detail at this quality, at a fraction of the size of higher ones.
+_JPEG_MODES = {"1", "L", "RGB", "CMYK"}  # Image modes that JPEG can store as they are
+_TEMPORARY_SUFFIX = ".tmp"
+_PARENT_POLL_INTERVAL = 1.0  # Seconds between checks by a pool process that the server is still running
+
+
+class VariantError(Exception):
+    """Raised when a variant of a stored image cannot be generated."""
+    pass
+
+
+class VariantGenerator:
+    """
+    Generates downscaled variants of stored images in a pool of processes, so that decoding and resizing neither
+    hold the interpreter lock of the process serving clients nor hold up its other requests.
+    Variants are cached on disk in the storage directory. A variant requested again while it is being generated
+    is generated once, for every request waiting for it.
+    """
+
+    def __init__(self, process_count: int = DEFAULT_VARIANT_PROCESSES) -> None:
+        if process_count < 1:
+            raise ValueError("Variant processes must be at least 1.")
+        self._process_count = process_count
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_pid = 0  # Of the process that started the pool, as a forked worker must start its own.
+        self._in_progress: dict[str, Future[None]] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def open_variant(self, filename: str, max_dimension: int) -> tuple[BufferedReader, int]:
+        """
+        Open the variant of a stored image whose longest side is at most max_dimension, rounded up to a cached size,
+        generating it if it is not cached. An image already that small is its own variant.
+        Return the open variant and the size it was rounded up to.
+        Raise FileNotFoundError if the image is missing, and VariantError if it cannot be resized.
+        """
+        dimension = round_variant_size(max_dimension)
+        variant = f"{dimension}px"
+        variant_path = storage.get_variant_path(filename, variant)
+        try:
+            return storage.open_file(variant_path), dimension
+        except FileNotFoundError:
+            pass
+
+        self._generate(storage.get_local_filepath(filename), variant_path, dimension)
+        # Variants of an earlier file of the same name, changed without a PUT, are no longer served.
+        storage.discard_variants(filename, variant, keep_path=variant_path)
+        return storage.open_file(variant_path), dimension
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future[Any]:
+        """
+        Run another function on images in the pool of processes, such as one computing their perceptual hashes.
+        It must be importable by the processes. Return its future, which raises BrokenProcessPool if the process
+        running it exited unexpectedly. Raise RuntimeError if the pool is closed.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The pool of variant processes is closed.")
+            pool = self._get_pool()
+            future = pool.submit(fn, *args)
+        future.add_done_callback(partial(self._check_pool, pool))
+        return future
+
+    def close(self) -> None:
+        """
+        Stop the pool of processes, once the variants being generated are done. Queued ones are cancelled,
+        and no more are generated.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._closed = True
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.shutdown(cancel_futures=True)
+
+    def _generate(self, source_path: str, variant_path: str, dimension: int) -> None:
+        """Generate a variant, or wait for it if it is already being generated."""
+        with self._lock:
+            if self._closed:
+                raise VariantError("the server is stopping")
+            pool = self._get_pool()
+            future = self._in_progress.get(variant_path)
+            if future is None:
+                future = pool.submit(_generate_variant, source_path, variant_path, dimension)
+                self._in_progress[variant_path] = future
+                print_debug("Generating a %d px variant.\n\tPath: %s", dimension, variant_path)
+
+        try:
+            future.result(_GENERATION_TIMEOUT)
+        except FutureTimeoutError:
+            raise VariantError(f"resizing took longer than {_GENERATION_TIMEOUT:.0f} seconds")
+        except BrokenProcessPool:
+            self._drop_pool(pool)
+            raise VariantError("the process resizing it exited unexpectedly")
+        finally:
+            with self._lock:
+                if self._in_progress.get(variant_path) is future:
+                    del self._in_progress[variant_path]
+
+    def _drop_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Forget a pool one of whose processes exited unexpectedly, so that the next task starts a new one."""
+        with self._lock:
+            if self._pool is pool:
+                print_error("A variant process exited unexpectedly; restarting the pool.")
+                self._pool = None
+
+    def _check_pool(self, pool: ProcessPoolExecutor, future: Future[Any]) -> None:
+        """Forget a pool if the process running a task in it exited unexpectedly."""
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._drop_pool(pool)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None or self._pool_pid != os.getpid():
+            # Spawned rather than forked, as the serving process has threads running, whose locks a fork would copy.
+            self._pool = ProcessPoolExecutor(
+                self._process_count,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_pool_process,
+                initargs=(os.getpid(),),
+            )
+            self._pool_pid = os.getpid()
+            self._in_progress.clear()
+        return self._pool
+
+
+def round_variant_size(max_dimension: int) -> int:
+    """Return the smallest cached variant size at least max_dimension, or the largest if none is."""
+    return next((size for size in VARIANT_SIZES if size >= max_dimension), VARIANT_SIZES[-1])
+
+
+def _init_pool_process(server_pid: int) -> None:
+    """
+    Leave the pool's processes to be stopped by the server, when interrupting the terminal signals them too.
+    They inherit the signal mask of the thread that started them, which blocks SIGTERM in a worker.
+    A server killed before it can stop the pool leaves its processes waiting for tasks forever, so each process
+    exits once the server has.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+    threading.Thread(target=_exit_with_server, args=(server_pid,), daemon=True).start()
+
+
+def _exit_with_server(server_pid: int) -> None:
+    """Exit the pool process once the server that started it has exited, and it has been reparented."""
+    while os.getppid() == server_pid:
+        time.sleep(_PARENT_POLL_INTERVAL)
+    os._exit(0)
+
+
+def _generate_variant(source_path: str, variant_path: str, dimension: int) -> None:
+    """
+    Write a variant of an image whose longest side is at most dimension, in the image's format, atomically.
+    Runs in a pool process. Raise VariantError if the image cannot be decoded or encoded.
+    """
+    os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+    temporary_path = f"{variant_path}.{uuid.uuid4().hex}{_TEMPORARY_SUFFIX}"
+    try:
+        with Image.open(source_path) as image:
+            if max(image.size) <= dimension:
+                shutil.copyfile(source_path, temporary_path)
+            else:
+                image_format = image.format
+                # Decodes JPEGs at a reduced scale straight away, far faster than decoding at full size.
+                image.thumbnail((dimension, dimension))
+                variant = ImageOps.exif_transpose(image)  # Previews are shown upright, as viewers show the original.
+                if image_format == "JPEG":
+                    if variant.mode not in _JPEG_MODES:
+                        variant = variant.convert("RGB")
+                    variant.save(temporary_path, format=image_format, quality=_JPEG_QUALITY)
+                else:
+                    variant.save(temporary_path, format=image_format)
+        os.replace(temporary_path, variant_path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+        if isinstance(e, UnidentifiedImageError):
+            raise VariantError("it is not an image that can be decoded")
+        print_error(f"Cannot generate a variant of '{source_path}': {e}.")
+        raise VariantError("it could not be decoded or encoded")
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Callable
+
+from file_service.utilities.debug import print_debug, print_error, stop_logging
+
+DRAIN_TIMEOUT = 10.0  # Seconds a stopping worker waits for its requests in progress to finish
+_RESTART_DELAY = 1.0  # Seconds before replacing a worker that exited unexpectedly, so a crashing worker cannot spin
+_STOP_GRACE = 2.0  # Seconds beyond the drain timeout before a stopping worker is killed
+_POLL_INTERVAL = 0.5  # Seconds between checks for signals while waiting for workers to exit
+
+# Workers are forked so that they inherit the server's state, set up once before they start.
+CAN_FORK = "fork" in multiprocessing.get_all_start_methods()
+
+
+class _Signals:
+    """The signals the supervisor has received and not yet acted on."""
+
+    def __init__(self) -> None:
+        self.stop = False
+        self.restart = False
+
+    def handle(self, signal_number: int, _frame: object) -> None:
+        if signal_number == signal.SIGHUP:
+            self.restart = True
+        else:
+            self.stop = True
+
+
+def run_workers(
+    worker_count: int,
+    serve_fn: Callable[[], None],
+    stop_fn: Callable[[float], bool],
+) -> None:
+    """
+    Serve clients from worker_count forked processes, each calling serve_fn, until SIGTERM or SIGINT.
+    A worker is stopped gracefully with SIGTERM: it calls stop_fn, which stops accepting clients and waits up to
+    the given number of seconds for the requests in progress to finish, returning whether they did.
+    SIGHUP restarts the workers one at a time, each replaced before it is stopped so that clients are always served.
+    Workers that exit unexpectedly are replaced.
+    """
+    signals = _Signals()
+    for signal_number in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signal_number, signals.handle)
+    # Started before forking, so that the workers share it. A worker starting processes of its own would start it
+    # otherwise, and starting it unblocks SIGTERM in the starting thread, which the signal would then kill outright.
+    resource_tracker.ensure_running()
+
+    workers = [_start_worker(serve_fn, stop_fn) for _ in range(worker_count)]
+    print(f"Started {worker_count} workers.")
+    while not signals.stop:
+        wait([worker.sentinel for worker in workers], _POLL_INTERVAL)
+        if signals.restart:
+            signals.restart = False
+            print("Restarting workers...")
+            workers = [_replace_worker(worker, serve_fn, stop_fn) for worker in workers]
+            continue
+        for i, worker in enumerate(workers):
+            if worker.exitcode is not None and not signals.stop:
+                print_error("Worker %s exited with code %s; replacing it.", worker.pid, worker.exitcode)
+                time.sleep(_RESTART_DELAY)
+                workers[i] = _start_worker(serve_fn, stop_fn)
+
+    print("Stopping workers...")
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        _join_stopping_worker(worker)
+    print("Server stopped.")
+
+
+def _start_worker(serve_fn: Callable[[], None], stop_fn: Callable[[float], bool]) -> BaseProcess:
+    worker = multiprocessing.get_context("fork").Process(target=_run_worker, args=(serve_fn, stop_fn))
+    worker.start()
+    print_debug("Worker %s started.", worker.pid)
+    return worker
+
+
+def _replace_worker(
+    worker: BaseProcess,
+    serve_fn: Callable[[], None],
+    stop_fn: Callable[[float], bool],
+) -> BaseProcess:
+    """Start a new worker, then stop the old one gracefully. Return the new worker."""
+    replacement = _start_worker(serve_fn, stop_fn)
+    worker.terminate()
+    _join_stopping_worker(worker)
+    return replacement
+
+
+def _join_stopping_worker(worker: BaseProcess) -> None:
+    """Wait for a worker sent SIGTERM to exit, killing it if it outlasts its drain timeout."""
+    worker.join(DRAIN_TIMEOUT + _STOP_GRACE)
+    if worker.exitcode is None:
+        print_error("Worker %s did not stop in time; killing it.", worker.pid)
+        worker.kill()
+        worker.join()
+    print_debug("Worker %s stopped.", worker.pid)
+
+
+def _run_worker(serve_fn: Callable[[], None], stop_fn: Callable[[float], bool]) -> None:
+    """
+    Serve clients on a background thread until SIGTERM, then drain and exit.
+    The main thread only waits for the signal, which every other thread blocks, whatever the engine is doing.
+    """
+    # Stopped before serving begins, the worker has nothing to drain.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Interrupting the terminal signals the whole process group; the supervisor stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    # Blocked before any thread starts, so that every thread inherits the mask and only sigwait receives it.
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+
+    failed = False
+
+    def serve() -> None:
+        nonlocal failed
+        try:
+            serve_fn()
+        except Exception as e:
+            print_error("Worker %s failed: %s.", os.getpid(), e)
+        # Serving only returns by itself if the worker cannot serve.
+        failed = True
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=serve, daemon=True).start()
+    signal.sigwait({signal.SIGTERM})
+    failed_to_serve = failed  # Serving returns once stop_fn stops it accepting clients.
+    if not failed_to_serve and not stop_fn(DRAIN_TIMEOUT):
+        print_error("Worker %s stopped with requests still in progress.", os.getpid())
+    stop_logging()  # Exiting skips the handlers registered to run at exit.
+    sys.stdout.flush()
+    # Exit without waiting for the threads still serving idle connections; their clients reconnect.
+    os._exit(1 if failed_to_serve else 0)
@@ -0,0 +1,201 @@
+import json
+import mimetypes
+import os
+from bisect import bisect_left, bisect_right, insort
+from threading import Lock
+from typing import Callable, Iterable, NamedTuple
+
+from file_service.utilities.debug import print_debug, print_error
+
+_DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+class CatalogEntry(NamedTuple):
+    """What the server knows about a stored file without touching the disk."""
+    name: str
+    size: int
+    mtime: float
+    content_type: str
+    digest: str | None = None  # Of the content, if it is known
+    perceptual_hash: int | None = None  # Of the image, if it is known, to find similar images by
+
+
+class Catalog:
+    """
+    A thread-safe, in-memory index of the files in a directory, kept sorted by name so that listings can be
+    filtered by prefix and paged through with a cursor without visiting the whole directory.
+    If a journal path is given, every change is appended to it so that the next start can reuse what is known.
+    If the journal is shared, other processes append their changes to it too, and each read first applies
+    whatever they appended since, so that a file saved by one process is listed by all of them.
+    Listeners are called with every entry applied to the catalog, whether by this process or read from the journal.
+    """
+
+    def __init__(self, journal_path: str | None = None, shared: bool = False) -> None:
+        if shared and journal_path is None:
+            raise ValueError("A shared catalog needs a journal.")
+        self._journal_path = journal_path
+        self._shared = shared
+        self._journal_offset = 0  # Bytes of a shared journal whose records are applied
+        self._entries: dict[str, CatalogEntry] = {}
+        self._names: list[str] = []  # Sorted
+        self._listeners: list[Callable[[CatalogEntry], None]] = []
+        self._lock = Lock()
+
+    def scan(self, files: Iterable[tuple[str, os.stat_result]]) -> None:
+        """
+        Replace the catalog with the given files, each a name and status, reusing journalled entries whose size and
+        modification time still match, then compact the journal.
+        """
+        journalled = self._read_journal()
+        entries: dict[str, CatalogEntry] = {}
+        for name, stat in files:
+            entry = journalled.get(name)
+            if entry is None or entry.size != stat.st_size or entry.mtime != stat.st_mtime:
+                entry = make_entry(name, stat.st_size, stat.st_mtime)
+            entries[name] = entry
+
+        with self._lock:
+            self._entries = entries
+            self._names = sorted(entries)
+            self._write_journal()
+            for entry in entries.values():
+                self._notify(entry)
+        print_debug(f"Catalog scanned {len(entries)} files.")
+
+    def add(self, entry: CatalogEntry) -> None:
+        """Add or replace the entry for a file."""
+        with self._lock:
+            self._apply(entry)
+            self._append_journal(entry)
+
+    def add_listener(self, listener: Callable[[CatalogEntry], None]) -> None:
+        """
+        Call listener with every current entry, then with every entry applied from now on.
+        It is called with the lock held, so it must not use the catalog.
+        """
+        with self._lock:
+            self._follow_journal()
+            for entry in self._entries.values():
+                listener(entry)
+            self._listeners.append(listener)
+
+    def refresh(self) -> None:
+        """Apply whatever other processes appended to a shared journal, so that listeners see their changes."""
+        with self._lock:
+            self._follow_journal()
+
+    def get(self, name: str) -> CatalogEntry | None:
+        """Return the entry for a file, or None if it is not catalogued."""
+        with self._lock:
+            self._follow_journal()
+            return self._entries.get(name)
+
+    def list_page(
+        self,
+        prefix: str = "",
+        cursor: str | None = None,
+        limit: int | None = None,
+    ) -> tuple[list[CatalogEntry], str | None]:
+        """
+        Return up to limit entries whose names start with prefix and sort after cursor, in name order,
+        with the cursor for the next page, or None if this page is the last.
+        """
+        with self._lock:
+            self._follow_journal()
+            start = bisect_left(self._names, prefix)
+            if cursor is not None:
+                start = max(start, bisect_right(self._names, cursor))
+            end = bisect_left(self._names, prefix + "\U0010ffff") if prefix else len(self._names)
+            stop = end if limit is None else min(end, start + limit)
+            page = [self._entries[name] for name in self._names[start:stop]]
+        next_cursor = page[-1].name if page and stop < end else None
+        return page, next_cursor
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._follow_journal()
+            return len(self._names)
+
+    def _apply(self, entry: CatalogEntry) -> None:
+        """Add or replace the entry for a file in memory. The lock must be held."""
+        if entry.name not in self._entries:
+            insort(self._names, entry.name)
+        self._entries[entry.name] = entry
+        self._notify(entry)
+
+    def _notify(self, entry: CatalogEntry) -> None:
+        """Call the listeners with an entry that was applied. The lock must be held."""
+        for listener in self._listeners:
+            listener(entry)
+
+    def _read_journal(self) -> dict[str, CatalogEntry]:
+        """Return the entries recorded in the journal, the latest record of each file winning."""
+        if self._journal_path is None or not os.path.exists(self._journal_path):
+            return {}
+        entries: dict[str, CatalogEntry] = {}
+        with open(self._journal_path, encoding="utf-8") as f:
+            for line in f:
+                entry = _parse_record(line)
+                if entry is not None:
+                    entries[entry.name] = entry
+        return entries
+
+    def _follow_journal(self) -> None:
+        """Apply the records appended to a shared journal since it was last read. The lock must be held."""
+        if not self._shared:
+            return
+        assert self._journal_path is not None
+        if os.path.getsize(self._journal_path) == self._journal_offset:
+            return
+        with open(self._journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            appended = f.read()
+        # A record being appended concurrently may be incomplete; it is applied once its line is complete.
+        complete_size = appended.rfind(b"\n") + 1
+        for line in appended[:complete_size].decode("utf-8").splitlines():
+            entry = _parse_record(line)
+            if entry is not None:
+                # Records this process appended itself are applied again, which changes nothing.
+                self._apply(entry)
+        self._journal_offset += complete_size
+
+    def _write_journal(self) -> None:
+        """Rewrite the journal with one record per catalogued file. The lock must be held."""
+        if self._journal_path is None:
+            return
+        temporary_path = f"{self._journal_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            for name in self._names:
+                f.write(json.dumps(self._entries[name]) + "\n")
+        os.replace(temporary_path, self._journal_path)
+        self._journal_offset = os.path.getsize(self._journal_path)
+
+    def _append_journal(self, entry: CatalogEntry) -> None:
+        """Record a change at the end of the journal. The lock must be held."""
+        if self._journal_path is None:
+            return
+        # Written in a single call, so that records appended by other processes sharing the journal do not interleave.
+        with open(self._journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+def make_entry(
+    name: str,
+    size: int,
+    mtime: float,
+    digest: str | None = None,
+    perceptual_hash: int | None = None,
+) -> CatalogEntry:
+    """Build the catalog entry for a file, guessing its content type from its name."""
+    content_type, _ = mimetypes.guess_type(name)
+    return CatalogEntry(name, size, mtime, content_type or _DEFAULT_CONTENT_TYPE, digest, perceptual_hash)
+
+
+def _parse_record(line: str) -> CatalogEntry | None:
+    """Return the entry a journal record describes, or None if the record is malformed."""
+    try:
+        return CatalogEntry(*json.loads(line))
+    except (ValueError, TypeError):
+        # A crash may leave a truncated last line; the scan recomputes whatever it described.
+        print_error(f"Skipping a malformed catalog journal record: {line.strip()!r}.")
+        return None
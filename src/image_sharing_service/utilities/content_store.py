@@ -0,0 +1,98 @@
+import hashlib
+import os
+import re
+from io import BufferedReader
+
+from file_service.utilities.debug import print_debug
+
+DIGEST_ALGORITHM = "sha256"
+_DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+_SHARD_WIDTH = 2  # Hex digits per directory level
+_SHARD_DEPTH = 2  # Directory levels above each blob, keeping directories small with millions of blobs
+
+
+class DigestError(ValueError):
+    """Raised when a digest is not a valid content digest."""
+    pass
+
+
+class ContentStore:
+    """
+    Blobs named by the digest of their content, in a sharded directory tree.
+    Stored files are hard links to their blob, so identical files share one copy on disk
+    and the number of names referencing a blob is its link count less one.
+    """
+
+    def __init__(self, root: str) -> None:
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+    def has(self, digest: str) -> bool:
+        """Return whether a blob with this digest is stored."""
+        return os.path.exists(self._blob_path(digest))
+
+    def link(self, digest: str, filepath: str) -> bool:
+        """
+        Create a file referencing the blob with this digest. Return False if no such blob is stored.
+        Raise FileExistsError if the file already exists.
+        """
+        try:
+            os.link(self._blob_path(digest), filepath)
+        except FileNotFoundError:
+            return False
+        print_debug("File linked to a stored blob.\n\tPath: %s\n\tDigest: %s", filepath, digest)
+        return True
+
+    def add(self, filepath: str, digest: str) -> None:
+        """
+        Store a file's content, replacing the file with a link to the existing blob if the content is already stored.
+        Raise OSError if the filesystem does not support hard links.
+        """
+        blob_path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        try:
+            os.link(filepath, blob_path)
+            return
+        except FileExistsError:
+            pass
+
+        # Link to a temporary name first so that the file is replaced atomically.
+        temporary_path = f"{filepath}.{os.getpid()}.link"
+        os.link(blob_path, temporary_path)
+        os.replace(temporary_path, filepath)
+        print_debug("File deduplicated.\n\tPath: %s\n\tDigest: %s", filepath, digest)
+
+    def reference_count(self, digest: str) -> int:
+        """Return the number of stored files referencing the blob with this digest."""
+        try:
+            return os.stat(self._blob_path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def collect_garbage(self) -> int:
+        """Remove the blobs that no stored file references any more. Return how many were removed."""
+        removed_count = 0
+        for directory, _, blob_names in os.walk(self._root):
+            for blob_name in blob_names:
+                blob_path = os.path.join(directory, blob_name)
+                if os.stat(blob_path).st_nlink == 1:
+                    os.remove(blob_path)
+                    removed_count += 1
+        print_debug(f"Removed {removed_count} unreferenced blobs.\n\tPath: {self._root}")
+        return removed_count
+
+    def _blob_path(self, digest: str) -> str:
+        validate_digest(digest)
+        shards = [digest[i * _SHARD_WIDTH:(i + 1) * _SHARD_WIDTH] for i in range(_SHARD_DEPTH)]
+        return os.path.join(self._root, *shards, digest)
+
+
+def compute_digest(file: BufferedReader) -> str:
+    """Return the hex digest of a file's content, read from its current position to its end."""
+    return hashlib.file_digest(file, DIGEST_ALGORITHM).hexdigest()
+
+
+def validate_digest(digest: str) -> None:
+    """Raise DigestError if a digest is not a lowercase hex SHA-256 digest."""
+    if not _DIGEST_PATTERN.fullmatch(digest):
+        raise DigestError(f"Invalid {DIGEST_ALGORITHM} digest: '{digest}'.")
@@ -1,7 +1,24 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
 from socket import socket
+from weakref import WeakKeyDictionary
 
-DEBUG = False
-ERROR = True
+# Levels of output, from the most verbose: debug messages, command reports, errors, or nothing.
+DEBUG_LEVEL = "debug"
+INFO_LEVEL = "info"
+ERROR_LEVEL = "error"
+OFF_LEVEL = "off"
+LOG_LEVELS = {
+    DEBUG_LEVEL: logging.DEBUG,
+    INFO_LEVEL: logging.INFO,
+    ERROR_LEVEL: logging.ERROR,
+    OFF_LEVEL: logging.CRITICAL + 1,
+}
+DEFAULT_LOG_LEVEL = INFO_LEVEL
 
 # ANSI color codes for terminal output
 _RESET = "\033[0m"
@@ -13,6 +30,72 @@ _MAGENTA = "\033[35m"
 _CYAN = "\033[36m"
 _WHITE = "\033[37m"
 
+_logger = logging.getLogger("file_service")
+_logger.propagate = False  # Written by the handler configured here only, whatever the application configures.
+
+# Whether debug messages are written, cached as a flag since loops check it on every call.
+_debug_enabled = False
+
+# While logging through a queue: the handler that queues records, and the thread writing them.
+_queue_handler: QueueHandler | None = None
+_listener: QueueListener | None = None
+
+# The address of the peer of each connection, looked up once rather than on every report.
+_peer_names: WeakKeyDictionary[socket, str] = WeakKeyDictionary()
+
+
+class _LabelledFormatter(logging.Formatter):
+    """Formats debug and error messages with a coloured label, and other messages as they are."""
+
+    _LABELS = {logging.DEBUG: ("Debug", _YELLOW), logging.ERROR: ("Error", _RED)}
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        label = self._LABELS.get(record.levelno)
+        if label is None:
+            return message
+        name, colour_code = label
+        return f"{colour_code}{name}:{_RESET} {message}"
+
+
+def configure_logging(level: str = DEFAULT_LOG_LEVEL, use_queue: bool = False) -> None:
+    """
+    Write messages at the given level and above to stdout.
+    With use_queue, the calling thread only queues each message, and a background thread writes it,
+    so that a slow terminal or pipe never holds up request handling.
+    """
+    global _debug_enabled, _queue_handler, _listener
+    stop_logging()
+    for handler in _logger.handlers[:]:
+        _logger.removeHandler(handler)
+
+    _logger.setLevel(LOG_LEVELS[level])
+    _debug_enabled = _logger.isEnabledFor(logging.DEBUG)
+    stream_handler = logging.StreamHandler(sys.stdout)  # Each message is written in a single call.
+    stream_handler.setFormatter(_LabelledFormatter())
+    if use_queue:
+        _queue_handler = QueueHandler(queue.SimpleQueue())
+        _listener = QueueListener(_queue_handler.queue, stream_handler)
+        _listener.start()
+        _logger.addHandler(_queue_handler)
+    else:
+        _logger.addHandler(stream_handler)
+
+
+def stop_logging() -> None:
+    """Stop the background thread writing queued messages, once it has written them all."""
+    global _queue_handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        _logger.removeHandler(_queue_handler)  # type: ignore[arg-type]
+        _logger.addHandler(_listener.handlers[0])
+        _queue_handler = _listener = None
+
+
+def debug_enabled() -> bool:
+    """Return whether debug messages are written, so that loops can check once rather than on every iteration."""
+    return _debug_enabled
+
 
 def print_command_report(
     sock: socket,
@@ -25,9 +108,10 @@ def print_command_report(
     _SUCCESS_VAL = "SUCCESS"
     _FAILURE_VAL = "FAILURE"
 
+    if not _logger.isEnabledFor(logging.INFO):
+        return
     status = _SUCCESS_VAL if success else _FAILURE_VAL
-    host = sock.getpeername()
-    parts = [str(host), command]
+    parts = [_get_peer_name(sock), command]
     if filename:
         parts.append(filename)
     parts.append(status)
@@ -35,22 +119,42 @@ def print_command_report(
     report = "\t".join(parts)
     if not success and error_message:
         report += f": {error_message}."
-    print(report)
+    _logger.info("%s", report)
+
+
+def print_info(message: str, *args: object) -> None:
+    """Print a message about the progress of the service, formatting it with args only if it is written."""
+    _logger.info(message, *args)
+
+
+def print_debug(message: str, *args: object) -> None:
+    """Print a debug message, formatting it with args only if debug messages are written."""
+    _logger.debug(message, *args)
+
+
+def print_error(message: str, *args: object) -> None:
+    """Print an error message, formatting it with args only if error messages are written."""
+    _logger.error(message, *args)
 
 
-def print_debug(message: str) -> None:
-    """Print a debug message if DEBUG is enabled."""
-    if DEBUG:
-        _colourful_print(message, "Debug", _YELLOW)
+def _get_peer_name(sock: socket) -> str:
+    """Return the address of a connection's peer, as printed in reports."""
+    peer_name = _peer_names.get(sock)
+    if peer_name is None:
+        peer_name = _peer_names[sock] = str(sock.getpeername())
+    return peer_name
 
 
-def print_error(message: str) -> None:
-    """Print an error message if ERROR is enabled."""
-    if ERROR:
-        _colourful_print(message, "Error", _RED)
+def _restart_listener_in_child() -> None:
+    """Give a forked process a queue and writing thread of its own, as threads do not survive a fork."""
+    global _listener
+    if _listener is not None:
+        _queue_handler.queue = queue.SimpleQueue()  # type: ignore[union-attr]
+        _listener = QueueListener(_queue_handler.queue, *_listener.handlers)  # type: ignore[union-attr]
+        _listener.start()
 
 
-def _colourful_print(message: str, label: str = "", colour_code: str = _WHITE) -> None:
-    """Print a message with a coloured label."""
-    prefix = f"{colour_code}{label}:{_RESET}"
-    print(f"{prefix} {message}")
+configure_logging()
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):  # Not available on Windows, which cannot fork.
+    os.register_at_fork(after_in_child=_restart_listener_in_child)
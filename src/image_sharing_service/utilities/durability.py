@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+from file_service.utilities.debug import print_debug, print_error
+
+# Durability modes
+DURABILITY_OFF = "off"  # Saved files reach the disk whenever the operating system writes them back.
+DURABILITY_FSYNC = "fsync"  # Each save syncs its own file and directory before it is acknowledged.
+DURABILITY_GROUP = "group"  # Concurrent saves share each sync, committed together after a short window.
+DURABILITY_MODES = (DURABILITY_OFF, DURABILITY_FSYNC, DURABILITY_GROUP)
+
+# Seconds a group commit waits for more saves to join it. Saves made while a group is being committed join the next
+# one anyway, so waiting only pays off where syncing is slow and saves arrive in bursts.
+DEFAULT_GROUP_COMMIT_WINDOW = 0.0
+
+# Windows syncs only files opened for writing, and cannot open directories.
+_SYNC_FLAGS = os.O_RDWR if os.name == "nt" else os.O_RDONLY
+_CAN_SYNC_DIRECTORIES = os.name != "nt"
+
+
+class DurabilityError(OSError):
+    """Raised when a saved file cannot be synced to disk, so that it may not survive a crash."""
+    pass
+
+
+class Syncer(ABC):
+    """Makes the content of files, and the entries of directories, durable on disk."""
+
+    @abstractmethod
+    def sync(self, paths: Iterable[str]) -> None:
+        """Sync files and directories to disk, returning once they are durable. Raise DurabilityError if one fails."""
+
+
+class ImmediateSyncer(Syncer):
+    """Syncs the paths of each call on its own, in the calling thread."""
+
+    def sync(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            sync_path(path)
+
+
+class GroupCommitter(Syncer):
+    """
+    Syncs the paths of concurrent calls together, from a background thread, so that they share the cost of
+    flushing the disk. A group is committed once window seconds have passed since its first call and the previous
+    group is committed; calls made while a group is being committed join the next one. Paths in a group are synced
+    once, however many calls gave them.
+    """
+
+    def __init__(self, window: float = DEFAULT_GROUP_COMMIT_WINDOW) -> None:
+        if window < 0:
+            raise ValueError("Group commit window must not be negative.")
+        self._window = window
+        self._group = _Group()
+        self._condition = threading.Condition()
+        self._thread_pid = 0  # Of the process that started the thread, as a forked worker must start its own.
+
+    def sync(self, paths: Iterable[str]) -> None:
+        with self._condition:
+            if self._thread_pid != os.getpid():
+                self._group = _Group()
+                threading.Thread(target=self._commit_groups, daemon=True).start()
+                self._thread_pid = os.getpid()
+            group = self._group
+            if not group.paths:
+                group.opened_at = time.monotonic()
+                self._condition.notify()
+            group.paths.update(paths)
+        group.committed.wait()
+        if group.error is not None:
+            raise group.error
+
+    def _commit_groups(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: bool(self._group.paths))
+                opened_at = self._group.opened_at
+            time.sleep(max(0.0, opened_at + self._window - time.monotonic()))
+            with self._condition:
+                group, self._group = self._group, _Group()
+            try:
+                for path in group.paths:
+                    sync_path(path)
+            except DurabilityError as e:
+                group.error = e
+            print_debug("Committed a group of %d paths.", len(group.paths))
+            group.committed.set()
+
+
+class _Group:
+    """The paths of the calls waiting for the same group commit."""
+
+    def __init__(self) -> None:
+        self.paths: set[str] = set()
+        self.opened_at = 0.0
+        self.committed = threading.Event()
+        self.error: DurabilityError | None = None
+
+
+def create_syncer(mode: str, window: float = DEFAULT_GROUP_COMMIT_WINDOW) -> Syncer | None:
+    """Return the syncer of a durability mode, or None if saved files are not synced."""
+    if mode == DURABILITY_FSYNC:
+        return ImmediateSyncer()
+    if mode == DURABILITY_GROUP:
+        return GroupCommitter(window)
+    return None
+
+
+def sync_path(path: str) -> None:
+    """Sync a file or directory to disk. Directories are skipped where they cannot be synced."""
+    if not _CAN_SYNC_DIRECTORIES and os.path.isdir(path):
+        return
+    try:
+        fd = os.open(path, _SYNC_FLAGS)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print_error(f"Cannot sync '{path}' to disk: {e}.")
+        raise DurabilityError(f"Cannot sync '{path}' to disk: {e.strerror}")
@@ -1,20 +1,207 @@
 from socket import socket
-from typing import Any
+from io import BufferedReader, BufferedWriter
+from functools import partial
+from typing import Any, Callable
+from weakref import WeakKeyDictionary
 
-from file_service.protocol import socket as socket_protocol
-from file_service.utilities import socket as socket_utilities
+from file_service.protocol import bundle, compression, message as message_protocol, socket as socket_protocol
+from file_service.protocol.bundle import ENTRY_HEADER_SIZE, ENTRY_OK, EntryHeader
+from file_service.protocol.compression import MIN_COMPRESSED_SIZE
+from file_service.protocol.message import PICKLE_FORMAT, BINARY_FORMAT, FILENAME_KEY, FILE_DATA_KEY
+from file_service.protocol.socket import EncodedMessage
+from file_service.utilities import metrics, socket as socket_utilities, storage
+from file_service.utilities.metrics import DESERIALIZE_PHASE, RECEIVE_PHASE, SEND_PHASE, SERIALIZE_PHASE
+from file_service.utilities.debug import debug_enabled, print_debug
 
 
-def send_message(sock: socket, payload: dict[str, Any]) -> None:
-    """Send a framed message through a socket."""
-    message = socket_protocol.frame_message(payload)
-    socket_utilities.send_data(sock, message)
+# The wire format negotiated on each connection. Connections that never negotiated use pickle.
+_wire_formats: WeakKeyDictionary[socket, str] = WeakKeyDictionary()
+# The protocol features negotiated on each connection, none by default.
+_features: WeakKeyDictionary[socket, frozenset[str]] = WeakKeyDictionary()
+
+
+def get_wire_format(sock: socket) -> str:
+    """Return the wire format used to encode messages on a connection."""
+    return _wire_formats.get(sock, PICKLE_FORMAT)
+
+
+def set_wire_format(sock: socket, wire_format: str) -> None:
+    """Set the wire format used to encode messages on a connection."""
+    print_debug("Using the %s wire format on %s.", wire_format, sock)
+    _wire_formats[sock] = wire_format
+
+
+def get_features(sock: socket) -> frozenset[str]:
+    """Return the protocol features negotiated on a connection."""
+    return _features.get(sock, frozenset())
+
+
+def set_features(sock: socket, features: frozenset[str]) -> None:
+    """Set the protocol features negotiated on a connection."""
+    if debug_enabled():
+        print_debug("Using the protocol features %s on %s.", ", ".join(sorted(features)) or "none", sock)
+    _features[sock] = features
+
+
+def send_message(sock: socket, message: EncodedMessage, body: bytes = b"") -> bool:
+    """
+    Send an encoded message through a socket with its framing, optionally followed by a streamed body
+    that is already in memory. Return False if the connection closed before everything was sent.
+    Once a compression codec is negotiated, frames are flagged and the payload is compressed if it is worth it.
+    """
+    with metrics.phase(SERIALIZE_PHASE):
+        frame = socket_protocol.frame_message(message, _get_compress_fn(sock, message))
+    with metrics.phase(SEND_PHASE):
+        metrics.record_bytes_out(sum(map(len, frame)) + len(body))
+        return socket_utilities.send_data(sock, *frame, body)
+
+
+def send_handshake(sock: socket, message: EncodedMessage) -> None:
+    """Send a handshake message, which must be encoded in the binary wire format."""
+    socket_utilities.send_data(sock, *socket_protocol.frame_handshake(message))
 
 
 def receive_message(sock: socket) -> dict[str, Any]:
-    """Receive and unframe a message from a socket."""
-    def receive_data_from_sock(byte_count: int) -> bytes:
+    """
+    Receive and unframe a message from a socket, decoding it with the connection's wire format.
+    Handshake messages are always decoded from the binary wire format.
+    """
+    def receive_data_from_sock(byte_count: int) -> bytearray:
+        metrics.record_bytes_in(byte_count)
         return socket_utilities.receive_data(sock, byte_count)
 
-    payload: dict[str, Any] = socket_protocol.unframe_message(receive_data_from_sock)
+    def decompress(flag: int, data: bytes | bytearray) -> bytes | bytearray:
+        return compression.decompress(flag, data, socket_protocol.get_max_payload_size())
+
+    is_flagged = compression.choose_codec(get_features(sock)) is not None
+    payload: dict[str, Any] = socket_protocol.unframe_message(
+        metrics.timed(RECEIVE_PHASE, receive_data_from_sock),
+        metrics.timed(DESERIALIZE_PHASE, message_protocol.get_decoder(get_wire_format(sock))),
+        metrics.timed(DESERIALIZE_PHASE, message_protocol.get_decoder(BINARY_FORMAT)),
+        metrics.timed(DESERIALIZE_PHASE, decompress) if is_flagged else None,
+    )
     return payload
+
+
+def is_worth_compressing(message: EncodedMessage) -> bool:
+    """
+    Return whether a message is worth compressing: small payloads have too little to save, and image data of a
+    type that is always compressed would not shrink. Others are compressed, but sent as they are if that saves
+    too little.
+    """
+    payload = message.payload
+    if message.size < MIN_COMPRESSED_SIZE:
+        return False
+    return not (payload.get(FILE_DATA_KEY) and storage.is_compressed_image(payload.get(FILENAME_KEY) or ""))
+
+
+def send_stream(sock: socket, file: BufferedReader, size: int) -> bool:
+    """
+    Send size bytes of a file as the streamed body following a message, straight from the file where possible.
+    Return False if the connection closed before the whole body was sent.
+    """
+    metrics.record_bytes_out(size)
+    if hasattr(sock, "sendfile"):
+        with metrics.phase(SEND_PHASE):
+            return socket_utilities.send_file(sock, file, size)
+
+    def send_data_to_sock(data: memoryview) -> bool:
+        return socket_utilities.send_data(sock, data)
+
+    return socket_protocol.stream_body(file.readinto, metrics.timed(SEND_PHASE, send_data_to_sock), size)
+
+
+def receive_stream(sock: socket, file: BufferedWriter, size: int) -> None:
+    """Receive the streamed body following a message, writing it to a file as it arrives."""
+    def receive_data_from_sock_into(buffer: memoryview) -> None:
+        socket_utilities.receive_data_into(sock, buffer)
+
+    metrics.record_bytes_in(size)
+    socket_protocol.unstream_body(metrics.timed(RECEIVE_PHASE, receive_data_from_sock_into), file.write, size)
+
+
+def discard_stream(sock: socket, size: int) -> None:
+    """Receive and drop the streamed body following a message, keeping the connection in sync."""
+    def receive_data_from_sock_into(buffer: memoryview) -> None:
+        socket_utilities.receive_data_into(sock, buffer)
+
+    metrics.record_bytes_in(size)
+    socket_protocol.unstream_body(metrics.timed(RECEIVE_PHASE, receive_data_from_sock_into), lambda chunk: None, size)
+    print_debug("Discarded a streamed body of %d bytes.", size)
+
+
+def receive_local_file(sock: socket, filename: str, size: int) -> None:
+    """
+    Save the streamed body following a message to a new local file.
+    Raise FileExistsError, after draining the body, if the file already exists.
+    """
+    if storage.local_file_exists(filename):
+        discard_stream(sock, size)
+        raise FileExistsError(f"'{filename}' already exists.")
+    with storage.create_local_file(filename) as file:
+        receive_stream(sock, file, size)
+
+
+def receive_staged_stream(sock: socket, key: str, offset: int, size: int) -> None:
+    """
+    Write the streamed body following a message to the staged file of a transfer, from offset.
+    What arrives is kept if the connection closes, so that the transfer can resume from there.
+    Raise StagingError, after draining the body, if the staged file cannot be written from offset.
+    """
+    try:
+        with storage.open_staged_file(key, offset) as file:
+            receive_stream(sock, file, size)
+    except storage.StagingError:
+        discard_stream(sock, size)
+        raise
+
+
+def send_bundle_entry(sock: socket, filename: str, file: BufferedReader, size: int) -> bool:
+    """
+    Send an entry of a bundle carrying size bytes of a file, streamed straight from the file where possible.
+    Return False if the connection closed before the whole entry was sent.
+    """
+    header = bundle.encode_entry_header(filename, size)
+    with metrics.phase(SEND_PHASE):
+        metrics.record_bytes_out(len(header))
+        if not socket_utilities.send_data(sock, header):
+            return False
+    return send_stream(sock, file, size)
+
+
+def send_bundle_entry_data(sock: socket, filename: str, data: bytes, status: int = ENTRY_OK) -> bool:
+    """
+    Send an entry of a bundle whose body is in memory: a file, or an error message if status is an error.
+    Return False if the connection closed before the whole entry was sent.
+    """
+    header = bundle.encode_entry_header(filename, len(data), status)
+    with metrics.phase(SEND_PHASE):
+        metrics.record_bytes_out(len(header) + len(data))
+        return socket_utilities.send_data(sock, header, data)
+
+
+def receive_bundle_entry(sock: socket) -> tuple[EntryHeader, str]:
+    """
+    Receive the header and filename of the next entry of a bundle, whose body is left to be received.
+    Raise BundleError if the entry is malformed.
+    """
+    with metrics.phase(RECEIVE_PHASE):
+        header = bundle.decode_entry_header(socket_utilities.receive_data(sock, ENTRY_HEADER_SIZE))
+        filename = bundle.decode_entry_filename(socket_utilities.receive_data(sock, header.filename_length))
+    metrics.record_bytes_in(ENTRY_HEADER_SIZE + header.filename_length)
+    return header, filename
+
+
+def receive_bundle_entry_data(sock: socket, size: int) -> bytes:
+    """Receive the body of an entry of a bundle into memory, such as an error message."""
+    metrics.record_bytes_in(size)
+    with metrics.phase(RECEIVE_PHASE):
+        return bytes(socket_utilities.receive_data(sock, size))
+
+
+def _get_compress_fn(sock: socket, message: EncodedMessage) -> Callable[[bytes], tuple[int, bytes]] | None:
+    """Return how to compress a message on a connection, or None if its frames are not flagged."""
+    codec = compression.choose_codec(get_features(sock))
+    if codec is None:
+        return None
+    return partial(compression.compress, codec=codec if is_worth_compressing(message) else None)
@@ -0,0 +1,271 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, TypeVar
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+# Phases of handling a request. Storage covers handling the request itself, mostly storage I/O:
+# whatever time is not spent in the other phases. Streamed bodies count as receiving or sending,
+# including the disk I/O the kernel does for sendfile().
+RECEIVE_PHASE = "receive"
+DESERIALIZE_PHASE = "deserialize"
+STORAGE_PHASE = "storage"
+SERIALIZE_PHASE = "serialize"
+SEND_PHASE = "send"
+PHASES = (RECEIVE_PHASE, DESERIALIZE_PHASE, STORAGE_PHASE, SERIALIZE_PHASE, SEND_PHASE)
+_MEASURED_PHASES = (RECEIVE_PHASE, DESERIALIZE_PHASE, SERIALIZE_PHASE, SEND_PHASE)
+
+# Latency histogram buckets: 4 per doubling from 1 µs to over 100 s, so percentiles are within 19%.
+_BUCKETS_PER_DOUBLING = 4
+_BUCKET_BOUNDS = tuple(1e-6 * 2 ** (i / _BUCKETS_PER_DOUBLING) for i in range(27 * _BUCKETS_PER_DOUBLING + 1))
+_PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """A latency distribution in logarithmic buckets, cheap to record into and summarised by percentiles."""
+
+    def __init__(self) -> None:
+        self._counts = [0] * (len(_BUCKET_BOUNDS) + 1)  # The last bucket holds what exceeds every bound.
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self._counts[bisect_left(_BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """Return the upper bound, in seconds, of the bucket holding the given percentile, at most the maximum."""
+        rank = self.count * percent / 100
+        cumulative = 0
+        for i, count in enumerate(self._counts):
+            cumulative += count
+            if count and cumulative >= rank:
+                return min(_BUCKET_BOUNDS[i], self.max) if i < len(_BUCKET_BOUNDS) else self.max
+        return 0.0
+
+    def summarise(self) -> dict[str, float]:
+        """Return the count, and the mean, percentiles and maximum in milliseconds."""
+        summary: dict[str, float] = {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+        }
+        for percent in _PERCENTILES:
+            summary[f"p{percent}_ms"] = self.percentile(percent) * 1000
+        summary["max_ms"] = self.max * 1000
+        return summary
+
+
+class _CommandMetrics:
+    """What is recorded about the requests for one command."""
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+
+class _Request:
+    """The measurements of the request a thread is handling."""
+
+    __slots__ = ("start", "phase_durations", "bytes_in", "bytes_out", "error")
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phase_durations = dict.fromkeys(_MEASURED_PHASES, 0.0)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.error = False
+
+
+class Metrics:
+    """
+    Thread-safe counters of the requests a server has handled, per command: requests, errors, bytes in and out,
+    and latency histograms overall and per phase; and of its connections.
+    """
+
+    def __init__(self) -> None:
+        self._start = time.monotonic()
+        self._commands: dict[str, _CommandMetrics] = {}
+        self._active_connections = 0
+        self._total_connections = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, command: str, request: _Request) -> None:
+        """Record a request that has been handled."""
+        duration = time.perf_counter() - request.start
+        storage_duration = max(duration - sum(request.phase_durations.values()), 0.0)
+        with self._lock:
+            command_metrics = self._commands.get(command)
+            if command_metrics is None:
+                command_metrics = self._commands[command] = _CommandMetrics()
+            command_metrics.requests += 1
+            command_metrics.errors += request.error
+            command_metrics.bytes_in += request.bytes_in
+            command_metrics.bytes_out += request.bytes_out
+            command_metrics.latency.record(duration)
+            for phase, phase_duration in request.phase_durations.items():
+                command_metrics.phases[phase].record(phase_duration)
+            command_metrics.phases[STORAGE_PHASE].record(storage_duration)
+
+    def open_connection(self) -> None:
+        with self._lock:
+            self._active_connections += 1
+            self._total_connections += 1
+
+    def close_connection(self) -> None:
+        with self._lock:
+            self._active_connections -= 1
+
+    def snapshot(self) -> dict[str, Any]:
+        """Return the counters, with each histogram summarised, as plain data ready to be encoded as JSON."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),  # Each worker process keeps its own counters.
+                "uptime_s": time.monotonic() - self._start,
+                "connections": {"active": self._active_connections, "total": self._total_connections},
+                "commands": {
+                    command: {
+                        "requests": command_metrics.requests,
+                        "errors": command_metrics.errors,
+                        "bytes_in": command_metrics.bytes_in,
+                        "bytes_out": command_metrics.bytes_out,
+                        "latency": command_metrics.latency.summarise(),
+                        "phases": {
+                            phase: histogram.summarise() for phase, histogram in command_metrics.phases.items()
+                        },
+                    }
+                    for command, command_metrics in sorted(self._commands.items())
+                },
+            }
+
+
+class _Phase:
+    """Times a block of code as part of a phase of the current request."""
+
+    __slots__ = ("_request", "_phase", "_start")
+
+    def __init__(self, request: _Request, phase: str) -> None:
+        self._request = request
+        self._phase = phase
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._request.phase_durations[self._phase] += time.perf_counter() - self._start
+
+
+class _NoPhase:
+    """Times nothing, when metrics are disabled or no request is being handled."""
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: object) -> None:
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+# Collects the server's metrics once enabled. While disabled, every recording function returns at once.
+_metrics: Metrics | None = None
+
+# The request each thread is handling.
+_current = threading.local()
+
+
+def enable() -> Metrics:
+    """Start collecting metrics, and return where they are collected."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def get_metrics() -> Metrics | None:
+    """Return the metrics being collected, or None if they are disabled."""
+    return _metrics
+
+
+def open_connection() -> None:
+    """Count a connection that has been accepted."""
+    if _metrics is not None:
+        _metrics.open_connection()
+
+
+def close_connection() -> None:
+    """Count a connection that has closed."""
+    if _metrics is not None:
+        _metrics.close_connection()
+
+
+def start_request() -> None:
+    """Start measuring the request that the calling thread is about to handle."""
+    if _metrics is not None:
+        _current.request = _Request()
+
+
+def finish_request(command: str) -> None:
+    """Record the request that the calling thread has handled."""
+    request = _current_request()
+    if request is not None:
+        _current.request = None
+        _metrics.record_request(command, request)  # type: ignore[union-attr]
+
+
+def record_error() -> None:
+    """Count the current request as failed."""
+    request = _current_request()
+    if request is not None:
+        request.error = True
+
+
+def record_bytes_in(byte_count: int) -> None:
+    """Count bytes received for the current request."""
+    request = _current_request()
+    if request is not None:
+        request.bytes_in += byte_count
+
+
+def record_bytes_out(byte_count: int) -> None:
+    """Count bytes sent for the current request."""
+    request = _current_request()
+    if request is not None:
+        request.bytes_out += byte_count
+
+
+def phase(name: str) -> _Phase | _NoPhase:
+    """Return a context manager timing a block of code as part of a phase of the current request."""
+    request = _current_request()
+    return _NO_PHASE if request is None else _Phase(request, name)
+
+
+def timed(name: str, fn: _F) -> _F:
+    """
+    Return a function timing every call of fn as part of a phase of the current request.
+    While no request is being measured, return fn itself, so that it costs nothing.
+    """
+    request = _current_request()
+    if request is None:
+        return fn
+
+    def timed_fn(*args: Any, **kwargs: Any) -> Any:
+        with _Phase(request, name):
+            return fn(*args, **kwargs)
+
+    return timed_fn  # type: ignore[return-value]
+
+
+def _current_request() -> _Request | None:
+    if _metrics is None:
+        return None
+    return getattr(_current, "request", None)
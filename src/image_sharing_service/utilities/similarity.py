@@ -0,0 +1,104 @@
+import heapq
+from array import array
+from threading import Lock
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it, searches compare hashes one at a time.
+    np = None  # type: ignore[assignment]
+
+from file_service.utilities.catalog import CatalogEntry
+
+HASH_BITS = 64  # Of a perceptual hash, packed in an unsigned 64-bit integer
+
+# Whether searches are vectorized, which needs NumPy.
+CAN_VECTORIZE = np is not None
+
+# Number of set bits in each byte, to count the bits of hashes where NumPy has no bitwise_count.
+_BYTE_BIT_COUNTS = None if np is None else np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+class SimilarFile(NamedTuple):
+    """A file found by a similarity search, with the number of bits its perceptual hash differs in from the query's."""
+    name: str
+    distance: int
+
+
+class SimilarityIndex:
+    """
+    A thread-safe, in-memory index of the perceptual hashes of stored files, answering which files have the hashes
+    nearest a query by Hamming distance. Hashes are packed in a single array of 64-bit integers, which is searched
+    in one vectorized pass when NumPy is installed. It is kept up to date with the catalog by updating it with every
+    entry the catalog applies.
+    """
+
+    def __init__(self) -> None:
+        self._hashes = array("Q")
+        self._names: list[str] = []  # Of the file whose hash is at each position of _hashes
+        self._positions: dict[str, int] = {}
+        self._lock = Lock()
+
+    def update(self, entry: CatalogEntry) -> None:
+        """Add, replace or remove the hash of a catalogued file, as the entry has one or none."""
+        with self._lock:
+            position = self._positions.get(entry.name)
+            if entry.perceptual_hash is None:
+                if position is not None:
+                    self._remove(position)
+            elif position is None:
+                self._positions[entry.name] = len(self._names)
+                self._names.append(entry.name)
+                self._hashes.append(entry.perceptual_hash)
+            else:
+                self._hashes[position] = entry.perceptual_hash
+
+    def search(self, perceptual_hash: int, limit: int, exclude: str | None = None) -> list[SimilarFile]:
+        """
+        Return up to limit files whose hashes are nearest a hash, nearest first, leaving out the file named exclude.
+        Files at the same distance are in name order.
+        """
+        with self._lock:
+            count = len(self._names)
+            wanted = min(limit + (exclude in self._positions), count)
+            if wanted <= 0:
+                return []
+            if np is None:
+                nearest = heapq.nsmallest(
+                    wanted,
+                    (((stored_hash ^ perceptual_hash).bit_count(), name)
+                     for stored_hash, name in zip(self._hashes, self._names)),
+                )
+            else:
+                distances = _count_bits(np.frombuffer(self._hashes, dtype=np.uint64) ^ np.uint64(perceptual_hash))
+                # Distances are few, so the furthest one kept is found from their histogram, in linear time.
+                furthest = int(np.searchsorted(np.cumsum(np.bincount(distances, minlength=HASH_BITS + 1)), wanted))
+                nearer = np.flatnonzero(distances < furthest)
+                # Of the files at the furthest distance, those stored first are kept.
+                tied = np.flatnonzero(distances == furthest)[:wanted - len(nearer)]
+                positions = np.concatenate((nearer, tied))
+                nearest = sorted((int(distances[position]), self._names[position]) for position in positions)
+        return [SimilarFile(name, distance) for distance, name in nearest if name != exclude][:limit]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._names)
+
+    def _remove(self, position: int) -> None:
+        """Remove the hash at a position, moving the last hash into its place. The lock must be held."""
+        del self._positions[self._names[position]]
+        last_name, last_hash = self._names.pop(), self._hashes.pop()
+        if position < len(self._names):
+            self._names[position] = last_name
+            self._hashes[position] = last_hash
+            self._positions[last_name] = position
+
+
+def _count_bits(values: "np.ndarray") -> "np.ndarray":
+    """Return the number of set bits in each of an array of 64-bit integers."""
+    counts: "np.ndarray"
+    if hasattr(np, "bitwise_count"):  # NumPy 2 counts them in a single instruction per value where it can.
+        counts = np.bitwise_count(values)
+    else:
+        counts = _BYTE_BIT_COUNTS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+    return counts
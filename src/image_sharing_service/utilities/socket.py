@@ -1,49 +1,108 @@
 from socket import socket
+from typing import BinaryIO
 
-from file_service.utilities.debug import print_debug, print_error
+from file_service.utilities.debug import debug_enabled, print_debug, print_error
 
+# Bytes of data received at once that are allocated before any arrive. Larger data grows its buffer as it arrives,
+# so that a size claimed by the peer costs no more memory than the bytes it actually sends.
+_PREALLOCATED_BYTE_COUNT = 1024 * 1024
 
-def send_data(sock: socket, data: bytes) -> None:
-    """Send all bytes of data through a socket."""
-    print_debug(
-        "Sending data to socket..."
-        f"\n\tSize: {len(data)} bytes."
-        f"\n\tSocket: {sock}."
-    )
+
+def send_data(sock: socket, *buffers: bytes | memoryview) -> bool:
+    """
+    Send all bytes of one or more buffers through a socket, without joining them into one copy.
+    Return False if the connection closed before all data was sent.
+    """
+    if debug_enabled():
+        print_debug("Sending data to socket...\n\tSize: %d bytes.\n\tSocket: %s.", sum(map(len, buffers)), sock)
 
     try:
-        sock.sendall(data)  # Send all the data to the socket.
+        _send_buffers(sock, buffers)
     except ConnectionError:
         print_error("Connection closed before all data was sent.")
-        return
+        return False
 
     print_debug("Payload sent.")
+    return True
 
 
-def receive_data(sock: socket, max_byte_count: int) -> bytes:
-    """Receive a fixed number of bytes from a socket."""
-    # socket.recv() may return fewer bytes than requested due to network latency.
-    print_debug(
-        f"Receiving {max_byte_count} bytes from the socket..."
-        f"\n\tSocket: {sock}."
-    )
+def send_file(sock: socket, file: BinaryIO, size: int) -> bool:
+    """
+    Send size bytes of a file, from its current position, through a socket. Where the platform supports it,
+    the kernel copies the file straight to the socket, so the bytes never pass through user space.
+    Return False if the connection closed before all data was sent. Raise EOFError if the file ends first.
+    """
+    print_debug("Sending file to socket...\n\tSize: %d bytes.\n\tSocket: %s.", size, sock)
+    if not size:
+        return True  # sendfile() rejects a count of 0, e.g. when resuming an upload that was already complete.
+
+    try:
+        sent_byte_count = sock.sendfile(file, file.tell(), size)
+    except ConnectionError:
+        print_error("Connection closed before all data was sent.")
+        return False
+    if sent_byte_count < size:
+        raise EOFError(f"File ended {size - sent_byte_count} bytes before its announced size.")
+
+    print_debug("File sent.")
+    return True
 
-    data = b""
-    # Continue until all expected bytes are received.
-    while len(data) < max_byte_count:
-        leftover_bytes = max_byte_count - len(data)
 
-        print_debug(
-            "Calling recv()..."
-            f"\n\tLeftover bytes: {leftover_bytes}"
-        )
+def receive_data(sock: socket, max_byte_count: int) -> bytearray:
+    """
+    Receive a fixed number of bytes from a socket into a single buffer. Up to _PREALLOCATED_BYTE_COUNT bytes are
+    allocated up front; beyond that, the buffer doubles each time it is filled.
+    """
+    data = bytearray(min(max_byte_count, _PREALLOCATED_BYTE_COUNT))
+    received_byte_count = 0
+    while True:
+        receive_data_into(sock, memoryview(data)[received_byte_count:])
+        received_byte_count = len(data)
+        if received_byte_count == max_byte_count:
+            return data
+        data.extend(bytes(min(received_byte_count, max_byte_count - received_byte_count)))
 
-        packet = sock.recv(leftover_bytes)
-        if not packet:
+
+def receive_data_into(sock: socket, buffer: memoryview) -> None:
+    """Fill a buffer with bytes received from a socket."""
+    # socket.recv_into() may fill fewer bytes than requested due to network latency.
+    max_byte_count = len(buffer)
+    # Checked once, so that the loop costs nothing more than recv_into() while debug messages are not written.
+    debug = debug_enabled()
+    if debug:
+        print_debug("Receiving %d bytes from the socket...\n\tSocket: %s.", max_byte_count, sock)
+
+    received_byte_count = 0
+    # Continue until all expected bytes are received.
+    while received_byte_count < max_byte_count:
+        leftover_bytes = max_byte_count - received_byte_count
+        if debug:
+            print_debug("Calling recv_into()...\n\tLeftover bytes: %d", leftover_bytes)
+
+        packet_size = sock.recv_into(buffer[received_byte_count:], leftover_bytes)
+        if not packet_size:
             print_debug("The next packet is empty, indicating the connection closed.")
             raise ConnectionError("Connection closed.")
 
-        data += packet
+        received_byte_count += packet_size
+
+    if debug:
+        print_debug("Received all bytes from the socket.")
+
+
+def _send_buffers(sock: socket, buffers: tuple[bytes | memoryview, ...]) -> None:
+    """Send every buffer in order, using scatter/gather I/O where the platform supports it."""
+    if not hasattr(sock, "sendmsg"):  # Not available on Windows.
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
 
-    print_debug("Received all bytes from the socket.")
-    return data
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    while views:
+        # sendmsg() may send fewer bytes than requested, so drop what was sent and retry with the rest.
+        sent_byte_count = sock.sendmsg(views)
+        while views and sent_byte_count >= len(views[0]):
+            sent_byte_count -= len(views[0])
+            views.pop(0)
+        if sent_byte_count:
+            views[0] = views[0][sent_byte_count:]
@@ -1,24 +1,366 @@
+import hashlib
 import os
-from file_service.utilities.debug import print_debug
+import threading
+import uuid
+from contextlib import contextmanager
+from io import BufferedReader, BufferedWriter
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore[assignment]
+
+from file_service.utilities.catalog import Catalog, CatalogEntry, make_entry
+from file_service.utilities.content_store import ContentStore, compute_digest
+from file_service.utilities.debug import debug_enabled, print_debug, print_error
+from file_service.utilities.durability import Syncer
+from file_service.utilities.similarity import SimilarFile, SimilarityIndex
+from file_service.utilities.storage_backends import FlatBackend, StorageBackend
+
+# Holds the service's own state inside the storage directory. It is never listed as a stored file.
+METADATA_DIRECTORY = ".image-sharing-service"
+_CATALOG_JOURNAL_FILENAME = "catalog.jsonl"
+_CONTENT_STORE_DIRECTORY = "objects"
+_STAGING_DIRECTORY = "staging"  # Transfers in progress, moved into place once complete
+_VARIANTS_DIRECTORY = "variants"  # Derived versions of stored files, such as downscaled images
+_TEMPORARY_SUFFIX = ".tmp"  # Of staged files that are not resumable
+_VALID_EXTENSIONS = {".jpg", ".jpeg", ".png"}  # Image types that may be stored
+# Image types whose content is always compressed. PNG may be stored uncompressed, or carry large text metadata.
+_COMPRESSED_EXTENSIONS = {".jpg", ".jpeg"}
+
+# Keys of the staged files being written, each by a single transfer at a time.
+_open_staged_keys: set[str] = set()
+_open_staged_keys_lock = threading.Lock()
+
+# Where stored files live. Files are stored directly in the current working directory unless another backend is set.
+_backend: StorageBackend = FlatBackend()
+
+# Index of the stored files, maintained by the functions saving files once opened.
+_catalog: Catalog | None = None
+
+# Serializes updates of catalog entries, which keep what is already known of a file's content.
+_catalog_update_lock = threading.Lock()
+
+# Deduplicates the content of files saved once opened.
+_content_store: ContentStore | None = None
+
+# Index of the perceptual hashes recorded in the catalog, kept up to date with it once opened.
+_similarity_index: SimilarityIndex | None = None
+
+# Makes saved files durable before saving them returns, or None to leave them to the operating system.
+_syncer: Syncer | None = None
+
+
+class StagingError(ValueError):
+    """A staged file cannot be written: another transfer is writing it, or fewer bytes are staged than resumed from."""
+
+
+def set_backend(backend: StorageBackend) -> None:
+    """Set where stored files live. Must be called before the catalog or content store is opened."""
+    global _backend
+    _backend = backend
+    print_debug(f"Storing files with {type(backend).__name__}.\n\tDirectory: {backend.directory}")
+
+
+def set_syncer(syncer: Syncer | None) -> None:
+    """Set what makes saved files durable before saving them returns, or None to leave them to the operating system."""
+    global _syncer
+    _syncer = syncer
+
+
+def open_catalog(persist: bool = False, shared: bool = False) -> Catalog:
+    """
+    Index the stored files with a single scan, keeping the index up to date as files
+    are saved from now on. If persist is set, the index is journalled in the metadata directory across restarts.
+    If shared is set, the index is journalled too, and processes forked from now on keep each other's copies of it
+    up to date through the journal.
+    """
+    global _catalog
+    journal_path = None
+    if persist or shared:
+        os.makedirs(_metadata_path(), exist_ok=True)
+        journal_path = _metadata_path(_CATALOG_JOURNAL_FILENAME)
+    catalog = Catalog(journal_path, shared)
+    catalog.scan(_backend.scan())
+    _catalog = catalog
+    return catalog
+
+
+def open_similarity_index() -> SimilarityIndex:
+    """
+    Index the perceptual hashes of the stored images recorded in the catalog, to find similar images by,
+    keeping the index up to date with the catalog from now on. The catalog must be open.
+    """
+    global _similarity_index
+    assert _catalog is not None
+    similarity_index = SimilarityIndex()
+    _catalog.add_listener(similarity_index.update)
+    _similarity_index = similarity_index
+    return similarity_index
+
+
+def open_content_store() -> ContentStore:
+    """
+    Deduplicate the content of files saved from now on,
+    keeping one copy of each distinct content in the metadata directory.
+    """
+    global _content_store
+    content_store = ContentStore(_metadata_path(_CONTENT_STORE_DIRECTORY))
+    content_store.collect_garbage()
+    _content_store = content_store
+    return content_store
+
+
+def clean_staging_area() -> None:
+    """Remove the staged files of transfers that cannot be resumed, left behind if the process stopped midway."""
+    staging_directory = _metadata_path(_STAGING_DIRECTORY)
+    if not os.path.isdir(staging_directory):
+        return
+    for key in os.listdir(staging_directory):
+        if key.endswith(_TEMPORARY_SUFFIX):
+            discard_staged_file(key)
 
 
 def save_local_file(filename: str, file: bytes) -> None:
-    """Save a file to the current working directory. Raise FileExistsError if it already exists."""
-    filepath = _full_path(filename)
-    with open(filepath, "xb") as f:
+    """Save a file to storage, atomically. Raise FileExistsError if it already exists."""
+    with create_local_file(filename) as f:
         f.write(file)
-    print_debug(f"File saved successfully.\n\tPath: {filepath}")
+
+
+@contextmanager
+def create_local_file(filename: str) -> Iterator[BufferedWriter]:
+    """
+    Create a file in storage to be written incrementally. It is written in the staging area and moved into place
+    when complete, so a partial file is never visible under its name, and is removed if writing fails.
+    Raise FileExistsError if the file already exists, whether before or after writing.
+    """
+    if local_file_exists(filename):
+        raise FileExistsError(f"'{filename}' already exists.")
+    key = f"{uuid.uuid4().hex}{_TEMPORARY_SUFFIX}"
+    try:
+        with open_staged_file(key) as f:
+            yield f
+        commit_staged_file(key, filename)
+    except BaseException:
+        discard_staged_file(key)
+        raise
+
+
+def get_local_filepath(filename: str) -> str:
+    """Return the path at which a file is stored, whether or not it exists."""
+    return _backend.get_filepath(filename)
+
+
+def local_file_exists(filename: str) -> bool:
+    """Return whether a file is in storage."""
+    return os.path.exists(_backend.get_filepath(filename))
+
+
+def get_staged_size(key: str) -> int:
+    """Return how many bytes of a transfer are staged under a key, 0 if none are."""
+    try:
+        return os.path.getsize(_staging_path(key))
+    except FileNotFoundError:
+        return 0
+
+
+@contextmanager
+def open_staged_file(key: str, offset: int = 0) -> Iterator[BufferedWriter]:
+    """
+    Open the staged file of a transfer for writing from offset, creating it if needed and dropping anything
+    after offset. Whatever is written is kept if writing fails, so that the transfer can resume.
+    Raise StagingError if another transfer, in this process or another, is writing the file
+    or fewer than offset bytes are staged.
+    """
+    with _open_staged_keys_lock:
+        if key in _open_staged_keys:
+            raise StagingError(f"Another transfer of '{key}' is in progress.")
+        _open_staged_keys.add(key)
+    try:
+        staging_path = _staging_path(key)
+        os.makedirs(os.path.dirname(staging_path), exist_ok=True)
+        with open(staging_path, "ab") as f:
+            _lock_staged_file(f, key)
+            staged_size = f.tell()
+            if staged_size < offset:
+                raise StagingError(f"Cannot resume from byte {offset}: only {staged_size} bytes are staged.")
+            f.truncate(offset)
+            yield f
+    finally:
+        with _open_staged_keys_lock:
+            _open_staged_keys.discard(key)
+
+
+def commit_staged_file(key: str, filename: str, digest: str | None = None) -> None:
+    """
+    Move the staged file of a completed transfer into storage, atomically and without replacing an existing file.
+    If a syncer is set, the file is durable once this returns: its content is synced before it appears under its
+    name, so that a crash never leaves a partial file there, and its name is synced after.
+    Raise FileExistsError if the file already exists, leaving the staged file in place,
+    and DurabilityError if syncing fails.
+    """
+    staging_path = _staging_path(key)
+    filepath = _backend.prepare_filepath(filename)
+    if _syncer is not None:
+        _syncer.sync([staging_path])
+    try:
+        os.link(staging_path, filepath)
+    except FileExistsError:
+        raise
+    except OSError:
+        # Without hard links, rename instead; this refuses to replace an existing file on Windows only.
+        os.rename(staging_path, filepath)
+    else:
+        os.remove(staging_path)
+    _record_saved_file(filename, digest)
+    _sync_name(filepath)
+    print_debug("File saved successfully.\n\tPath: %s", filepath)
+
+
+def discard_staged_file(key: str) -> None:
+    """Remove the staged file of a transfer, if there is one."""
+    try:
+        os.remove(_staging_path(key))
+    except FileNotFoundError:
+        return
+    print_debug("Staged file removed.\n\tKey: %s", key)
+
+
+def compute_staged_digest(key: str) -> str:
+    """Return the digest of the content staged under a key."""
+    with open(_staging_path(key), "rb") as f:
+        return compute_digest(f)
+
+
+def link_local_file(filename: str, digest: str) -> bool:
+    """
+    Save a file to storage from content that is already stored, given its digest.
+    Return False if no stored content has this digest. Raise FileExistsError if the file already exists,
+    DigestError if the digest is malformed, and DurabilityError if syncing the file's name fails.
+    """
+    filepath = _backend.prepare_filepath(filename)
+    if _content_store is None or not _content_store.link(digest, filepath):
+        return False
+    discard_variants(filename)
+    _catalog_file(filename, digest)
+    _sync_name(filepath)
+    return True
+
+
+def get_local_digest(filename: str) -> str | None:
+    """
+    Return the digest of a stored file's content, which identifies this version of the file to clients.
+    It is kept in the catalog, and computed the first time for files catalogued without one, such as those found by
+    the scan. Return None if no catalog is open to keep it. Raise FileNotFoundError if the file is missing.
+    """
+    if _catalog is None:
+        return None
+    entry = _catalog.get(filename)
+    if entry is not None and entry.digest is not None:
+        return entry.digest
+    with _backend.open(filename) as f:
+        digest = compute_digest(f)
+    _catalog_file(filename, digest)
+    print_debug("Computed the digest of '%s'.\n\tDigest: %s", filename, digest)
+    return digest
+
+
+def get_perceptual_hash(filename: str) -> int | None:
+    """
+    Return the perceptual hash recorded for a stored image, or None if it is not known.
+    Raise FileNotFoundError if the file is missing.
+    """
+    _backend.stat(filename)
+    entry = _catalog.get(filename) if _catalog is not None else None
+    return entry.perceptual_hash if entry is not None else None
+
+
+def record_perceptual_hash(filename: str, perceptual_hash: int) -> None:
+    """
+    Record the perceptual hash of a stored image in the catalog, if one is open.
+    Raise FileNotFoundError if the file is missing.
+    """
+    _catalog_file(filename, perceptual_hash=perceptual_hash)
+
+
+def list_unhashed_images() -> list[str]:
+    """Return the names of the catalogued images whose perceptual hashes are not recorded."""
+    if _catalog is None:
+        return []
+    entries, _ = _catalog.list_page()
+    return [entry.name for entry in entries if entry.perceptual_hash is None and is_image_file(entry.name)]
+
+
+def find_similar_files(perceptual_hash: int, limit: int, exclude: str | None = None) -> list[SimilarFile]:
+    """
+    Return up to limit stored images whose perceptual hashes are nearest a hash, nearest first, leaving out the
+    file named exclude. Images hashed by other processes sharing the catalog are included. The similarity index
+    must be open.
+    """
+    assert _catalog is not None and _similarity_index is not None
+    _catalog.refresh()
+    return _similarity_index.search(perceptual_hash, limit, exclude)
 
 
 def get_local_file(filename: str) -> bytes:
-    """Retrieve a file from the current working directory. Raise FileNotFoundError if the file is missing."""
-    file = get_file(_full_path(filename))
-    print_debug(f"File retrieved successfully.\n\tPath: {_full_path(filename)}")
+    """Retrieve a file from storage. Raise FileNotFoundError if the file is missing."""
+    file = get_file(_backend.get_filepath(filename))
+    if debug_enabled():
+        print_debug("File retrieved successfully.\n\tPath: %s", _backend.get_filepath(filename))
     return file
 
 
-def get_local_list() -> list[str]:
-    return os.listdir(os.getcwd())
+def open_local_file(filename: str) -> BufferedReader:
+    """Open a file in storage for streaming. Raise FileNotFoundError if the file is missing."""
+    f = _backend.open(filename)
+    print_debug("File opened successfully.\n\tPath: %s", f.name)
+    return f
+
+
+def get_variant_path(filename: str, variant: str) -> str:
+    """
+    Return the path at which a variant of a stored file, derived from it and named by variant, is cached.
+    The path is keyed by the file's size and modification time, so a file that changes never serves a stale variant.
+    Raise FileNotFoundError if the file is missing.
+    """
+    stat = _backend.stat(filename)
+    _, extension = os.path.splitext(filename)
+    return os.path.join(_variants_path(filename), f"{variant}-{stat.st_mtime_ns}-{stat.st_size}{extension.lower()}")
+
+
+def discard_variants(filename: str, variant: str | None = None, keep_path: str | None = None) -> None:
+    """Remove the cached variants of a file, or only those named by variant, except the one at keep_path."""
+    variants_path = _variants_path(filename)
+    try:
+        variant_names = os.listdir(variants_path)
+    except FileNotFoundError:
+        return
+    for variant_name in variant_names:
+        variant_path = os.path.join(variants_path, variant_name)
+        if variant_path != keep_path and (variant is None or variant_name.startswith(f"{variant}-")):
+            try:
+                os.remove(variant_path)
+            except FileNotFoundError:
+                continue  # Removed concurrently by another request or worker.
+            print_debug("Variant removed.\n\tPath: %s", variant_path)
+
+
+def get_local_list(
+    prefix: str = "",
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> tuple[list[CatalogEntry], str | None]:
+    """
+    Return up to limit stored files whose names start with prefix and sort after cursor,
+    with the cursor for the next page, or None if there are no more files.
+    Use the catalog if one is open, otherwise scan the storage.
+    """
+    catalog = _catalog
+    if catalog is None:
+        catalog = Catalog()
+        catalog.scan(_backend.scan())
+    return catalog.list_page(prefix, cursor, limit)
 
 
 def get_image(filepath: str) -> bytes:
@@ -26,21 +368,144 @@ def get_image(filepath: str) -> bytes:
     Retrieve an image file (.jpg, .jpeg, .png) from the current working directory.
     Raises ValueError if the file is not one of the allowed image types.
     """
-    _VALID_EXTENSIONS = {".jpg", ".jpeg", ".png"}
-
-    _, extension = os.path.splitext(filepath)
-    if extension.lower() not in _VALID_EXTENSIONS:
-        raise ValueError(f"Invalid image type '{extension}'. Allowed types are: {', '.join(_VALID_EXTENSIONS)}.")
+    _validate_image_extension(filepath)
     return get_file(filepath)
 
 
+def open_image(filepath: str) -> BufferedReader:
+    """
+    Open an image file (.jpg, .jpeg, .png) for streaming.
+    Raises ValueError if the file is not one of the allowed image types.
+    """
+    _validate_image_extension(filepath)
+    return open_file(filepath)
+
+
 def get_file(filepath: str) -> bytes:
     """Read a file into bytes. Raise FileNotFoundError if the file is missing."""
     with open(filepath, "rb") as f:
         file = f.read()
-    print_debug(f"File read successfully.\n\tPath: {filepath}")
+    print_debug("File read successfully.\n\tPath: %s", filepath)
     return file
 
 
-def _full_path(filename: str) -> str:
-    return os.path.join(os.getcwd(), filename)
+def open_file(filepath: str) -> BufferedReader:
+    """Open a file for reading in binary mode. Raise FileNotFoundError if the file is missing."""
+    f = open(filepath, "rb")
+    print_debug("File opened successfully.\n\tPath: %s", filepath)
+    return f
+
+
+def get_file_size(file: BufferedReader) -> int:
+    """Return the size in bytes of an open file."""
+    return os.fstat(file.fileno()).st_size
+
+
+def is_compressed_image(filepath: str) -> bool:
+    """Return whether a file is of an image type whose content is always compressed, judging by its extension."""
+    _, extension = os.path.splitext(filepath)
+    return extension.lower() in _COMPRESSED_EXTENSIONS
+
+
+def is_image_file(filepath: str) -> bool:
+    """Return whether a file is one of the allowed image types, judging by its extension."""
+    _, extension = os.path.splitext(filepath)
+    return extension.lower() in _VALID_EXTENSIONS
+
+
+def _validate_image_extension(filepath: str) -> None:
+    """Raise ValueError if the file is not one of the allowed image types."""
+    if not is_image_file(filepath):
+        _, extension = os.path.splitext(filepath)
+        raise ValueError(f"Invalid image type '{extension}'. Allowed types are: {', '.join(_VALID_EXTENSIONS)}.")
+
+
+def _record_saved_file(filename: str, digest: str | None = None) -> None:
+    """
+    Deduplicate the content of a newly saved file and record it in the catalog, if they are open,
+    and drop any variants cached from an earlier file of the same name.
+    The digest of the content is computed unless it is given.
+    """
+    discard_variants(filename)
+    if _content_store is not None:
+        filepath = _backend.get_filepath(filename)
+        if digest is None:
+            with open(filepath, "rb") as f:
+                digest = compute_digest(f)
+        try:
+            _content_store.add(filepath, digest)
+        except OSError as e:
+            # The file stays as it is, which is correct, merely not shared.
+            print_error(f"Cannot deduplicate '{filename}': {e}.")
+    _catalog_file(filename, digest)
+
+
+def _catalog_file(filename: str, digest: str | None = None, perceptual_hash: int | None = None) -> None:
+    """
+    Record a saved file in the catalog, if one is open. The digest and perceptual hash already recorded are kept
+    unless given, as long as the file's size and modification time are unchanged.
+    """
+    if _catalog is None:
+        return
+    stat = _backend.stat(filename)
+    with _catalog_update_lock:
+        known = _catalog.get(filename)
+        if known is not None and known.size == stat.st_size and known.mtime == stat.st_mtime:
+            digest = digest or known.digest
+            perceptual_hash = known.perceptual_hash if perceptual_hash is None else perceptual_hash
+        _catalog.add(make_entry(filename, stat.st_size, stat.st_mtime, digest, perceptual_hash))
+
+
+def _sync_name(filepath: str) -> None:
+    """
+    Sync the directory entry of a newly saved file, if a syncer is set, and that of its directory if it is in a
+    subdirectory of the storage directory, which may have been created for it.
+    """
+    if _syncer is None:
+        return
+    directory = os.path.dirname(os.path.abspath(filepath))
+    storage_directory = os.path.abspath(_backend.directory)
+    _syncer.sync({directory, storage_directory})
+
+
+def lock_metadata_file(name: str) -> BufferedWriter | None:
+    """
+    Open a file in the metadata directory and lock it against other processes, for as long as it is open.
+    Return None if another process holds the lock. Without fcntl, processes do not exclude each other.
+    """
+    os.makedirs(_metadata_path(), exist_ok=True)
+    f = open(_metadata_path(name), "ab")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
+
+
+def _lock_staged_file(f: BufferedWriter, key: str) -> None:
+    """
+    Lock an open staged file against other processes, until it is closed. Raise StagingError if one holds the lock.
+    Without fcntl, only transfers within this process exclude each other.
+    """
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise StagingError(f"Another transfer of '{key}' is in progress.")
+
+
+def _variants_path(filename: str) -> str:
+    """Return the directory caching the variants of a file, named by a hash so that any filename is safe."""
+    return _metadata_path(_VARIANTS_DIRECTORY, hashlib.sha256(filename.encode()).hexdigest())
+
+
+def _staging_path(key: str) -> str:
+    return _metadata_path(_STAGING_DIRECTORY, key)
+
+
+def _metadata_path(*names: str) -> str:
+    """Return the path of an entry in the metadata directory, which lives in the storage directory."""
+    return os.path.join(_backend.directory, METADATA_DIRECTORY, *names)
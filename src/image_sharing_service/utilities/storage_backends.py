@@ -0,0 +1,136 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from io import BufferedReader, BufferedWriter
+from typing import Iterator
+
+# Storage layouts
+FLAT_LAYOUT = "flat"
+SHARDED_LAYOUT = "sharded"
+LAYOUTS = (FLAT_LAYOUT, SHARDED_LAYOUT)
+
+# One level of 256 directories keeps them to ~4000 files per million stored, well within what indexed directories
+# handle at a flat cost. More directories cost more on writes, since each file then lands in a directory that is
+# rarely in cache.
+_SHARD_WIDTH = 2  # Hex digits per directory level
+_SHARD_DEPTH = 1  # Directory levels above each file
+_SHARD_HASH_SIZE = (_SHARD_WIDTH * _SHARD_DEPTH + 1) // 2  # Bytes of name hash needed for every level
+
+
+class StorageBackend(ABC):
+    """
+    Where the files of a storage directory live on disk.
+    Subclasses decide the path of each file and how to enumerate them; reading and writing go through those paths.
+    A directory of None means the current working directory at the time of each call.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        self._directory = directory
+
+    @property
+    def directory(self) -> str:
+        return self._directory or os.getcwd()
+
+    @abstractmethod
+    def get_filepath(self, filename: str) -> str:
+        """Return the path at which a file is stored."""
+
+    @abstractmethod
+    def scan(self) -> Iterator[tuple[str, os.stat_result]]:
+        """Yield the name and status of every stored file."""
+
+    def prepare_filepath(self, filename: str) -> str:
+        """Return the path at which a file is stored, creating any directories it needs."""
+        return self.get_filepath(filename)
+
+    def save(self, filename: str, data: bytes) -> str:
+        """Store a new file. Raise FileExistsError if it already exists. Return its path."""
+        with self.create(filename) as f:
+            f.write(data)
+        return self.get_filepath(filename)
+
+    def create(self, filename: str) -> BufferedWriter:
+        """Create a new file to be written. Raise FileExistsError if it already exists."""
+        return open(self.prepare_filepath(filename), "xb")
+
+    def open(self, filename: str) -> BufferedReader:
+        """Open a stored file for reading. Raise FileNotFoundError if it is missing."""
+        return open(self.get_filepath(filename), "rb")
+
+    def stat(self, filename: str) -> os.stat_result:
+        """Return the status of a stored file. Raise FileNotFoundError if it is missing."""
+        return os.stat(self.get_filepath(filename))
+
+    def remove(self, filename: str) -> None:
+        """Remove a stored file. Raise FileNotFoundError if it is missing."""
+        os.remove(self.get_filepath(filename))
+
+
+class FlatBackend(StorageBackend):
+    """Every file directly in the storage directory, named as it was uploaded."""
+
+    def get_filepath(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def scan(self) -> Iterator[tuple[str, os.stat_result]]:
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if dir_entry.is_file(follow_symlinks=False):
+                    yield dir_entry.name, dir_entry.stat(follow_symlinks=False)
+
+
+class ShardedBackend(StorageBackend):
+    """
+    Every file in a subdirectory chosen by the hash of its name,
+    so that no directory grows large as the number of files stored grows.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        super().__init__(directory)
+        self._prepared_shards: set[str] = set()
+
+    def get_filepath(self, filename: str) -> str:
+        return os.path.join(self.directory, *_get_shards(filename), filename)
+
+    def prepare_filepath(self, filename: str) -> str:
+        filepath = self.get_filepath(filename)
+        shard_path = os.path.dirname(filepath)
+        # Creating a directory that exists still costs a system call, so remember the ones already created.
+        if shard_path not in self._prepared_shards:
+            os.makedirs(shard_path, exist_ok=True)
+            self._prepared_shards.add(shard_path)
+        return filepath
+
+    def scan(self) -> Iterator[tuple[str, os.stat_result]]:
+        yield from self._scan_level(self.directory, _SHARD_DEPTH)
+
+    def _scan_level(self, path: str, remaining_depth: int) -> Iterator[tuple[str, os.stat_result]]:
+        """Yield the files below a shard directory, descending only into shard directories."""
+        with os.scandir(path) as it:
+            for dir_entry in it:
+                if remaining_depth == 0:
+                    if dir_entry.is_file(follow_symlinks=False):
+                        yield dir_entry.name, dir_entry.stat(follow_symlinks=False)
+                elif dir_entry.is_dir(follow_symlinks=False) and _is_shard_name(dir_entry.name):
+                    yield from self._scan_level(dir_entry.path, remaining_depth - 1)
+
+
+def create_backend(layout: str, directory: str | None = None) -> StorageBackend:
+    """Return the backend storing files in a layout. Raise ValueError if the layout is not supported."""
+    backends: dict[str, type[StorageBackend]] = {
+        FLAT_LAYOUT: FlatBackend,
+        SHARDED_LAYOUT: ShardedBackend,
+    }
+    if layout not in backends:
+        raise ValueError(f"Storage layout must be one of: {', '.join(LAYOUTS)}.")
+    return backends[layout](directory)
+
+
+def _get_shards(filename: str) -> list[str]:
+    """Return the shard directories of a file, taken from the hash of its name."""
+    name_hash = hashlib.blake2b(filename.encode(), digest_size=_SHARD_HASH_SIZE).hexdigest()
+    return [name_hash[i * _SHARD_WIDTH:(i + 1) * _SHARD_WIDTH] for i in range(_SHARD_DEPTH)]
+
+
+def _is_shard_name(name: str) -> bool:
+    return len(name) == _SHARD_WIDTH and all(c in "0123456789abcdef" for c in name)